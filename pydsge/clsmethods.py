@@ -4,10 +4,11 @@
 import os
 import numpy as np
 import pandas as pd
-from .stats import summary, gfevd, mbcs_index, nhd, mdd
+from .stats import summary, gfevd, mbcs_index, nhd, mdd, hessian, mode_cov
 from .plots import posteriorplot, traceplot
-from .mcmc import mcmc, tmcmc
-from .modesearch import cmaes
+from .mcmc import mcmc, tmcmc, smc
+from .modesearch import cmaes, islands
+from .emulator import emulate
 from .filtering import *
 from .tools import *
 from .mpile import *
@@ -44,23 +45,63 @@ def oix(self, observables):
     return [list(self.observables).index(v) for v in observables]
 
 
-def get_eps_lin(self, x, xp, rcond=1e-14):
-    """Get filter-implied (smoothed) shocks for linear model
+def get_lin_sys(self, rcond=None):
+    """Get the transition matrix `F` and the shock loadings `E` of the linear model
+
+    The matrices are only calculated once per parameter set and cached on the model. The cache is invalidated whenever the system matrices are recompiled (i.e. by `set_par`).
+
+    Parameters
+    ----------
+    rcond : float, optional
+        If given, additionally return the pseudo-inverse of `E` with this cutoff.
+
+    Returns
+    -------
+    tuple
+        `F` and `E` (and the pseudo-inverse of `E` if `rcond` is given)
     """
 
-    qmat = self.precalc_mat[1]
+    fname = self.filter.name
+
+    try:
+        key, cache = self.lin_sys_cache
+        if key[0] is not self.precalc_mat or key[1] != fname:
+            raise AttributeError
+    except AttributeError:
+
+        pmat, qmat = self.precalc_mat[:2]
+
+        if fname == 'KalmanFilter':
+            F = np.vstack((pmat[1, 0][:, :-self.neps],
+                           qmat[1, 0][:-self.neps, :-self.neps]))
+            F = np.pad(F, ((0, 0), (self.dimp, 0)))
+            E = np.vstack((pmat[1, 0][:, -self.neps:],
+                           qmat[1, 0][:-self.neps, -self.neps:]))
+        else:
+            F = qmat[1, 0][:, :-self.neps]
+            E = qmat[1, 0][:, -self.neps:]
 
-    if self.filter.name == 'KalmanFilter':
-        pmat = self.precalc_mat[0]
-        F = self.filter.F
-        E = np.vstack((pmat[1, 0][:, -self.neps:],
-                       qmat[1, 0][:-self.neps, -self.neps:]))
+        cache = {'F': F, 'E': E}
+        self.lin_sys_cache = (self.precalc_mat, fname), cache
 
-    else:
-        F = qmat[1, 0][:, :-self.neps]
-        E = qmat[1, 0][:, -self.neps:]
+    if rcond is None:
+        return cache['F'], cache['E']
+
+    if rcond not in cache:
+        cache[rcond] = np.linalg.pinv(cache['E'], rcond)
 
-    return np.linalg.pinv(E, rcond) @ (x - F@xp)
+    return cache['F'], cache['E'], cache[rcond]
+
+
+def get_eps_lin(self, x, xp, rcond=1e-14):
+    """Get filter-implied (smoothed) shocks for linear model
+
+    Vectorized: `x` and `xp` can also be arrays of states (e.g. the complete smoothed path), in which case all shocks are recovered at once.
+    """
+
+    F, _, E_inv = get_lin_sys(self, rcond)
+
+    return (x - xp @ F.T) @ E_inv.T
 
 
 @property
@@ -72,7 +113,18 @@ def get_tune(self):
         return self.fdict['tune']
 
 
-def get_chain(self, get_acceptance_fraction=False, get_log_prob=False, backend_file=None, flat=None):
+def get_chain(self, get_acceptance_fraction=False, get_log_prob=False, backend_file=None, flat=None, tail=None, thin=1, walkers=None):
+    """Get the chain of the sampler (or of the backend file)
+
+    Parameters
+    ----------
+    tail : int, optional
+        Only get the last `tail` iterations. Only these are read from the backend file, which is much faster for long chains. Defaults to the full chain
+    thin : int, optional
+        Only get every `thin`-th iteration. Defaults to 1
+    walkers : int, slice or array, optional
+        Only get the chains of these walkers. Defaults to all walkers
+    """
 
     if not backend_file:
         if hasattr(self, 'sampler'):
@@ -97,12 +149,22 @@ def get_chain(self, get_acceptance_fraction=False, get_log_prob=False, backend_f
         except:
             return reader.accepted / reader.iteration
 
+    # the backends only read the requested iterations from disk
+    discard = max(reader.iteration - tail, 0) if tail else 0
+    args = dict(discard=discard, thin=thin)
+
     if get_log_prob:
-        return reader.get_log_prob(flat=flat)
+        chain = reader.get_log_prob(**args)
+    else:
+        chain = self.bjfunc(reader.get_chain(**args))
 
-    chain = reader.get_chain(flat=flat)
+    if walkers is not None:
+        chain = chain[:, walkers]
 
-    return self.bjfunc(chain)
+    if flat:
+        chain = chain.reshape((-1,) + chain.shape[2:])
+
+    return chain
 
 
 def get_log_prob(self, **args):
@@ -239,6 +301,18 @@ def mode_summary(self, data_cmaes=None, verbose=True):
     except (TypeError, KeyError, IndexError):
         pass
 
+    try:
+        # standard errors from the hessian, if it was calculated at the mode
+        x_hess, hess = self.fdict['hessian'][:2]
+        if np.array_equal(x_hess, self.fdict['mode_x']):
+            mode = list(self.fdict['mode_x']) + [float(self.fdict['mode_f'])]
+            if mode not in df_inp.values():
+                df_inp['mode'] = mode
+            df_inp['mode: s.e.'] = list(
+                np.sqrt(np.diag(np.linalg.inv(-hess)))) + [np.nan]
+    except (KeyError, np.linalg.LinAlgError):
+        pass
+
     df = pd.DataFrame(df_inp)
     df.index = self.prior_names + ['loglike']
 
@@ -262,7 +336,7 @@ def swarm_summary(self, verbose=True, **args):
 def mcmc_summary(self, chain=None, tune=None, calc_mdd=True, calc_ll_stats=False, calc_maf=True, out=print, verbose=True, **args):
 
     try:
-        chain = self.get_chain() if chain is None else chain
+        chain = self.get_chain(tail=tune or self.get_tune) if chain is None else chain
     except AttributeError:
         raise AttributeError('[summary:]'.ljust(
             15, ' ') + "No chain to be found...")
@@ -271,7 +345,7 @@ def mcmc_summary(self, chain=None, tune=None, calc_mdd=True, calc_ll_stats=False
 
     chain = chain[-tune:]
     nchain = chain.reshape(-1, chain.shape[-1])
-    lprobs = self.get_log_prob()[-tune:]
+    lprobs = self.get_log_prob(tail=tune)
     lprobs = lprobs.reshape(-1, lprobs.shape[-1])
     mode_x = nchain[lprobs.argmax()]
 
@@ -310,8 +384,8 @@ def posterior2csv(self, path=None, tune=None, **args):
     tune = tune or self.get_tune
     path = path or os.path.join(self.path, self.name+'_posterior.csv')
 
-    chain = self.get_chain()
-    post = chain[-tune:].reshape(-1,chain.shape[-1])
+    chain = self.get_chain(tail=tune)
+    post = chain.reshape(-1,chain.shape[-1])
 
     vd = pd.DataFrame(post.T, index=self.prior_names)
     vd.to_csv(path)
@@ -360,6 +434,8 @@ def load_data(self, df, start=None, end=None):
     ...
     This function takes a provided `pandas.DataFrame`, reads out the observables as they are defined in the YAML-file, and ajusts it regarding the `start` and `end` keywords. Using a `pandas.DatetimeIndex` as index of the DataFrame is strongly encuraged as it can be very powerful, but not necessary.
 
+Missing observations (NaNs) are allowed and handled by the filters. This covers mixed-frequency and ragged-edge data.
+
     Parameters
     ----------
     df : pandas.DataFrame
@@ -394,6 +470,7 @@ def load_data(self, df, start=None, end=None):
     self.data = d
     self.fdict['data'] = cpickle.dumps(d, protocol=4)
     self.fdict['obs'] = self.observables
+    self.revision = getattr(self, 'revision', 0) + 1
 
     return d
 
@@ -407,6 +484,14 @@ def lprob(self, par, linear=None, verbose=False):
     return self.lprob(par, linear=linear, verbose=verbose)
 
 
+def lprob_and_grad(self, par, verbose=False):
+
+    if not hasattr(self, 'ndim'):
+        self.prep_estim(linear=True, load_R=True, verbose=verbose)
+
+    return self.lprob_and_grad(par, verbose=verbose)
+
+
 def bjfunc(self, x):
 
     bnd = np.array(self.fdict['prior_bounds'])
@@ -438,14 +523,18 @@ def get_sample(self, size, chain=None):
     """Get a (preferably recent) sample from the chain
     """
 
-    chain = None or self.get_chain()
+    if chain is None:
+        nwalks = self.get_chain(tail=1).shape[1]
+        recent = int(np.ceil(60 / nwalks))
+        chain = self.get_chain(tail=recent)
+
     clen, nwalks, npar = chain.shape
     recent = int(np.ceil(60 / nwalks))
 
     if recent > clen:
         raise Exception("Requested sample size is larger than chain")
 
-    sample = chain[:, -recent, :].reshape(-1, npar)
+    sample = chain[-recent:].reshape(-1, npar)
     res = np.random.choice(np.arange(recent*nwalks), size, False)
 
     return sample[res]
@@ -456,17 +545,23 @@ DSGE_RAW.oix = oix
 DSGE_RAW.get_tune = get_tune
 DSGE_RAW.save = save_meta
 DSGE_RAW.mapper = mapper
+DSGE_RAW.batch_map = batch_map
 DSGE_RAW.mode_summary = mode_summary
 DSGE_RAW.swarm_summary = swarm_summary
 DSGE_RAW.mcmc_summary = mcmc_summary
 DSGE_RAW.info = info_m
 DSGE_RAW.mdd = mdd
+DSGE_RAW.hessian = hessian
+DSGE_RAW.mode_cov = mode_cov
 DSGE_RAW.get_data = load_data
 DSGE_RAW.load_data = load_data
 DSGE_RAW.rjfunc = rjfunc
 DSGE_RAW.bjfunc = bjfunc
 DSGE_RAW.get_sample = get_sample
 DSGE_RAW.create_pool = create_pool
+DSGE_RAW.get_pool = get_pool
+DSGE_RAW.__enter__ = enter_pool
+DSGE_RAW.__exit__ = exit_pool
 DSGE_RAW.posterior2csv = posterior2csv
 # from mpile
 DSGE_RAW.get_par = get_par
@@ -482,21 +577,30 @@ DSGE_RAW.simulate = simulate
 DSGE_RAW.shock2state = shock2state
 DSGE_RAW.obs = o_func
 DSGE_RAW.get_eps_lin = get_eps_lin
+DSGE_RAW.get_lin_sys = get_lin_sys
 DSGE_RAW.k_map = k_map
 DSGE_RAW.traj = traj
 # from mcmc
 DSGE_RAW.mcmc = mcmc
 DSGE_RAW.tmcmc = tmcmc
+DSGE_RAW.smc = smc
 # from estimation
 DSGE_RAW.prep_estim = prep_estim
 DSGE_RAW.load_estim = prep_estim
 DSGE_RAW.lprob = lprob
+DSGE_RAW.lprob_and_grad = lprob_and_grad
+DSGE_RAW.lprob_stats = lprob_stats
+DSGE_RAW.lprob_timeouts = lprob_timeouts
 # from modesearch
 DSGE_RAW.cmaes = cmaes
+DSGE_RAW.islands = islands
+DSGE_RAW.emulate = emulate
 # from filter
 DSGE_RAW.create_filter = create_filter
 DSGE_RAW.run_filter = run_filter
 DSGE_RAW.get_ll = get_ll
+DSGE_RAW.get_ll_and_grad = get_ll_and_grad
+DSGE_RAW.get_ll_batch = get_ll_batch
 # from plot
 DSGE_RAW.traceplot = traceplot_m
 DSGE_RAW.posteriorplot = posteriorplot_m
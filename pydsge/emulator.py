@@ -0,0 +1,263 @@
+#!/bin/python
+# -*- coding: utf-8 -*-
+
+"""contains a Gaussian process emulator of the posterior that is used to warm-start the mode search
+"""
+
+import time
+import numpy as np
+import scipy.linalg as sl
+import scipy.optimize as so
+from grgrlib.core import timeprint
+
+
+class GPEmulator(object):
+    """Gaussian process regression with an anisotropic squared-exponential kernel
+
+    The hyperparameters (length scales, signal and noise variance) are fitted by maximizing the marginal likelihood. Meant to be used on the unit hypercube spanned by the prior bounds.
+
+    Parameters
+    ----------
+    floor : float, optional
+        Percentile of the finite target values below which all values (including -inf) are censored. The emulator should be accurate close to the mode, and not waste its flexibility on the tails. Defaults to 20
+    jitter : float, optional
+        Added to the diagonal of the covariance for numerical stability. Defaults to 1e-8
+    """
+
+    def __init__(self, floor=20, jitter=1e-8):
+
+        self.floor = floor
+        self.jitter = jitter
+        self.theta = None
+
+    def kernel(self, X1, X2, theta, get_dist=False):
+
+        ls = np.exp(theta[:-2])
+
+        if get_dist:
+            dist = ((X1[:, None, :] - X2[None, :, :])/ls)**2
+            return np.exp(theta[-2])*np.exp(-.5*np.sum(dist, axis=-1)), dist
+
+        # avoids the (n1, n2, ndim) array of distances
+        X1, X2 = X1/ls, X2/ls
+        sqdist = np.sum(X1**2, axis=1)[:, None] + \
+            np.sum(X2**2, axis=1) - 2*X1 @ X2.T
+
+        return np.exp(theta[-2])*np.exp(-.5*np.maximum(sqdist, 0))
+
+    def neg_mll(self, theta, X, y):
+        """Negative log marginal likelihood (up to a constant) and its gradient w.r.t. the log-hyperparameters
+        """
+
+        K, dist = self.kernel(X, X, theta, get_dist=True)
+        noise = np.exp(theta[-1])
+
+        try:
+            L = np.linalg.cholesky(
+                K + (noise + self.jitter)*np.eye(len(X)))
+        except np.linalg.LinAlgError:
+            return 1e10, np.zeros_like(theta)
+
+        alpha = sl.cho_solve((L, True), y)
+        nll = .5*y @ alpha + np.sum(np.log(np.diag(L)))
+
+        # d nll = -tr((alpha alpha' - K^-1) dK)/2
+        W = sl.cho_solve((L, True), np.eye(len(X))) - np.outer(alpha, alpha)
+        WK = W*K
+        grad = np.hstack((.5*np.einsum('ij,ijk->k', WK, dist),
+                          .5*np.sum(WK), .5*noise*np.trace(W)))
+
+        return nll, grad
+
+    def cov(self, X, theta):
+        return self.kernel(X, X, theta) + (np.exp(theta[-1]) + self.jitter)*np.eye(len(X))
+
+    def fit(self, X, y, optimize=True):
+        """Fit the emulator to the points `X` of shape (n, ndim) and the values `y` of shape (n,)
+
+        If `optimize` is False, the previous hyperparameters are kept.
+        """
+
+        X = np.atleast_2d(X)
+        y = np.array(y, dtype=float)
+
+        finite = np.isfinite(y)
+        if not finite.any():
+            raise ValueError('[emulator:]'.ljust(15, ' ') +
+                             ' No finite values to fit the emulator to.')
+
+        y = np.maximum(np.where(finite, y, -np.inf),
+                       np.percentile(y[finite], self.floor))
+
+        self.mean = y.mean()
+        self.scale = y.std() or 1.
+        yn = (y - self.mean)/self.scale
+
+        ndim = X.shape[1]
+        if self.theta is None or len(self.theta) != ndim + 2:
+            self.theta = np.hstack((np.full(ndim, np.log(.3)), 0, np.log(1e-2)))
+            optimize = True
+
+        if optimize:
+            bounds = [(np.log(1e-2), np.log(1e1))]*ndim + \
+                [(np.log(1e-2), np.log(1e2)), (np.log(1e-8), 0)]
+            res = so.minimize(self.neg_mll, self.theta, args=(
+                X, yn), jac=True, method='L-BFGS-B', bounds=bounds)
+            self.theta = res.x
+
+        self.X = X
+        self.L = np.linalg.cholesky(self.cov(X, self.theta))
+        self.alpha = sl.cho_solve((self.L, True), yn)
+
+        return self
+
+    def predict(self, X, return_std=False):
+        """Predictive mean (and standard deviation) at the points `X`
+        """
+
+        X = np.atleast_2d(X)
+        Ks = self.kernel(X, self.X, self.theta)
+
+        mean = Ks @ self.alpha*self.scale + self.mean
+
+        if not return_std:
+            return mean
+
+        v = sl.solve_triangular(self.L, Ks.T, lower=True)
+        var = np.exp(self.theta[-2]) - np.sum(v**2, axis=0)
+
+        return mean, np.sqrt(np.maximum(var, 0))*self.scale
+
+    @property
+    def lengthscales(self):
+        return np.exp(self.theta[:-2])
+
+
+def latin_hypercube(n, ndim):
+    """Latin hypercube sample of size `n` on the unit hypercube
+    """
+
+    perms = np.argsort(np.random.rand(ndim, n), axis=1).T
+
+    return (perms + np.random.rand(n, ndim))/n
+
+
+def propose(gp, X, y, batch, kappa, ncands=2000):
+    """Choose a batch of new points by maximizing the upper confidence bound of the emulator
+
+    The candidates are uniform draws from the hypercube and local perturbations of the best points so far. Once a point is chosen, candidates within one length scale of it are dropped, such that the batch is spread out. Returns the chosen points and the number of candidates.
+    """
+
+    ndim = X.shape[1]
+    best = X[np.argsort(-np.where(np.isfinite(y), y, -np.inf))[:5]]
+
+    local = best[np.random.randint(len(best), size=ncands)] + \
+        .05*np.random.randn(ncands, ndim)
+    cands = np.vstack((np.random.rand(ncands, ndim), np.clip(local, 0, 1)))
+
+    mean, std = gp.predict(cands, return_std=True)
+    ucb = mean + kappa*std
+
+    chosen = []
+    for _ in range(batch):
+        i = np.argmax(ucb)
+        if not np.isfinite(ucb[i]):
+            break
+        chosen.append(cands[i])
+        close = np.sum(((cands - cands[i])/gp.lengthscales)**2, axis=1) < 1
+        ucb[close] = -np.inf
+
+    return np.array(chosen), len(cands)
+
+
+def emulate(self, nevals=None, ninit=None, batch=None, kappa=2., p0=None, linear=None, lprob_seed=None, seed=None, verbose=True):
+    """Explore the posterior with a Gaussian process emulator in order to warm-start the mode search
+
+    After an initial Latin hypercube design, the emulator is fitted to all evaluated points and proposes batches of new points by the upper confidence bound of `lprob`. All calculations are done on the unit hypercube spanned by the prior bounds, as in `cmaes`.
+
+    Parameters
+    ----------
+    nevals : int, optional
+        Number of evaluations of `lprob`. Defaults to 20 times the number of parameters
+    ninit : int, optional
+        Size of the initial design. Defaults to a quarter of `nevals`
+    batch : int, optional
+        Number of points proposed in each iteration. Defaults to the number of workers of the pool
+    kappa : float, optional
+        Weight of the predictive standard deviation in the acquisition function. Defaults to 2
+    p0 : array, optional
+        Parameters that are added to the initial design. Defaults to the prior mean
+
+    Returns
+    -------
+    tuple
+        The best point and an estimate of its uncertainty (both on the unit hypercube), and the number of evaluations
+    """
+
+    from .mpile import get_par
+    from .parallel import WorkerTask
+    from .modesearch import neg_lprob_unit
+
+    st = time.time()
+    np.random.seed(seed or self.fdict['seed'])
+
+    ndim = self.ndim
+    nevals = nevals or 20*ndim
+    ninit = ninit or max(nevals//4, ndim + 1)
+
+    if batch is None:
+        batch = self.pool.ncpus if getattr(
+            self, 'pool', None) is not None and not self.debug else 1
+
+    bnd = np.array(self.fdict['prior_bounds'])
+    p0 = get_par(self, 'adj_prior_mean', full=False,
+                 asdict=False) if p0 is None else p0
+
+    lprob_unit = WorkerTask(self, neg_lprob_unit,
+                            linear=linear, lprob_seed=lprob_seed or 'set')
+
+    def evaluate(xs):
+        return -np.fromiter(self.mapper(lprob_unit, xs), dtype=float, count=len(xs))
+
+    X = np.vstack(((p0 - bnd[0])/(bnd[1] - bnd[0]),
+                   latin_hypercube(ninit - 1, ndim)))
+    y = evaluate(X)
+
+    gp = GPEmulator()
+    nscreened = 0
+    nfitted = 0
+
+    while len(X) < nevals:
+
+        # the hyperparameters are only updated once the sample grew by 10%
+        optimize = len(X) >= 1.1*nfitted
+        gp.fit(X, y, optimize=optimize)
+        if optimize:
+            nfitted = len(X)
+        Xn, ncands = propose(gp, X, y, min(batch, nevals - len(X)), kappa)
+        nscreened += ncands
+
+        if not len(Xn):
+            break
+
+        X = np.vstack((X, Xn))
+        y = np.hstack((y, evaluate(Xn)))
+
+        if verbose > 1:
+            print('[emulator:]'.ljust(15, ' ') + ' %s evaluations, best value is %s.' %
+                  (len(X), np.round(np.max(y), 4)))
+
+    self.emulator = gp.fit(X, y)
+    self.fdict['emulator_history'] = y, X*(bnd[1] - bnd[0]) + bnd[0]
+
+    # the spread of the best points serves as initial step size
+    order = np.argsort(-y)
+    x_best = X[order[0]]
+    sigma = np.clip(np.mean(np.std(X[order[:max(len(X)//10, 2)]], axis=0)), .02, .25)
+
+    if verbose:
+        print('[emulator:]'.ljust(15, ' ') + ' Best value of %s after %s evaluations (%s candidates screened by the emulator) in %s.' %
+              (np.round(y[order[0]], 4), len(X), nscreened, timeprint(time.time() - st, 3)))
+
+    return x_best, sigma, len(X)
+
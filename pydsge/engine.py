@@ -233,6 +233,106 @@ def t_func_jit(pmat, pterm, qmat, qterm, bmat, bterm, x_bar, hxp, hxq, hxc, stat
     return p_or_obs, q, l, k, flag
 
 
+@njit(cache=True, nogil=True)
+def girf_jit(pmat, pterm, qmat, qterm, bmat, bterm, x_bar, hxp, hxq, hxc, states, resids, horizon, linear):
+    """jitted generalized impulse responses
+
+    For each initial state, the paths after each single shock in `resids` and the baseline path without shock are simulated for `horizon` periods, following the conventions of `irfs`. Returns the differences to the baseline at the horizon as an array of shape (nstates, nshocks, dimx).
+    """
+
+    nstates, dimeps = resids.shape
+    dimp = pmat.shape[2]
+    dimx = dimp + qmat.shape[2]
+
+    girfs = np.empty((nstates, dimeps, dimx))
+    final = np.empty((dimeps + 1, dimx))
+
+    for i in range(nstates):
+        # the last path is the baseline
+        for e in range(dimeps + 1):
+
+            shocks = np.zeros(dimeps)
+            if e < dimeps:
+                shocks[e] = resids[i, e]
+
+            p = np.zeros(dimp)
+            q = states[i].copy()
+            l, k = 0, 0
+
+            for t in range(horizon):
+                if linear:
+                    set_l, set_k = 0, 0
+                elif t == 0 and np.any(shocks):
+                    set_l, set_k = -1, -1
+                elif l:
+                    set_l, set_k = l - 1, k
+                else:
+                    set_l, set_k = 0, max(k - 1, 0)
+
+                p, q, l, k, _ = t_func_jit(
+                    pmat, pterm, qmat, qterm, bmat, bterm, x_bar, hxp, hxq, hxc, q, shocks, set_l, set_k, False)
+                shocks[:] = 0
+
+            final[e, :dimp] = p
+            final[e, dimp:] = q
+
+        for e in range(dimeps):
+            girfs[i, e] = final[e] - final[dimeps]
+
+    return girfs
+
+
+@njit(cache=True, nogil=True)
+def nhd_jit(pmat, pterm, qmat, qterm, bmat, bterm, x_bar, hxp, hxq, hxc, state, resids, linear):
+    """jitted normalized historic decomposition
+
+    The contributions of all shocks are updated at once in each period. The constant terms at the constraint are attributed in proportion to the contribution of each shock to the constraint. Returns the decomposition of shape (nshocks, nobs+1, dimx) and the series of states.
+    """
+
+    nobs, dimeps = resids.shape
+    dimp = pmat.shape[2]
+    dimq = qmat.shape[3]
+    dimx = len(state)
+    dimr = dimq - dimeps
+
+    hd = np.empty((dimeps, nobs + 1, dimx))
+    means = np.empty((nobs + 1, dimx))
+    # the state of each counterfactual, stacked with its shock
+    v = np.zeros((dimeps, dimq))
+
+    means[0] = state
+    for s in range(dimeps):
+        hd[s, 0] = state/dimeps
+
+    if linear:
+        set_l, set_k = 0, 0
+    else:
+        set_l, set_k = -1, -1
+
+    for t in range(nobs):
+
+        p, q, l, k, _ = t_func_jit(pmat, pterm, qmat, qterm, bmat, bterm, x_bar,
+                                   hxp, hxq, hxc, state[dimx-dimr:], resids[t], set_l, set_k, False)
+        state = np.hstack((p, q))
+        means[t+1] = state
+
+        v[:, :dimr] = hd[:, t, dimx-dimr:]
+        for s in range(dimeps):
+            v[s, dimr+s] = resids[t, s]
+
+        hd[:, t+1, :dimp] = v @ pmat[l, k].T
+        hd[:, t+1, dimp:] = v @ qmat[l, k].T
+
+        if k:
+            rcons = v @ bmat[0, l, k]
+            rsum = rcons.sum()
+            if rsum:
+                hd[:, t+1, :dimp] += np.outer(rcons/rsum, pterm[l, k])
+                hd[:, t+1, dimp:] += np.outer(rcons/rsum, qterm[l, k])
+
+    return hd, means
+
+
 @njit(nogil=True, cache=True)
 def find_lk(bmat, bterm, x_bar, q):
     """iteration loop to find (l,k) given state q
@@ -7,12 +7,18 @@ import os
 import pathos
 import time
 import tqdm
-from .stats import get_prior
-from .filtering import get_ll
+from .stats import get_prior, CompiledPrior
+from econsieve import KalmanFilter
+from .filtering import get_ll, get_ll_and_grad, get_ll_batch, check_deadline
 from .mpile import get_par, set_par
+from .parallel import SharedArray, locked
 
+# stages of the rejection pipeline in `lprob`
+lprob_stages = ('bounds', 'prior', 'bk', 'solve',
+                'filter', 'timeout', 'accepted')
 
-def prep_estim(self, N=None, linear=None, load_R=False, seed=None, eval_priors=False, dispatch=False, ncores=None, l_max=3, k_max=16, verbose=True, debug=False, **filterargs):
+
+def prep_estim(self, N=None, linear=None, load_R=False, seed=None, eval_priors=False, dispatch=False, ncores=None, memoize=False, time_budget=None, l_max=3, k_max=16, verbose=True, debug=False, **filterargs):
     """Initializes the tools necessary for estimation
 
     ...
@@ -29,6 +35,10 @@ def prep_estim(self, N=None, linear=None, load_R=False, seed=None, eval_priors=F
         Random seed. Defaults to 0
     dispatch : bool, optional
         Whether to use a dispatcher to create jitted transition and observation functions. Defaults to False.
+    memoize : bool or int, optional
+        Whether to cache the likelihood of evaluated parameter vectors, such that repeated calls of `lprob` with the same parameters (and seed) do not solve and filter again. If an integer, this is the number of cached values (defaults to 10000). The cache is shared by all workers of the pool, and `self.lprob_cache.stats` reports its hit rate. Defaults to False.
+    time_budget : float, optional
+        Maximum wall-clock time in seconds for a single evaluation of the likelihood. The budget is checked after solving the model and in each period of the filter, and evaluations that exceed it return -inf. Their parameters are recorded (see `lprob_timeouts`). Since the solution itself can not be interrupted, pool tasks that take more than twice the budget are killed (see `kill_timeout`). Defaults to no budget.
     verbose : bool/int, optional
         Whether display messages:
             0 - no messages
@@ -39,6 +49,7 @@ def prep_estim(self, N=None, linear=None, load_R=False, seed=None, eval_priors=F
     """
 
     import warnings
+    from .gensys import BKError
 
     # all that should be reproducible
     np.random.seed(seed)
@@ -81,6 +92,15 @@ def prep_estim(self, N=None, linear=None, load_R=False, seed=None, eval_priors=F
         raise AttributeError('[estimation:]'.ljust(
             15, ' ') + "`filter.R` not in `fdict`.")
 
+    if linear:
+        self.linear_filter = self.filter
+    else:
+        # the linear model can be filtered much faster. Used to approximate the likelihood of the nonlinear model
+        self.linear_filter = KalmanFilter(dim_x=self.dimx, dim_z=self.nobs)
+        self.linear_filter.R = self.filter.R
+        self.linear_filter.P *= 1e1
+        self.linear_filter.init_P = self.linear_filter.P
+
     # dry run before the fun beginns
     if np.isinf(get_ll(self, verbose=verbose > 3, dispatch=dispatch)):
         raise ValueError('[estimation:]'.ljust(
@@ -110,9 +130,53 @@ def prep_estim(self, N=None, linear=None, load_R=False, seed=None, eval_priors=F
             print('[estimation:]'.ljust(
                 15, ' ') + ' %s priors detected. Adding parameters to the prior distribution.' % self.ndim)
 
+    # evaluates the whole prior (or batches of it) in one call
+    self.compiled_prior = CompiledPrior(
+        self.fdict['frozen_prior'], self.fdict['prior_bounds'])
+    compiled_prior = self.compiled_prior
+    linear_filter = self.linear_filter
+
+    # number of draws that ended in each stage of `lprob` and the time spent on them. Shared by all workers
+    self.stage_stats = SharedArray(
+        np.zeros((2, len(lprob_stages))), writeable=True)
+    stage_stats = self.stage_stats
+
+    # the last draws that exceeded the time budget
+    self.time_budget = time_budget
+    self.timeout_draws = SharedArray(
+        np.full((100, self.ndim), np.nan), writeable=True)
+    timeout_draws = self.timeout_draws
+
+    def record(stage, st, parameters=None):
+
+        i = lprob_stages.index(stage)
+
+        with locked():
+            if parameters is not None:
+                # ring buffer indexed by the number of draws in this stage
+                count = int(stage_stats.array[0, i])
+                timeout_draws.array[count % len(timeout_draws.array)] = parameters
+            stage_stats.array[0, i] += 1
+            stage_stats.array[1, i] += time.time() - st
+
     def llike(parameters, par_fix, linear, verbose, seed):
 
+        st = time.time()
+        deadline = st + time_budget if time_budget else None
         random_state = np.random.get_state()
+
+        # the likelihood of the linear model can also be requested for the nonlinear model, e.g. for screening draws
+        filt = self.filter
+        # solving the linear model must not change the (l,k) of the model
+        lks = getattr(self, 'lks', None)
+        if linear:
+            self.filter = linear_filter
+            # the filter leaves its last covariance behind. Start from the same prior in every evaluation
+            self.filter.P = linear_filter.init_P.copy()
+            l_max_loc, k_max_loc = 1, 0
+        else:
+            l_max_loc, k_max_loc = l_max, k_max
+
         with warnings.catch_warnings(record=True):
             try:
                 warnings.filterwarnings('error')
@@ -123,12 +187,17 @@ def prep_estim(self, N=None, linear=None, load_R=False, seed=None, eval_priors=F
                 par_active_lst = list(par_fix)
 
                 # the gen_sys and following part replicates call to set_par, redundant
-                self.gen_sys(par=par_active_lst, l_max=l_max,
-                             k_max=k_max, verbose=verbose > 3)
+                stage = 'solve'
+                self.gen_sys(par=par_active_lst, l_max=l_max_loc,
+                             k_max=k_max_loc, bk_check=True, verbose=verbose > 3)
                 self.filter.Q = self.QQ(self.ppar) @ self.QQ(self.ppar)
 
-                ll = get_ll(self, verbose=verbose > 3, dispatch=dispatch)
+                stage = 'filter'
+                check_deadline(deadline, 0)
+                ll = get_ll(self, verbose=verbose > 3,
+                            dispatch=dispatch, deadline=deadline)
 
+                record('filter' if np.isinf(ll) else 'accepted', st)
                 np.random.set_state(random_state)
                 return ll
 
@@ -136,6 +205,13 @@ def prep_estim(self, N=None, linear=None, load_R=False, seed=None, eval_priors=F
                 raise
 
             except Exception as err:
+                if isinstance(err, TimeoutError):
+                    stage = 'timeout'
+                elif isinstance(err, BKError):
+                    # indeterminacy and explosiveness are already detected before solving the model
+                    stage = 'bk'
+
+                record(stage, st, parameters if stage == 'timeout' else None)
                 if verbose:
                     print('[llike:]'.ljust(15, ' ') +
                           ' Failure. Error msg: %s' % err)
@@ -147,21 +223,62 @@ def prep_estim(self, N=None, linear=None, load_R=False, seed=None, eval_priors=F
                 np.random.set_state(random_state)
                 return -np.inf
 
+            finally:
+                self.filter = filt
+                if lks is not None:
+                    self.lks = lks
+
     def lprior(par):
+        return compiled_prior(par)
+
+    def lprior_batch(pars):
+        return compiled_prior(np.atleast_2d(pars))
 
-        prior = 0
-        for i, pl in enumerate(self.fdict['frozen_prior']):
-            prior += pl.logpdf(par[i])
+    def lprior_grad(par):
 
-        return prior
+        # the priors are univariate, so central differences are cheap and accurate
+        par = np.asarray(par, dtype=float)
+        h = np.diag(1e-6*np.maximum(1, np.abs(par)))
+
+        return (compiled_prior(par + h) - compiled_prior(par - h))/(2*np.diag(h))
+
+    if memoize:
+        from .parallel import SharedCache
+        # the key is the parameter vector and the seed
+        self.lprob_cache = SharedCache(
+            10000 if memoize is True else memoize, self.ndim + 1)
+    else:
+        self.lprob_cache = None
+
+    cache = self.lprob_cache
+
+    def cache_key(par, seed_loc, linear):
+        # the linear filter does not depend on the seed
+        if self.filter.name == 'KalmanFilter':
+            seed_loc = 0
+        elif linear:
+            # the linear approximation of the nonlinear model
+            seed_loc = -1
+        return cache.key(par, seed_loc)
 
     linear_pa = linear
 
     def lprob(par, par_fix=par_fix, linear=None, verbose=verbose > 1, temp=1, lprob_seed='set'):
 
+        st_stage = time.time()
+
+        # the stages are ordered by their costs
+        if not np.all(compiled_prior.in_bounds(par)):
+            record('bounds', st_stage)
+            if verbose:
+                print('[lprob:]'.ljust(15, ' ') +
+                      " parameters are out of bounds.")
+            return -np.inf
+
         lp = lprior(par)
 
         if np.isinf(lp):
+            record('prior', st_stage)
             if verbose:
                 print('[lprob:]'.ljust(15, ' ') + " prior is -inf.")
             return lp
@@ -185,7 +302,20 @@ def prep_estim(self, N=None, linear=None, load_R=False, seed=None, eval_priors=F
             raise NotImplementedError(
                 "`lprob_seed` must be one of `('vec', 'rand', 'set')`.")
 
-        ll = llike(par, par_fix, linear, verbose, seed_loc)*temp if temp else 0
+        if not temp:
+            ll = 0
+        elif cache is not None:
+            # the untempered likelihood is cached, so the tempering does not affect the key
+            key = cache_key(par, seed_loc, linear)
+            ll = cache.get(key)
+            if ll is None:
+                ll = llike(par, par_fix, linear, verbose, seed_loc)
+                # a timeout may not occur again
+                if not time_budget or time.time() - st_stage < time_budget:
+                    cache.put(key, ll)
+            ll *= temp
+        else:
+            ll = llike(par, par_fix, linear, verbose, seed_loc)*temp
 
         if np.isinf(ll):
             return ll
@@ -198,39 +328,198 @@ def prep_estim(self, N=None, linear=None, load_R=False, seed=None, eval_priors=F
 
         return ll
 
+    def lprob_batch(pars, par_fix=par_fix, linear=None, verbose=verbose > 1, temp=1, lprob_seed='set'):
+        """Evaluate `lprob` for a batch of parameter vectors of shape (n, ndim)
+
+        For the linear model all systems of the batch are filtered together. Otherwise this loops over `lprob`, which at least saves the overhead of dispatching single vectors.
+        """
+
+        pars = np.atleast_2d(pars)
+        lps = lprior_batch(pars)
+        res = np.full(len(pars), -np.inf)
+
+        valid = np.isfinite(lps) & np.all(compiled_prior.in_bounds(pars), axis=1)
+        if not valid.any():
+            return res
+
+        if self.filter.name != 'KalmanFilter':
+            for i in np.flatnonzero(valid):
+                res[i] = lprob(pars[i], par_fix=par_fix, linear=linear,
+                               verbose=verbose, temp=temp, lprob_seed=lprob_seed)
+            return res
+
+        if not temp:
+            res[valid] = lps[valid]
+            return res
+
+        lls = np.empty(len(pars))
+        todo = valid.copy()
+
+        if cache is not None:
+            keys = [cache_key(p, seed, linear) for p in pars]
+            for i in np.flatnonzero(valid):
+                ll = cache.get(keys[i])
+                if ll is not None:
+                    lls[i] = ll
+                    todo[i] = False
+
+        if todo.any():
+            full_pars = np.tile(par_fix, (sum(todo), 1))
+            full_pars[:, prior_arg] = pars[todo]
+
+            self.filter.P = self.filter.init_P.copy()
+            lls[todo] = get_ll_batch(self, full_pars, l_max=l_max,
+                                     k_max=k_max, verbose=verbose)
+
+            if cache is not None:
+                for i in np.flatnonzero(todo):
+                    cache.put(keys[i], lls[i])
+
+        res[valid] = lls[valid]*temp + lps[valid]
+
+        return res
+
+    def lprob_and_grad(par, par_fix=par_fix, verbose=verbose > 1):
+        """Log-posterior and its gradient. Only available for the linear model
+        """
+
+        if not linear_pa:
+            raise NotImplementedError(
+                'The gradient of the posterior is only available for the linear model (`KalmanFilter`).')
+
+        lp = lprior(par)
+
+        if np.isinf(lp):
+            if verbose:
+                print('[lprob:]'.ljust(15, ' ') + " prior is -inf.")
+            return lp, np.zeros(len(par))
+
+        if verbose:
+            st = time.time()
+
+        with warnings.catch_warnings(record=True):
+            try:
+                warnings.filterwarnings('error')
+
+                par_fix[prior_arg] = par
+
+                self.gen_sys(par=list(par_fix), l_max=l_max,
+                             k_max=k_max, verbose=verbose > 3)
+
+                # directions of the estimated parameters in the full parameter vector
+                dpar = np.zeros((len(par), len(par_fix)))
+                dpar[range(len(par)), prior_arg] = 1
+
+                # as in `llike`, start from the prior covariance and not from what the last filter run left behind
+                self.filter.P = self.filter.init_P.copy()
+                ll, grad = get_ll_and_grad(self, dpar)
+
+            except KeyboardInterrupt:
+                raise
+
+            except Exception as err:
+                if verbose:
+                    print('[lprob:]'.ljust(15, ' ') +
+                          ' Failure. Error msg: %s' % err)
+                return -np.inf, np.zeros(len(par))
+
+        if verbose:
+            print('[lprob:]'.ljust(15, ' ') + " Sample took %ss, ll is %s." %
+                  (np.round(time.time() - st, 3), np.round(ll + lp, 4)))
+
+        return ll + lp, grad + lprior_grad(par)
+
     # make functions accessible
     self.lprob = lprob
     self.lprior = lprior
+    self.lprior_batch = lprior_batch
     self.llike = llike
+    self.lprob_and_grad = lprob_and_grad
+    self.lprob_batch = lprob_batch
 
     if ncores is None or ncores:
-        create_pool(self, ncores)
+        get_pool(self, ncores)
     else:
         self.pool = None
 
     return
 
 
+def lprob_stats(self):
+    """Statistics of the rejection pipeline of `lprob`
+
+    Returns
+    -------
+    DataFrame
+        For each stage the number of draws that were rejected in that stage (or accepted), and the total and average time spent on them
+    """
+
+    count, total = self.stage_stats.array
+
+    with np.errstate(invalid='ignore'):
+        stats = pd.DataFrame({'count': count.astype(int), 'time': total,
+                              'time/draw': total/count}, index=lprob_stages)
+
+    return stats
+
+
+def lprob_timeouts(self):
+    """The last (at most 100) parameter draws for which the evaluation of the likelihood exceeded the time budget
+
+    Draws of pool tasks that were killed are found in `self.pool.killed`.
+
+    Returns
+    -------
+    DataFrame
+    """
+
+    draws = self.timeout_draws.array
+
+    return pd.DataFrame(draws[~np.isnan(draws[:, 0])], columns=self.prior_names)
+
+
+def kill_timeout(self):
+    """Wall-clock limit for pool tasks that evaluate `lprob`
+
+    Returns twice the time budget (or None), such that tasks are only killed if the budget could not be enforced cooperatively.
+    """
+
+    time_budget = getattr(self, 'time_budget', None)
+
+    return 2*time_budget if time_budget else None
+
+
+def limited_mapper(self, fallback):
+    """Like `mapper`, but calls that exceed `kill_timeout` are killed and return `fallback`
+
+    To be passed to samplers and optimizers, which wrap the `WorkerTask` they are given.
+    """
+
+    if self.mapper is map:
+        return map
+
+    return self.pool.limited(kill_timeout(self), fallback).imap
+
+
 def create_pool(self, ncores=None, threadpool_limit=None):
     """Creates a reusable pool
 
+    Each worker of the pool holds a resident copy of the model, such that tasks only need to carry parameters and small task descriptors (see `pydsge.parallel.WorkerTask`).
+
     Parameters
     ----------
 
     ncores : int, optional
-        Number of cores. Defaults to pathos' default, which is the number of cores.
+        Number of cores. Defaults to the number of cores.
     threadpool_limit : int, optional
-        Number of threads that numpy uses independently of pathos. Only used if `threadpoolctl` is installed. Defaults to one.
+        Number of threads that numpy uses independently of the pool. Only used if `threadpoolctl` is installed. Defaults to one.
     """
 
-    import pathos
+    from .parallel import ModelPool
 
-    if hasattr(self, 'pool'):
+    if getattr(self, 'pool', None) is not None:
         ncores = ncores or self.pool.ncpus
         self.pool.close()
-    else:
-        # pools should carry their count with them
-        ncores = ncores or pathos.multiprocessing.cpu_count()
 
     if threadpool_limit:
         self.threadpool_limit = threadpool_limit
@@ -244,16 +533,60 @@ def create_pool(self, ncores=None, threadpool_limit=None):
         print('[create_pool:]'.ljust(
             15, ' ') + " Could not import package `threadpoolctl` to limit numpy multithreading. This might reduce multiprocessing performance.")
 
-    self.pool = pathos.pools.ProcessPool(ncores)
-    self.pool.clear()
+    self.pool = ModelPool(self, ncores, self.threadpool_limit)
+
+    return self.pool
+
+
+def get_pool(self, ncores=None):
+    """Returns the pool of the model
+
+    The existing pool (and its running workers) is reused. A new pool is only created if there is none yet or if a different number of cores is requested.
+    """
+
+    if getattr(self, 'pool', None) is None or (ncores and ncores != self.pool.ncpus):
+        create_pool(self, ncores)
 
     return self.pool
 
 
+def enter_pool(self):
+    """Start the workers of the pool when entering a `with` statement on the model
+
+    Within the statement all calls share the same warm workers, which are shut down when leaving it.
+    """
+
+    get_pool(self).start()
+
+    return self
+
+
+def exit_pool(self, *args):
+
+    if getattr(self, 'pool', None) is not None:
+        self.pool.close()
+
+
+def batch_map(self, func, xs):
+    """Map a batched function over the pool
+
+    Splits `xs` into one chunk per worker, applies `func` to each chunk and stacks the results.
+    """
+
+    xs = np.atleast_2d(xs)
+
+    if hasattr(self, 'pool') and self.pool and not self.debug:
+        nchunks = min(self.pool.ncpus, len(xs))
+    else:
+        nchunks = 1
+
+    return np.hstack(list(self.mapper(func, np.array_split(xs, nchunks))))
+
+
 @property
 def mapper(self):
 
-    if hasattr(self, 'pool') and not self.debug:
+    if getattr(self, 'pool', None) is not None and not self.debug:
         return self.pool.imap
     else:
         return map
@@ -12,12 +12,573 @@ from econsieve.stats import logpdf
 def create_obs_cov(self, scale_obs=0.1):
 
     self.Z = np.array(self.data)
-    sig_obs = np.var(self.Z, axis=0)*scale_obs**2
+    sig_obs = np.nanvar(self.Z, axis=0)*scale_obs**2
     obs_cov = np.diagflat(sig_obs)
 
     return obs_cov
 
 
+def get_obs_sel(self):
+    """Get the selection pattern of observed data points
+
+    The pattern is only calculated once per dataset and then cached.
+
+    Returns
+    -------
+    tuple
+        A boolean mask of observed data points of shape (T, nobs), an array assigning each period to a pattern, and a list of the indices of the observables contained in each pattern
+    """
+
+    try:
+        data, obs_sel = self.obs_sel_cache
+        if data is self.data:
+            return obs_sel
+    except AttributeError:
+        pass
+
+    mask = ~np.isnan(np.array(self.data, dtype=float))
+    patterns, pix = np.unique(mask, axis=0, return_inverse=True)
+    sels = [np.flatnonzero(p) for p in patterns]
+
+    obs_sel = mask, pix.flatten(), sels
+    self.obs_sel_cache = self.data, obs_sel
+
+    return obs_sel
+
+
+def check_deadline(deadline, t):
+    """Raise a `TimeoutError` if the wall-clock `deadline` (as from `time.time`) has passed
+    """
+
+    if deadline is not None and time.time() > deadline:
+        raise TimeoutError(
+            'Time budget exceeded after %s periods of filtering.' % t)
+
+
+def batch_filter_kf(f, Z, obs_sel, deadline=None):
+    """Kalman filter that only uses the observed rows of `H` and `R` in each period
+
+    Mirrors `KalmanFilter.batch_filter` but allows for missing observations (NaNs in `Z`). If `deadline` is given, the filter gives up once it passed (see `check_deadline`).
+    """
+
+    mask, pix, sels = obs_sel
+
+    F, Q, R = f.F, f.Q, f.R
+    H, c = f.H
+
+    # selection of system matrices per pattern
+    Hs = [H[sel] for sel in sels]
+    cs = [c[sel] for sel in sels]
+    Rs = [R[np.ix_(sel, sel)] for sel in sels]
+
+    means = np.empty((len(Z), f.dim_x))
+    covs = np.empty((len(Z), f.dim_x, f.dim_x))
+    I = np.eye(f.dim_x)
+
+    x = np.zeros(f.dim_x)
+    P = f.P
+    ll = 0
+
+    for t, z in enumerate(Z):
+
+        check_deadline(deadline, t)
+
+        # predict
+        x = F @ x
+        P = F @ P @ F.T + Q
+
+        j = pix[t]
+        sel = sels[j]
+
+        # update only if anything is observed
+        if len(sel):
+
+            y = z[sel] - Hs[j] @ x - cs[j]
+            PHT = P @ Hs[j].T
+            S = Hs[j] @ PHT + Rs[j]
+            K = PHT @ np.linalg.inv(S)
+
+            x = x + K @ y
+            I_KH = I - K @ Hs[j]
+            P = I_KH @ P @ I_KH.T + K @ Rs[j] @ K.T
+
+            ll += logpdf(y, mean=np.zeros(len(sel)), cov=S)
+
+        means[t] = x
+        covs[t] = P
+
+    f.x = x.reshape(-1, 1)
+    f.P = P
+
+    return means, covs, ll
+
+
+def batch_filter_kf_stacked(F, Q, H, c, R, P, Z, obs_sel):
+    """Kalman filter that runs on a stack of linear systems at once
+
+    All system matrices carry a leading dimension that indexes the systems (e.g. one per parameter vector), such that the recursions are vectorized across systems. `R` and the initial covariance `P` are shared. Missing observations are handled as in `batch_filter_kf`.
+
+    Returns
+    -------
+    array
+        The log-likelihood of each system. Systems for which the filter breaks down are assigned `-inf`
+    """
+
+    mask, pix, sels = obs_sel
+
+    n, dim_x = F.shape[:2]
+    I = np.eye(dim_x)
+
+    x = np.zeros((n, dim_x, 1))
+    P = np.broadcast_to(P, (n, dim_x, dim_x))
+    FT = F.transpose(0, 2, 1)
+    ll = np.zeros(n)
+
+    with np.errstate(all='ignore'):
+        for t, z in enumerate(Z):
+
+            # predict
+            x = F @ x
+            P = F @ P @ FT + Q
+
+            sel = sels[pix[t]]
+
+            if len(sel):
+
+                Hj = H[:, sel]
+                Rj = R[np.ix_(sel, sel)]
+
+                y = z[sel, None] - Hj @ x - c[:, sel, None]
+                PHT = P @ Hj.transpose(0, 2, 1)
+                S = Hj @ PHT + Rj
+                SI = np.linalg.inv(S)
+                K = PHT @ SI
+
+                x = x + K @ y
+                I_KH = I - K @ Hj
+                P = I_KH @ P @ I_KH.transpose(0, 2, 1) + \
+                    K @ Rj @ K.transpose(0, 2, 1)
+
+                _, logdet = np.linalg.slogdet(S)
+                maha = (y.transpose(0, 2, 1) @ SI @ y).flatten()
+                ll -= .5*(len(sel)*np.log(2*np.pi) + logdet + maha)
+
+    ll[~np.isfinite(ll)] = -np.inf
+
+    return ll
+
+
+def batch_filter_kf_grad(f, Z, obs_sel, dF, dQ, dH, dc):
+    """Kalman filter that additionally returns the gradient of the log-likelihood
+
+    Propagates the derivatives of the means and covariances alongside the filter recursions (the analytic score). The derivatives of the system matrices are given with a leading dimension that indexes the parameters. The initial covariance is treated as independent of the parameters.
+
+    Returns
+    -------
+    tuple
+        The log-likelihood and its gradient
+    """
+
+    mask, pix, sels = obs_sel
+
+    F, Q, R = f.F, f.Q, f.R
+    H, c = f.H
+
+    Hs = [H[sel] for sel in sels]
+    cs = [c[sel] for sel in sels]
+    Rs = [R[np.ix_(sel, sel)] for sel in sels]
+    dHs = [dH[:, sel] for sel in sels]
+    dcs = [dc[:, sel] for sel in sels]
+
+    k = len(dF)
+    I = np.eye(f.dim_x)
+    x = np.zeros(f.dim_x)
+    P = f.P
+    dx = np.zeros((k, f.dim_x))
+    dP = np.zeros((k, f.dim_x, f.dim_x))
+    ll = 0
+    grad = np.zeros(k)
+
+    for t, z in enumerate(Z):
+
+        # predict
+        dx = dF @ x + dx @ F.T
+        x = F @ x
+        dFPF = dF @ P @ F.T
+        dP = dFPF + dFPF.transpose(0, 2, 1) + F @ dP @ F.T + dQ
+        P = F @ P @ F.T + Q
+
+        j = pix[t]
+        sel = sels[j]
+
+        if len(sel):
+
+            Hj, dHj = Hs[j], dHs[j]
+
+            y = z[sel] - Hj @ x - cs[j]
+            dy = -dHj @ x - dx @ Hj.T - dcs[j]
+
+            PHT = P @ Hj.T
+            dPHT = dP @ Hj.T + P @ dHj.transpose(0, 2, 1)
+            S = Hj @ PHT + Rs[j]
+            dS = dHj @ PHT + Hj @ dPHT
+            SI = np.linalg.inv(S)
+            K = PHT @ SI
+            dK = (dPHT - K @ dS) @ SI
+
+            Sy = SI @ y
+            grad -= .5*(np.einsum('ij,kji->k', SI, dS) +
+                        2*dy @ Sy - np.einsum('i,kij,j->k', Sy, dS, Sy))
+            ll += logpdf(y, mean=np.zeros(len(sel)), cov=S)
+
+            dx = dx + dK @ y + dy @ K.T
+            x = x + K @ y
+            # Joseph form for numerical stability
+            I_KH = I - K @ Hj
+            dI_KH = -dK @ Hj - K @ dHj
+            dJ = dI_KH @ P @ I_KH.T + dK @ Rs[j] @ K.T
+            dP = dJ + dJ.transpose(0, 2, 1) + I_KH @ dP @ I_KH.T
+            P = I_KH @ P @ I_KH.T + K @ Rs[j] @ K.T
+
+    f.x = x.reshape(-1, 1)
+    f.P = P
+
+    return ll, grad
+
+
+def batch_filter_tenkf(f, Z, obs_sel, init_states=None, seed=None, store=False, calc_ll=False, deadline=None):
+    """TEnKF that only uses the observed rows of the ensemble observations and `R` in each period
+
+    Mirrors `TEnKF.batch_filter` but allows for missing observations (NaNs in `Z`). Stores the ensembles in the same attributes of the filter object such that `TEnKF.rts_smoother` can be used subsequently. If `deadline` is given, the filter gives up once it passed (see `check_deadline`).
+    """
+
+    mask, pix, sels = obs_sel
+
+    dim_x, dim_z, N = f.dim_x, f.dim_z, f.N
+
+    I1 = np.ones(N)
+    I2 = np.eye(N) - np.outer(I1, I1)/N
+
+    f.Z = Z
+    f.Xs = np.empty((Z.shape[0], dim_x, N))
+
+    if store:
+        f.X_priors = np.empty_like(f.Xs)
+        f.X_bars = np.empty_like(f.Xs)
+        f.X_bar_priors = np.empty_like(f.Xs)
+
+    if seed is not None:
+        np.random.seed(seed)
+    elif f.seed is not None:
+        np.random.seed(f.seed)
+
+    mus = f.multivariate(mean=np.zeros(dim_z), cov=f.R, size=(len(Z), N))
+    epss = f.multivariate(mean=np.zeros(
+        f.Q.shape[0]), cov=f.Q, size=(len(Z), N))
+
+    if init_states is None:
+        X = f.multivariate(mean=f.x, cov=f.P, size=N).T
+    else:
+        X = init_states
+
+    Y = np.empty((dim_z, N))
+    ll = 0
+
+    for nz, z in enumerate(Z):
+
+        check_deadline(deadline, nz)
+
+        # predict
+        for i in range(N):
+            if f.o_func is None:
+                X[:, i], Y[:, i] = f.t_func(X[:, i], epss[nz, i])[0]
+            else:
+                X[:, i] = f.t_func(X[:, i], epss[nz, i])[0]
+
+        if f.o_func is not None:
+            Y = f.o_func(X.T).T
+
+        if store:
+            f.X_priors[nz] = X
+
+        X_bar = X @ I2
+        sel = sels[pix[nz]]
+
+        # update only if anything is observed
+        if len(sel):
+
+            Y_sel = Y[sel]
+            Y_bar = Y_sel @ I2
+            S = np.atleast_2d(np.cov(Y_sel)) + f.R[np.ix_(sel, sel)]
+            ZZ = np.outer(z[sel], I1)
+            X += X_bar @ Y_bar.T @ np.linalg.inv((N-1)*S) @ (ZZ - Y_sel - mus[nz][:, sel].T)
+
+            if calc_ll:
+                y = z[sel] - np.mean(Y_sel, axis=1)
+                ll += logpdf(y, mean=np.zeros(len(sel)), cov=S)
+
+        if store:
+            f.X_bar_priors[nz] = X_bar
+            f.X_bars[nz] = X @ I2
+
+        f.Xs[nz] = X
+
+    if calc_ll:
+        f.ll = ll
+        return ll
+
+    return np.rollaxis(f.Xs, 2)
+
+
+def fixed_lag_kf(f, Z, obs_sel, lag, means_only=False):
+    """Fixed-lag Kalman smoother
+
+    Runs the Kalman filter and updates the estimates of the last `lag` periods with every new observation, using the cross-covariances between these periods and the current state. Only these `lag` (cross-)covariances are kept in memory.
+
+    Returns
+    -------
+    tuple
+        The smoothed means x(t|t+lag), the smoothed covariances (`None` if `means_only`) and the log-likelihood
+    """
+
+    from collections import deque
+
+    mask, pix, sels = obs_sel
+
+    F, Q, R = f.F, f.Q, f.R
+    H, c = f.H
+
+    Hs = [H[sel] for sel in sels]
+    cs = [c[sel] for sel in sels]
+    Rs = [R[np.ix_(sel, sel)] for sel in sels]
+
+    means = np.empty((len(Z), f.dim_x))
+    covs = None if means_only else np.empty((len(Z), f.dim_x, f.dim_x))
+
+    x = np.zeros(f.dim_x)
+    P = f.P
+    ll = 0
+
+    # each entry: [period, mean, cross-cov with current state, cov]
+    window = deque()
+
+    for t, z in enumerate(Z):
+
+        # predict
+        x = F @ x
+        P = F @ P @ F.T + Q
+
+        for entry in window:
+            entry[2] = entry[2] @ F.T
+
+        window.append([t, x, P, None if means_only else P])
+
+        j = pix[t]
+        sel = sels[j]
+
+        if len(sel):
+
+            y = z[sel] - Hs[j] @ x - cs[j]
+            S = Hs[j] @ P @ Hs[j].T + Rs[j]
+            SI = np.linalg.inv(S)
+            HP = Hs[j] @ P
+
+            for entry in window:
+                G = entry[2] @ Hs[j].T @ SI
+                entry[1] = entry[1] + G @ y
+                if not means_only:
+                    entry[3] = entry[3] - G @ S @ G.T
+                entry[2] = entry[2] - G @ HP
+
+            x, P = window[-1][1], window[-1][2]
+            ll += logpdf(y, mean=np.zeros(len(sel)), cov=S)
+
+        # release what is no longer needed
+        if len(window) > lag:
+            s, m, _, cov = window.popleft()
+            means[s] = m
+            if not means_only:
+                covs[s] = cov
+
+    for s, m, _, cov in window:
+        means[s] = m
+        if not means_only:
+            covs[s] = cov
+
+    f.x = x.reshape(-1, 1)
+    f.P = P
+
+    return means, covs, ll
+
+
+def smoothed_means_kf(f, Z, obs_sel, deadline=None):
+    """Smoothed means of the Kalman filter without storing covariances
+
+    Uses the disturbance smoother (Koopman, 1993): the forward pass keeps the innovations, their inverse covariances and the gains, the backward pass accumulates the smoothed disturbances, and the smoothed states then follow from propagating these forward. Memory is O(T·dimx·nobs) instead of the O(T·dimx²) of the RTS smoother. Gives the same means as the RTS smoother.
+
+    Returns
+    -------
+    tuple
+        The smoothed means, `None` (instead of covariances) and the log-likelihood
+    """
+
+    mask, pix, sels = obs_sel
+
+    F, Q, R = f.F, f.Q, f.R
+    H, c = f.H
+
+    Hs = [H[sel] for sel in sels]
+    cs = [c[sel] for sel in sels]
+    Rs = [R[np.ix_(sel, sel)] for sel in sels]
+
+    I = np.eye(f.dim_x)
+
+    x = np.zeros(f.dim_x)
+    P = f.P
+    ll = 0
+
+    # per period: innovation, its inverse covariance and the gain (`None` if nothing is observed)
+    steps = []
+
+    for t, z in enumerate(Z):
+
+        check_deadline(deadline, t)
+
+        x = F @ x
+        P = F @ P @ F.T + Q
+
+        if not t:
+            x_init, P_init = x, P
+
+        j = pix[t]
+        sel = sels[j]
+
+        if len(sel):
+
+            y = z[sel] - Hs[j] @ x - cs[j]
+            S = Hs[j] @ P @ Hs[j].T + Rs[j]
+            SI = np.linalg.inv(S)
+            K = P @ Hs[j].T @ SI
+
+            x = x + K @ y
+            I_KH = I - K @ Hs[j]
+            P = I_KH @ P @ I_KH.T + K @ Rs[j] @ K.T
+
+            ll += logpdf(y, mean=np.zeros(len(sel)), cov=S)
+            steps.append((j, y, SI, K))
+        else:
+            steps.append(None)
+
+    f.x = x.reshape(-1, 1)
+    f.P = P
+
+    # backward pass: `rs[t]` is the smoothing residual of the transition from t to t+1
+    rs = np.zeros((len(Z), f.dim_x))
+    r = np.zeros(f.dim_x)
+
+    for t in range(len(Z) - 1, -1, -1):
+
+        rs[t] = r
+        r = F.T @ r
+
+        if steps[t] is not None:
+            j, y, SI, K = steps[t]
+            r = Hs[j].T @ SI @ y + r - Hs[j].T @ (K.T @ r)
+
+    means = np.empty((len(Z), f.dim_x))
+    means[0] = x_init + P_init @ r
+
+    for t in range(1, len(Z)):
+        means[t] = F @ means[t-1] + Q @ rs[t-1]
+
+    return means, None, ll
+
+
+def fixed_lag_tenkf(f, Z, obs_sel, lag, means_only=False, init_states=None, seed=None):
+    """Fixed-lag ensemble Kalman smoother for the TEnKF
+
+    Every update of the current ensemble is also applied to the ensembles of the last `lag` periods (as in the ensemble Kalman smoother). Older ensembles are discarded (or reduced to their means if `means_only`).
+
+    Returns
+    -------
+    array
+        The smoothed ensembles of shape (N, T, dim_x), or the smoothed means of shape (T, dim_x) if `means_only`
+    """
+
+    from collections import deque
+
+    mask, pix, sels = obs_sel
+
+    dim_x, dim_z, N = f.dim_x, f.dim_z, f.N
+
+    I1 = np.ones(N)
+    I2 = np.eye(N) - np.outer(I1, I1)/N
+
+    if means_only:
+        res = np.empty((Z.shape[0], dim_x))
+    else:
+        res = np.empty((Z.shape[0], dim_x, N))
+
+    if seed is not None:
+        np.random.seed(seed)
+    elif f.seed is not None:
+        np.random.seed(f.seed)
+
+    mus = f.multivariate(mean=np.zeros(dim_z), cov=f.R, size=(len(Z), N))
+    epss = f.multivariate(mean=np.zeros(
+        f.Q.shape[0]), cov=f.Q, size=(len(Z), N))
+
+    if init_states is None:
+        X = f.multivariate(mean=f.x, cov=f.P, size=N).T
+    else:
+        X = init_states
+
+    Y = np.empty((dim_z, N))
+    window = deque()
+
+    for nz, z in enumerate(Z):
+
+        X = X.copy()
+
+        # predict
+        for i in range(N):
+            if f.o_func is None:
+                X[:, i], Y[:, i] = f.t_func(X[:, i], epss[nz, i])[0]
+            else:
+                X[:, i] = f.t_func(X[:, i], epss[nz, i])[0]
+
+        if f.o_func is not None:
+            Y = f.o_func(X.T).T
+
+        window.append((nz, X))
+        sel = sels[pix[nz]]
+
+        if len(sel):
+
+            Y_sel = Y[sel]
+            Y_bar = Y_sel @ I2
+            S = np.atleast_2d(np.cov(Y_sel)) + f.R[np.ix_(sel, sel)]
+            ZZ = np.outer(z[sel], I1)
+
+            # weights of the update are the same for all lagged ensembles
+            W = I2 @ Y_bar.T @ np.linalg.inv((N-1)*S) @ (ZZ - Y_sel - mus[nz][:, sel].T)
+
+            for _, Xs in window:
+                Xs += Xs @ W
+
+        if len(window) > lag:
+            s, Xs = window.popleft()
+            res[s] = Xs.mean(axis=1) if means_only else Xs
+
+    for s, Xs in window:
+        res[s] = Xs.mean(axis=1) if means_only else Xs
+
+    if means_only:
+        return res
+
+    return np.rollaxis(res, 2)
+
+
 def create_filter(self, R=None, N=None, ftype=None, seed=None, incl_obs=False, reduced_form=False, **fargs):
 
     self.Z = np.array(self.data)
@@ -67,6 +628,7 @@ def create_filter(self, R=None, N=None, ftype=None, seed=None, incl_obs=False, r
     except AttributeError:
         f.Q = self.fdict['QQ'] @ self.fdict['QQ']
     self.filter = f
+    self.revision = getattr(self, 'revision', 0) + 1
 
     return f
 
@@ -75,7 +637,140 @@ def get_ll(self, **args):
     return run_filter(self, smoother=False, get_ll=True, **args)
 
 
-def run_filter(self, smoother=True, get_ll=False, dispatch=None, rcond=1e-14, seed=None, verbose=False):
+def get_ll_batch(self, pars, l_max=None, k_max=None, verbose=False):
+    """Get the log-likelihood of a batch of (full) parameter vectors for the linear model
+
+    The systems are solved one after the other, and then filtered together by `batch_filter_kf_stacked`. The initial covariance is the current `filter.P` for all vectors and is not updated.
+
+    Parameters
+    ----------
+    pars : array
+        Array of shape (n, len(self.par))
+
+    Returns
+    -------
+    array
+        The n log-likelihoods
+    """
+
+    import warnings
+
+    if self.filter.name != 'KalmanFilter':
+        raise NotImplementedError(
+            'Batched filtering is only available for the linear model (`KalmanFilter`).')
+
+    self.Z = np.array(self.data)
+
+    lls = np.full(len(pars), -np.inf)
+    valid = np.zeros(len(pars), dtype=bool)
+    dim_x, nobs = self.filter.dim_x, self.nobs
+
+    # workspace for the stacked systems
+    Fs = np.empty((len(pars), dim_x, dim_x))
+    Qs = np.empty_like(Fs)
+    Hs = np.empty((len(pars), nobs, dim_x))
+    cs = np.empty((len(pars), nobs))
+
+    for i, par in enumerate(pars):
+        with warnings.catch_warnings(record=True):
+            try:
+                warnings.filterwarnings('error')
+
+                self.gen_sys(par=list(par), l_max=l_max,
+                             k_max=k_max, verbose=verbose > 3)
+
+                F, E = self.get_lin_sys()
+                QQ = self.QQ(self.ppar)
+
+                Fs[i] = F
+                Qs[i] = E @ QQ @ QQ @ E.T
+                Hs[i] = np.hstack((self.hx[0], self.hx[1]))
+                cs[i] = self.hx[2]
+                valid[i] = True
+
+            except KeyboardInterrupt:
+                raise
+
+            except Exception as err:
+                if verbose:
+                    print('[get_ll_batch:]'.ljust(15, ' ') +
+                          ' Failure. Error msg: %s' % err)
+
+    if valid.any():
+        lls[valid] = batch_filter_kf_stacked(Fs[valid], Qs[valid], Hs[valid], cs[valid],
+                                             self.filter.R, self.filter.P, self.Z, get_obs_sel(self))
+
+    return lls
+
+
+def get_ll_and_grad(self, dpar):
+    """Get the log-likelihood and its analytic gradient for the linear model
+
+    Assumes that the system was generated with the current parameters (as in `llike`).
+
+    Parameters
+    ----------
+    dpar : array
+        Array of shape (k, len(self.par)) with the directions in which to take the derivatives
+
+    Returns
+    -------
+    tuple
+        The log-likelihood and its k derivatives
+    """
+
+    if self.filter.name != 'KalmanFilter':
+        raise NotImplementedError(
+            'The gradient of the likelihood is only available for the linear model (`KalmanFilter`).')
+
+    self.Z = np.array(self.data)
+
+    F, E = self.get_lin_sys()
+    dpmat, dqmat, dhx, dQQ = self.gen_sys_grad(dpar)
+
+    neps = self.neps
+
+    # same layout as in `get_lin_sys`
+    dF = np.concatenate(
+        (dpmat[..., :-neps], dqmat[:, :-neps, :-neps]), axis=1)
+    dF = np.pad(dF, ((0, 0), (0, 0), (self.dimp, 0)))
+    dE = np.concatenate((dpmat[..., -neps:], dqmat[:, :-neps, -neps:]), axis=1)
+
+    Qe = self.QQ(self.ppar) @ self.QQ(self.ppar)
+    dEQE = dE @ Qe @ E.T
+    dQ = dEQE + dEQE.transpose(0, 2, 1) + E @ dQQ @ E.T
+
+    self.filter.F = F
+    self.filter.H = np.hstack((self.hx[0], self.hx[1])), self.hx[2]
+    self.filter.Q = E @ Qe @ E.T
+
+    dH = np.concatenate(dhx[:2], axis=2)
+    dc = dhx[2]
+
+    return batch_filter_kf_grad(self.filter, self.Z, get_obs_sel(self), dF, dQ, dH, dc)
+
+
+def run_filter(self, smoother=True, get_ll=False, dispatch=None, rcond=1e-14, lag=None, means_only=False, seed=None, deadline=None, verbose=False):
+    """Run the filter (and smoother) on the data
+
+    Parameters
+    ----------
+    smoother : bool, optional
+        Whether to return the smoothed states. Defaults to `True`.
+    get_ll : bool, optional
+        Whether to only return the log-likelihood. Defaults to `False`.
+    lag : int, optional
+        If given, use a fixed-lag smoother with this lag instead of a full-sample smoother. Covariances (or ensembles) are then only kept for the last `lag` periods, such that memory is O(lag·N·dimx) rather than O(T·N·dimx). For the Kalman filter, `lag >= T` gives the same result as the full-sample smoother. The fixed-lag smoother of the TEnKF is not identical to `TEnKF.rts_smoother`, even for `lag >= T`.
+    means_only : bool, optional
+        Only return the smoothed means (the ensemble mean for the TEnKF) and discard covariances/ensembles. The Kalman filter then uses a disturbance smoother that does not store covariances. For the TEnKF, the memory required during smoothing is only reduced in combination with `lag`.
+    deadline : float, optional
+        Wall-clock time (as from `time.time`) after which the Kalman filter or the TEnKF give up with a `TimeoutError`. Not supported by the particle filter and the fixed-lag smoothers.
+
+    Returns
+    -------
+    array or tuple
+        The log-likelihood or the (smoothed) states
+    """
 
     if verbose:
         st = time.time()
@@ -85,15 +780,7 @@ def run_filter(self, smoother=True, get_ll=False, dispatch=None, rcond=1e-14, se
     # assign current transition & observation functions (of parameters)
     if self.filter.name == 'KalmanFilter':
 
-        pmat = self.precalc_mat[0]
-        qmat = self.precalc_mat[1]
-
-        F = np.vstack((pmat[1, 0][:, :-self.neps],
-                       qmat[1, 0][:-self.neps, :-self.neps]))
-        F = np.pad(F, ((0, 0), (self.dimp, 0)))
-
-        E = np.vstack((pmat[1, 0][:, -self.neps:],
-                       qmat[1, 0][:-self.neps, -self.neps:]))
+        F, E = self.get_lin_sys()
 
         self.filter.F = F
         self.filter.H = np.hstack((self.hx[0], self.hx[1])), self.hx[2]
@@ -118,22 +805,41 @@ def run_filter(self, smoother=True, get_ll=False, dispatch=None, rcond=1e-14, se
 
     self.filter.get_eps = self.get_eps_lin
 
+    # missing observations require selecting the observed rows in each period
+    obs_sel = get_obs_sel(self)
+    missing = not obs_sel[0].all()
+
     if self.filter.name == 'KalmanFilter':
 
-        means, covs, ll = self.filter.batch_filter(self.Z)
+        if smoother and lag is not None:
+            means, covs, ll = fixed_lag_kf(
+                self.filter, self.Z, obs_sel, lag, means_only)
+        elif smoother and means_only:
+            means, covs, ll = smoothed_means_kf(
+                self.filter, self.Z, obs_sel, deadline)
+        elif missing or deadline is not None:
+            means, covs, ll = batch_filter_kf(
+                self.filter, self.Z, obs_sel, deadline)
+        else:
+            means, covs, ll = self.filter.batch_filter(self.Z)
 
-        if smoother:
+        if smoother and lag is None and not means_only:
             means, covs, _, _ = self.filter.rts_smoother(
                 means, covs, inv=np.linalg.pinv)
 
         if get_ll:
             res = ll
+        elif means_only:
+            res = means
         else:
-            means = means
             res = (means, covs)
 
     elif self.filter.name == 'ParticleFilter':
 
+        if missing:
+            raise NotImplementedError(
+                'The particle filter does not support missing observations.')
+
         res = self.filter.batch_filter(self.Z)
 
         if smoother:
@@ -146,13 +852,24 @@ def run_filter(self, smoother=True, get_ll=False, dispatch=None, rcond=1e-14, se
                 smoother = 10
             res = self.filter.smoother(smoother)
 
+    elif smoother and lag is not None:
+        res = fixed_lag_tenkf(self.filter, self.Z, obs_sel,
+                              lag, means_only, seed=seed)
+
     else:
-        res = self.filter.batch_filter(
-            self.Z, calc_ll=get_ll, store=smoother, seed=seed, verbose=verbose > 0)
+        if missing or deadline is not None:
+            res = batch_filter_tenkf(
+                self.filter, self.Z, obs_sel, calc_ll=get_ll, store=smoother, seed=seed, deadline=deadline)
+        else:
+            res = self.filter.batch_filter(
+                self.Z, calc_ll=get_ll, store=smoother, seed=seed, verbose=verbose > 0)
 
         if smoother:
             res = self.filter.rts_smoother(res, rcond=rcond)
 
+            if means_only:
+                res = res.mean(axis=0)
+
     if get_ll:
         if np.isnan(res):
             res = -np.inf
@@ -170,7 +887,54 @@ def run_filter(self, smoother=True, get_ll=False, dispatch=None, rcond=1e-14, se
     return res
 
 
-def extract(self, sample=None, nsamples=1, precalc=True, seed=0, nattemps=4, accept_failure=False, verbose=True, debug=False, l_max=None, k_max=None, **npasargs):
+def extract_runner(self, arg, fname, lag, l_max, k_max, nattemps, accept_failure, verbose, npasargs):
+    """Extract the shocks for a single parameter vector and seed
+    """
+
+    par, seed_loc = arg
+
+    if par is not None:
+        self.set_par(par, l_max=l_max, k_max=k_max)
+
+    if fname == 'KalmanFilter':
+        # covariances are not required to recover the shocks
+        means = self.run_filter(verbose=verbose > 2, lag=lag, means_only=True)
+        # recover all shocks of the smoothed path at once
+        resid = self.get_eps_lin(means[1:], means[:-1])
+
+        return means[0], resid, 0
+
+    res = self.run_filter(verbose=verbose > 2, lag=lag, seed=seed_loc)
+
+    np.random.shuffle(res)
+    sample = np.dstack((self.obs(res), res[..., self.dimp:]))
+    inits = res[:, 0, :]
+
+    def t_func_loc(states, eps):
+
+        (q, pobs), flag = self.t_func(states, eps, get_obs=True)
+
+        return np.hstack((pobs, q)), flag
+
+    for natt in range(nattemps):
+        try:
+            init, resid, flags = self.filter.npas(func=t_func_loc, X=sample, init_states=inits, verbose=max(
+                len(sample) == 1, verbose-1), seed=seed_loc, nsamples=1, **npasargs)
+
+            return init, resid[0], flags
+
+        except Exception as e:
+            raised_error = e
+
+    if accept_failure:
+        print('[extract:]'.ljust(15, ' ') + "got an error: '%s' (after %s unsuccessful attemps)." %(raised_error,natt+1))
+        return None
+    else:
+        import sys
+        raise type(raised_error)(str(raised_error) + ' (after %s unsuccessful attemps).' % (natt+1)).with_traceback(sys.exc_info()[2])
+
+
+def extract(self, sample=None, nsamples=1, precalc=True, seed=0, nattemps=4, accept_failure=False, lag=None, verbose=True, debug=False, l_max=None, k_max=None, **npasargs):
     """Extract the timeseries of (smoothed) shocks.
 
     Parameters
@@ -181,6 +945,8 @@ def extract(self, sample=None, nsamples=1, precalc=True, seed=0, nattemps=4, acc
         Number of `npas`-draws for each element in `sample`. Defaults to 1
     nattemps : int, optional
         Number of attemps per sample to crunch the sample with a different seed. Defaults to 4
+    lag : int, optional
+        If given, use a fixed-lag smoother with this lag (see `run_filter`) to save memory on long samples
 
     Returns
     -------
@@ -190,7 +956,8 @@ def extract(self, sample=None, nsamples=1, precalc=True, seed=0, nattemps=4, acc
 
     import tqdm
     import os
-    from grgrlib.core import map2arr, serializer
+    from grgrlib.core import map2arr
+    from .parallel import WorkerTask
 
     # if sample is None:
         # sample = self.par
@@ -204,8 +971,8 @@ def extract(self, sample=None, nsamples=1, precalc=True, seed=0, nattemps=4, acc
     verbose = max(verbose, debug)
 
     if hasattr(self, 'pool'):
-        from .estimation import create_pool
-        create_pool(self)
+        from .estimation import get_pool
+        get_pool(self)
 
     if fname == 'ParticleFilter':
         raise NotImplementedError
@@ -226,74 +993,13 @@ def extract(self, sample=None, nsamples=1, precalc=True, seed=0, nattemps=4, acc
             print('[extract:]'.ljust(
                 15, ' ')+' Extraction requires filter in non-reduced form. Recreating filter instance.')
 
-        npas = serializer(self.filter.npas)
-
     self.debug |= debug
 
-    if sample[0] is not None:
-        set_par = serializer(self.set_par)
-
-    run_filter = serializer(self.run_filter)
-    t_func = serializer(self.t_func)
-    edim = len(self.shocks)
-    xdim = len(self.vv)
-    odim = len(self.observables)
-
-    obs_func = serializer(self.obs)
-    filter_get_eps = serializer(self.get_eps_lin)
-
-    dimeps = self.dimeps
-    dimp = self.dimp
-
     seeds = np.random.randint(2**31, size=nsamples)  # win explodes with 2**32
     sample = [(x, y) for x in sample for y in seeds]
 
-    def runner(arg):
-
-        par, seed_loc = arg
-
-        if par is not None:
-            set_par(par, l_max=l_max, k_max=k_max)
-
-        res = run_filter(verbose=verbose > 2, seed=seed_loc)
-
-        if fname == 'KalmanFilter':
-            means, covs = res
-            res = means.copy()
-            resid = np.empty((means.shape[0]-1, dimeps))
-
-            for t, x in enumerate(means[1:]):
-                resid[t] = filter_get_eps(x, res[t])
-                res[t+1] = t_func(res[t], resid[t], linear=True)[0]
-
-            return res[0], resid, 0
-
-        np.random.shuffle(res)
-        sample = np.dstack((obs_func(res), res[..., dimp:]))
-        inits = res[:, 0, :]
-
-        def t_func_loc(states, eps):
-
-            (q, pobs), flag = t_func(states, eps, get_obs=True)
-
-            return np.hstack((pobs, q)), flag
-
-        for natt in range(nattemps):
-            try:
-                init, resid, flags = npas(func=t_func_loc, X=sample, init_states=inits, verbose=max(
-                    len(sample) == 1, verbose-1), seed=seed_loc, nsamples=1, **npasargs)
-
-                return init, resid[0], flags
-
-            except Exception as e:
-                raised_error = e
-
-        if accept_failure:
-            print('[extract:]'.ljust(15, ' ') + "got an error: '%s' (after %s unsuccessful attemps)." %(raised_error,natt+1))
-            return None
-        else:
-            import sys
-            raise type(raised_error)(str(raised_error) + ' (after %s unsuccessful attemps).' % (natt+1)).with_traceback(sys.exc_info()[2])
+    runner = WorkerTask(self, extract_runner, fname=fname, lag=lag, l_max=l_max, k_max=k_max,
+                        nattemps=nattemps, accept_failure=accept_failure, verbose=verbose, npasargs=npasargs)
 
     wrap = tqdm.tqdm if (verbose and len(sample) >
                          1) else (lambda x, **kwarg: x)
@@ -301,9 +1007,6 @@ def extract(self, sample=None, nsamples=1, precalc=True, seed=0, nattemps=4, acc
                total=len(sample), dynamic_ncols=True)
     init, resid, flags = map2arr(res)
 
-    if hasattr(self, 'pool') and self.pool:
-        self.pool.close()
-
     if fname == 'KalmanFilter':
         self.debug = debug
 
@@ -72,9 +72,11 @@ def gen_sys_from_dict(mdict, l_max=None, k_max=None, parallel=True, force_proces
     return res_sys
 
 
-def gen_sys_from_yaml(self, par=None, l_max=None, k_max=None, get_hx_only=False, parallel=False, verbose=True):
+def gen_sys_from_yaml(self, par=None, l_max=None, k_max=None, get_hx_only=False, parallel=False, bk_check=False, verbose=True):
 
     self.par = self.p0() if par is None else list(par)
+    # tells the pool that its workers are outdated
+    self.revision = getattr(self, 'revision', 0) + 1
     try:
         self.ppar = self.pcompile(self.par)  # parsed par
     except TypeError:
@@ -110,10 +112,16 @@ def gen_sys_from_yaml(self, par=None, l_max=None, k_max=None, get_hx_only=False,
     ZZ0 = self.ZZ0(self.ppar).astype(float)
     ZZ1 = self.ZZ1(self.ppar).squeeze().astype(float)
 
-    return gen_sys(self, AA0, BB0, CC0, DD0, fb0, fc0, fd0, ZZ0, ZZ1, l_max, k_max, get_hx_only, parallel, verbose)
+    return gen_sys(self, AA0, BB0, CC0, DD0, fb0, fc0, fd0, ZZ0, ZZ1, l_max, k_max, get_hx_only, parallel, verbose, bk_check)
 
 
-def gen_sys(self, AA0, BB0, CC0, DD0, fb0, fc0, fd0, ZZ0, ZZ1, l_max, k_max, get_hx_only, parallel, verbose):
+class BKError(ValueError):
+    """Raised if the Blanchard-Kahn conditions are not satisfied
+    """
+    pass
+
+
+def gen_sys(self, AA0, BB0, CC0, DD0, fb0, fc0, fd0, ZZ0, ZZ1, l_max, k_max, get_hx_only, parallel, verbose, bk_check=False):
     """Generate system matrices expressed in the one-sided, first-order compressed dimensionality reduction given a set of parameters. 
 
     Details can be found in "Efficient Solution of Models with Occasionally Binding Constraints" (Gregor Boehl).
@@ -129,6 +137,8 @@ def gen_sys(self, AA0, BB0, CC0, DD0, fb0, fc0, fd0, ZZ0, ZZ1, l_max, k_max, get
         The expected number of periods for which the constraint binds (defaults to 17).
     verbose : bool or int, optional
         Level of verbosity
+    bk_check : bool, optional
+        Whether to check the Blanchard-Kahn conditions by counting the generalized eigenvalues before solving the model. This is cheap and allows to reject indeterminate or explosive parameters early (raising a `BKError`). Defaults to False.
     """
 
     st = time.time()
@@ -169,42 +179,29 @@ def gen_sys(self, AA0, BB0, CC0, DD0, fb0, fc0, fd0, ZZ0, ZZ1, l_max, k_max, get
     fc0 = -fc0/fb0[c_arg]
     fb0 = -fb0/fb0[c_arg]
 
+    PU, MU, PR, MR, fb0, fc0, masks = get_pencil(
+        AA0, BB0, CC0, DD0, fb0, fc0, fd0, c_arg)
+    inall, inq, inp = masks
+
     # create auxiliry vars for those both in A & C
-    inall = ~fast0(AA0, 0) & ~fast0(CC0, 0)
     if np.any(inall):
         vv0 = np.hstack((vv0, [v + '_lag' for v in vv0[inall]]))
-        AA0 = np.pad(AA0, ((0, sum(inall)), (0, sum(inall))))
-        BB0 = np.pad(BB0, ((0, sum(inall)), (0, sum(inall))))
-        CC0 = np.pad(CC0, ((0, sum(inall)), (0, sum(inall))))
-        DD0 = np.pad(DD0, ((0, sum(inall)), (0, 0)))
-        fb0 = np.pad(fb0, (0, sum(inall)))
-        fc0 = np.pad(fc0, (0, sum(inall)))
 
         if ZZ0 is not None:
             ZZ0 = np.pad(ZZ0, ((0, 0), (0, sum(inall))))
 
-        BB0[-sum(inall):, -sum(inall):] = np.eye(sum(inall))
-        BB0[-sum(inall):, :-sum(inall)][:, inall] = -np.eye(sum(inall))
-        CC0[:, -sum(inall):] = CC0[:, :-sum(inall)][:, inall]
-        CC0[:, :-sum(inall)][:, inall] = 0
-
-    # create representation in y-space
-    AA0 = np.pad(AA0, ((0, dimeps), (0, dimeps)))
-    BB0 = sl.block_diag(BB0, np.eye(dimeps))
-    CC0 = np.block([[CC0, DD0], [np.zeros((dimeps, AA0.shape[1]))]])
-    fb0 = np.pad(fb0, (0, dimeps))
-    if fd0 is not None:
-        fc0 = -np.hstack((fc0, fd0))
-    else:
-        fc0 = np.pad(fc0, (0, dimeps))
-
-    inq = ~fast0(CC0, 0) | ~fast0(fc0)
-    inp = (~fast0(AA0, 0) | ~fast0(BB0, 0)) & ~inq
-
     # check dimensionality
     dimq = sum(inq)
     dimp = sum(inp)
 
+    if bk_check:
+        # counting is much cheaper than the ordered QZ in `klein`. The rotation below does not change the eigenvalues
+        alp, bet = sl.eigvals(PU, MU, homogeneous_eigvals=True)
+        nouc = sum(ouc(alp, bet))
+        if nouc != dimq:
+            raise BKError('B-K condition not satisfied: %s states but %s Evs inside the unit circle.' % (
+                dimq, nouc))
+
     # create hx. Do this early so that the procedure can be stopped if get_hx_only
     if ZZ0 is None:
         # must create dummies
@@ -216,14 +213,7 @@ def gen_sys(self, AA0, BB0, CC0, DD0, fb0, fc0, fd0, ZZ0, ZZ1, l_max, k_max, get
         zq = ZZ0[:, inq[:-dimeps]]
         zc = ZZ1
 
-    AA = np.pad(AA0, ((0, 1), (0, 0)))
-    BBU = np.vstack((BB0, fb0))
-    CCU = np.vstack((CC0, fc0))
-    BBR = np.pad(BB0, ((0, 1), (0, 0)))
-    CCR = np.pad(CC0, ((0, 1), (0, 0)))
-    BBR[-1, list(vv0).index(str(self.const_var))] = -1
-
-    fb0[list(vv0).index(str(self.const_var))] = 0
+    fb0[c_arg] = 0
 
     self.svv = vv0[inq[:-dimeps]]
     self.cvv = vv0[inp[:-dimeps]]
@@ -239,11 +229,6 @@ def gen_sys(self, AA0, BB0, CC0, DD0, fb0, fc0, fd0, ZZ0, ZZ1, l_max, k_max, get
     if get_hx_only:
         return self
 
-    PU = -np.hstack((BBU[:, inq], AA[:, inp]))
-    MU = np.hstack((CCU[:, inq], BBU[:, inp]))
-
-    PR = -np.hstack((BBR[:, inq], AA[:, inp]))
-    MR = np.hstack((CCR[:, inq], BBR[:, inp]))
     gg = np.pad([float(self.x_bar)], (dimp+dimq-1, 0))
 
     # avoid QL in jitted funcs
@@ -281,4 +266,226 @@ def gen_sys(self, AA0, BB0, CC0, DD0, fb0, fc0, fd0, ZZ0, ZZ1, l_max, k_max, get
 
     return self
 
+
+def get_pencil(AA0, BB0, CC0, DD0, fb0, fc0, fd0, c_arg, masks=None, diff=False):
+    """Create the (unrotated) pencils of the unconstrained and the constrained system in y-space
+
+    With `diff=True` the arguments are interpreted as the derivatives of the (normalized) system matrices. Constant entries are then dropped, such that the returned pencils are the derivatives of the pencils. This requires the masks of the undifferentiated system.
+    """
+
+    if masks is None:
+        inall = ~fast0(AA0, 0) & ~fast0(CC0, 0)
+    else:
+        inall, inq, inp = masks
+
+    nall = sum(inall)
+    dimeps = DD0.shape[1]
+
+    # create auxiliry vars for those both in A & C
+    if nall:
+        AA0 = np.pad(AA0, ((0, nall), (0, nall)))
+        BB0 = np.pad(BB0, ((0, nall), (0, nall)))
+        CC0 = np.pad(CC0, ((0, nall), (0, nall)))
+        DD0 = np.pad(DD0, ((0, nall), (0, 0)))
+        fb0 = np.pad(fb0, (0, nall))
+        fc0 = np.pad(fc0, (0, nall))
+
+        if not diff:
+            BB0[-nall:, -nall:] = np.eye(nall)
+            BB0[-nall:, :-nall][:, inall] = -np.eye(nall)
+        CC0[:, -nall:] = CC0[:, :-nall][:, inall]
+        CC0[:, :-nall][:, inall] = 0
+
+    # create representation in y-space
+    AA0 = np.pad(AA0, ((0, dimeps), (0, dimeps)))
+    BB0 = sl.block_diag(BB0, np.eye(dimeps)*(not diff))
+    CC0 = np.block([[CC0, DD0], [np.zeros((dimeps, AA0.shape[1]))]])
+    fb0 = np.pad(fb0, (0, dimeps))
+    if fd0 is not None:
+        fc0 = -np.hstack((fc0, fd0))
+    else:
+        fc0 = np.pad(fc0, (0, dimeps))
+
+    if masks is None:
+        inq = ~fast0(CC0, 0) | ~fast0(fc0)
+        inp = (~fast0(AA0, 0) | ~fast0(BB0, 0)) & ~inq
+
+    AA = np.pad(AA0, ((0, 1), (0, 0)))
+    BBU = np.vstack((BB0, fb0))
+    CCU = np.vstack((CC0, fc0))
+    BBR = np.pad(BB0, ((0, 1), (0, 0)))
+    CCR = np.pad(CC0, ((0, 1), (0, 0)))
+    if not diff:
+        BBR[-1, c_arg] = -1
+
+    PU = -np.hstack((BBU[:, inq], AA[:, inp]))
+    MU = np.hstack((CCU[:, inq], BBU[:, inp]))
+
+    PR = -np.hstack((BBR[:, inq], AA[:, inp]))
+    MR = np.hstack((CCR[:, inq], BBR[:, inp]))
+
+    return PU, MU, PR, MR, fb0, fc0, (inall, inq, inp)
+
+
+def get_sys_jac(self, ppar):
+    """Get the jacobians of the system matrices w.r.t. the parsed parameters
+
+    The derivatives are taken from the symbolic model and compiled on first use. If the symbolic system is not available (or can not be differentiated), central finite differences are used instead.
+
+    Parameters
+    ----------
+    ppar : list
+        The parsed parameters (parameters and `para_func` parameters)
+
+    Returns
+    -------
+    dict
+        For each system matrix an array of shape (len(ppar), *matrix.shape)
+    """
+
+    names = ('AA', 'BB', 'CC', 'PSI', 'bb', 'bb_PSI', 'ZZ0', 'ZZ1', 'QQ')
+
+    if not hasattr(self, 'sys_jac'):
+
+        from sympy.utilities.lambdify import lambdify
+
+        self.sys_jac = {}
+        plist = self.parameters + self['other_para']
+
+        for name in names:
+            try:
+                mat = self.sys_sym[name]
+                self.sys_jac[name] = lambdify(
+                    [plist], [mat.diff(p) for p in plist])
+                # test if derivatives can be evaluated
+                self.sys_jac[name](ppar)
+            except Exception:
+                self.sys_jac[name] = None
+
+    jac = {}
+    for name in names:
+
+        if self.sys_jac[name] is not None:
+            jac[name] = np.array(self.sys_jac[name](ppar), dtype=float)
+            continue
+
+        func = getattr(self, name)
+        jac[name] = np.empty((len(ppar),) + np.shape(func(ppar)))
+
+        for i, p in enumerate(ppar):
+            h = 1e-6*max(1, abs(p))
+            pu, pl = list(ppar), list(ppar)
+            pu[i] += h
+            pl[i] -= h
+            jac[name][i] = (np.array(func(pu), dtype=float) -
+                            np.array(func(pl), dtype=float))/(2*h)
+
+    return jac
+
+
+def gen_sys_grad(self, dpar):
+    """Get the derivatives of the linear solution w.r.t. the parameters
+
+    The derivatives of the symbolic system matrices are propagated through the construction of the pencil and the Klein solution using implicit differentiation. Assumes that `gen_sys` was called with the current parameters.
+
+    Parameters
+    ----------
+    dpar : array
+        Array of shape (k, len(self.par)) with the directions in which to take the derivatives. Typically the rows of an identity matrix that correspond to the parameters of interest
+
+    Returns
+    -------
+    tuple
+        The derivatives (each with leading dimension k) of `pmat[1, 0]` and `qmat[1, 0]`, of the observation matrices `hx`, and of the shock covariance `QQ @ QQ`
+    """
+
+    par = np.array(self.par, dtype=float)
+    dpar = np.atleast_2d(dpar)
+    k = len(dpar)
+
+    # derivatives of para_func parameters via central differences
+    dpsi = np.empty((k, len(self['other_para'])))
+    for i, d in enumerate(dpar):
+        h = 1e-6*max(1, abs(par @ d))
+        dpsi[i] = (np.array(self.psi(list(par + h*d))) -
+                   np.array(self.psi(list(par - h*d))))/(2*h)
+
+    ppar = self.ppar
+    dppar = np.hstack((dpar, dpsi))
+    jac = get_sys_jac(self, ppar)
+    dmat = {name: np.tensordot(dppar, jac[name], 1) for name in jac}
+
+    vv0 = np.array([v.name for v in self.variables])
+    nvar = len(vv0)
+    c_arg = list(vv0).index(str(self.const_var))
+
+    # the system at the current parameters (as in `gen_sys_from_yaml`)
+    AA0 = self.AA(ppar)
+    BB0 = self.BB(ppar)
+    CC0 = self.CC(ppar)
+    DD0 = -self.PSI(ppar).astype(float)
+    fbc = self.bb(ppar).flatten().astype(float)
+    fd0 = -self.bb_PSI(ppar).flatten().astype(float)
+    fb0 = -fbc[:nvar]
+    fc0 = -fbc[nvar:]
+    QQ = self.QQ(ppar).astype(float)
+
+    fbn = -fb0/fb0[c_arg]
+    fcn = -fc0/fb0[c_arg]
+
+    PU, MU, _, _, _, _, masks = get_pencil(
+        AA0, BB0, CC0, DD0, fbn, fcn, fd0, c_arg)
+    inall, inq, inp = masks
+
+    dimq = sum(inq)
+    dimp = sum(inp)
+    dimeps = DD0.shape[1]
+
+    dPU = np.empty((k,) + PU.shape)
+    dMU = np.empty((k,) + MU.shape)
+
+    for i in range(k):
+
+        dfbc = dmat['bb'][i].flatten()
+        dfb0 = -dfbc[:nvar]
+        dfc0 = -dfbc[nvar:]
+
+        # derivatives of the normalization
+        dfbn = -(dfb0 + fbn*dfb0[c_arg])/fb0[c_arg]
+        dfcn = -(dfc0 + fcn*dfb0[c_arg])/fb0[c_arg]
+
+        dPU[i], dMU[i] = get_pencil(dmat['AA'][i], dmat['BB'][i], dmat['CC'][i], -dmat['PSI'][i], dfbn,
+                                    dfcn, -dmat['bb_PSI'][i].flatten(), c_arg, masks=masks, diff=True)[:2]
+
+    omg, lam, _ = self.sys
+    Y = np.vstack((np.eye(dimq), omg))
+
+    # implicit differentiation of PU @ Y @ lam = MU @ Y w.r.t. (omg, lam)
+    Iq = np.eye(dimq)
+    jac_omg = np.kron(lam.T, PU[:, dimq:]) - np.kron(Iq, MU[:, dimq:])
+    jac_lam = np.kron(Iq, PU @ Y)
+    rhs = dMU @ Y - dPU @ Y @ lam
+    rhs = rhs.transpose(0, 2, 1).reshape(k, -1).T
+
+    sol = np.linalg.solve(np.hstack((jac_omg, jac_lam)), rhs)
+    domg = sol[:dimp*dimq].T.reshape(k, dimq, dimp).transpose(0, 2, 1)
+    dlam = sol[dimp*dimq:].T.reshape(k, dimq, dimq).transpose(0, 2, 1)
+
+    # p is given by MU[:, p] @ pmat = PU @ Y @ lam - MU[:, q]
+    pmat = self.precalc_mat[0][1, 0]
+    dY = np.concatenate((np.zeros((k, dimq, dimq)), domg), axis=1)
+    dK = dPU @ Y @ lam + PU @ dY @ lam + PU @ Y @ dlam - dMU[..., :dimq]
+    dpmat = np.linalg.pinv(MU[:, dimq:]) @ (dK - dMU[..., dimq:] @ pmat)
+
+    # observation equation
+    dZZ0 = np.pad(dmat['ZZ0'], ((0, 0), (0, 0), (0, sum(inall))))
+    dhx = dZZ0[..., inp[:-dimeps]], dZZ0[..., inq[:-dimeps]
+                                         ], dmat['ZZ1'].reshape(k, -1)
+
+    dQQ = dmat['QQ'] @ QQ + QQ @ dmat['QQ']
+
+    return dpmat, dlam, dhx, dQQ
+
+
 DSGE.gen_sys = gen_sys_from_yaml
+DSGE.gen_sys_grad = gen_sys_grad
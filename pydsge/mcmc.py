@@ -7,11 +7,513 @@ import os
 import pathos
 import time
 import tqdm
+import threading
+from collections import deque
+from itertools import islice
 from datetime import datetime
+from emcee.moves import StretchMove
+from emcee.state import State
+from emcee import __version__ as emcee_version
+from emcee.backends import HDFBackend
 from .mpile import get_par
+from .stats import StreamingDiagnostics
 
 
-def mcmc(self, p0=None, nsteps=3000, nwalks=None, tune=None, moves=None, temp=False, seed=None, backend=True, suffix=None, linear=None, resume=False, append=False, update_freq=None, lprob_seed=None, biject=False, report=None, verbose=False, debug=False, **samplerargs):
+def lprob_bij(self, x, biject=False, bounds=None, **lprob_args):
+    """`lprob` on the (possibly bijected) parameter space of the sampler
+
+    The bijection is passed explicitly since the workers do not see changes to `fdict` that were made after they were started.
+    """
+
+    if biject:
+        x = (bounds[1] - bounds[0])/(1 + np.exp(x)) + bounds[0]
+
+    return self.lprob(x, **lprob_args)
+
+
+class DelayedAcceptanceMove(StretchMove):
+    """Stretch move with delayed acceptance
+
+    Proposals are first accepted or rejected based on a cheap approximation of the log-probability. Only the proposals that survive this screening are evaluated with the actual log-probability, and are then accepted or rejected based on the ratio of the errors of the approximation. The target distribution is preserved as long as the approximation is finite wherever the target is (Christen & Fox, 2005).
+
+    Parameters
+    ----------
+    screen : callable
+        Function that returns the approximate log-probabilities for an array of positions
+    kwargs : keyword arguments, optional
+        Further arguments to `emcee.moves.StretchMove`
+    """
+
+    def __init__(self, screen, **kwargs):
+
+        self.screen = screen
+        self.screen_lp = None
+        # number of proposals and number of evaluations of the actual log-probability
+        self.nproposed = 0
+        self.nevaluated = 0
+
+        super().__init__(**kwargs)
+
+    def propose(self, model, state):
+
+        nwalkers, ndim = state.coords.shape
+        if nwalkers < 2 * ndim and not self.live_dangerously:
+            raise RuntimeError(
+                "It is unadvisable to use a red-blue move with fewer walkers than twice the number of dimensions.")
+
+        if self.screen_lp is None or len(self.screen_lp) != nwalkers:
+            self.screen_lp = np.array(self.screen(state.coords), dtype=float)
+
+        accepted = np.zeros(nwalkers, dtype=bool)
+        all_inds = np.arange(nwalkers)
+        inds = all_inds % self.nsplits
+        if self.randomize_split:
+            model.random.shuffle(inds)
+
+        for split in range(self.nsplits):
+            S1 = inds == split
+            walkers = all_inds[S1]
+
+            sets = [state.coords[inds == j] for j in range(self.nsplits)]
+            q, factors = self.get_proposal(
+                sets[split], sets[:split] + sets[split + 1:], model.random)
+
+            new_screen_lp = np.array(self.screen(q), dtype=float)
+            new_log_probs = np.full(len(q), -np.inf)
+
+            with np.errstate(invalid='ignore'):
+                # first stage: the approximation
+                lnpdiff = factors + new_screen_lp - self.screen_lp[walkers]
+                survived = lnpdiff > np.log(model.random.rand(len(q)))
+
+                if survived.any():
+                    new_log_probs[survived] = model.compute_log_prob_fn(
+                        q[survived])[0]
+
+                # second stage: correct for the error of the approximation
+                lnpdiff = new_log_probs - state.log_prob[walkers] - \
+                    new_screen_lp + self.screen_lp[walkers]
+                acc = survived & (
+                    lnpdiff > np.log(model.random.rand(len(q))))
+
+            accepted[walkers[acc]] = True
+            self.screen_lp[walkers[acc]] = new_screen_lp[acc]
+
+            self.nproposed += len(q)
+            self.nevaluated += np.sum(survived)
+
+            new_state = State(q, log_prob=new_log_probs)
+            state = self.update(state, new_state, accepted, S1)
+
+        return state, accepted
+
+
+class ParallelTemperingMove(StretchMove):
+    """Stretch moves on a ladder of tempered ensembles, with swaps between adjacent temperatures
+
+    The state of the sampler is the ensemble at the lowest temperature, the ensembles at the higher temperatures are kept by the move itself. Only the likelihood is tempered, the log-prior is subtracted from the log-probability to do so. The proposals of all temperatures are evaluated in a single call, such that they are distributed over the pool together. After each update, the walkers of adjacent temperatures are paired randomly and swapped with the usual Metropolis-Hastings probability. During the first `adapt` iterations, the temperatures (apart from the lowest and the highest) are adapted such that the swap rates are equal across the ladder (Vousden, Farr & Mandel, 2016).
+
+    Parameters
+    ----------
+    lprior : callable
+        Function that returns the log-prior densities for an array of positions
+    ntemps : int
+        Number of temperatures
+    tmax : float, optional
+        Highest temperature. Defaults to a geometric ladder with ratio `1 + sqrt(2/ndim)`
+    adapt : int, optional
+        Number of iterations during which the ladder is adapted. Defaults to 0
+    adaptation_lag : int, optional
+        Time scale over which the adaptation decays. Defaults to 1000
+    adaptation_time : int, optional
+        Inverse of the initial adaptation speed. Defaults to 100
+    kwargs : keyword arguments, optional
+        Further arguments to `emcee.moves.StretchMove`
+    """
+
+    def __init__(self, lprior, ntemps, tmax=None, adapt=0, adaptation_lag=1000, adaptation_time=100, **kwargs):
+
+        self.lprior = lprior
+        self.ntemps = ntemps
+        self.tmax = tmax
+        self.adapt = adapt
+        self.adaptation_lag = adaptation_lag
+        self.adaptation_time = adaptation_time
+
+        self.betas = None
+        self.coords = None
+        self.iteration = 0
+        # accepted swaps between adjacent temperatures
+        self.nswaps = np.zeros(ntemps - 1)
+
+        super().__init__(**kwargs)
+
+    def setup(self, state):
+
+        nwalkers, ndim = state.coords.shape
+
+        if self.betas is None:
+            ratio = self.tmax**(1/(self.ntemps - 1)
+                                ) if self.tmax else 1 + np.sqrt(2/ndim)
+            self.betas = ratio**-np.arange(self.ntemps, dtype=float)
+
+        self.coords = np.tile(state.coords, (self.ntemps, 1, 1))
+        self.log_prob = np.tile(state.log_prob, (self.ntemps, 1))
+        self.log_prior = np.tile(
+            np.array(self.lprior(state.coords), dtype=float), (self.ntemps, 1))
+
+    def tempered(self, log_prob, log_prior, betas):
+
+        with np.errstate(invalid='ignore'):
+            lp = betas[:, None]*(log_prob - log_prior) + log_prior
+
+        return np.where(np.isfinite(log_prob), lp, -np.inf)
+
+    def swap(self, random):
+        """Swap walkers between adjacent temperatures, from the hottest to the coldest
+        """
+
+        nwalkers = self.log_prob.shape[1]
+        rates = np.zeros(self.ntemps - 1)
+
+        for k in range(self.ntemps - 1, 0, -1):
+
+            # walker `i` at temperature `k-1` is paired with walker `perm[i]` at temperature `k`
+            perm = random.permutation(nwalkers)
+
+            with np.errstate(invalid='ignore'):
+                ll_hot = self.log_prob[k, perm] - self.log_prior[k, perm]
+                ll_cold = self.log_prob[k-1] - self.log_prior[k-1]
+                lnpdiff = (self.betas[k-1] - self.betas[k])*(ll_hot - ll_cold)
+
+            acc = np.nan_to_num(lnpdiff, nan=-np.inf) > np.log(
+                random.rand(nwalkers))
+            rates[k-1] = np.mean(acc)
+
+            i, j = np.flatnonzero(acc), perm[acc]
+            for arr in (self.coords, self.log_prob, self.log_prior):
+                arr[k-1, i], arr[k, j] = arr[k, j], arr[k-1, i]
+
+        return rates
+
+    def adapt_ladder(self, rates):
+
+        kappa = self.adaptation_lag / \
+            (self.iteration + self.adaptation_lag)/self.adaptation_time
+        dtemps = np.diff(1/self.betas[:-1]) * np.exp(kappa*(rates[:-1] - rates[1:]))
+        self.betas[1:-1] = 1/(np.cumsum(dtemps) + 1/self.betas[0])
+
+    @property
+    def swap_rates(self):
+        """Swap acceptance rates between adjacent temperatures
+        """
+        return self.nswaps/max(self.iteration, 1)
+
+    def propose(self, model, state):
+
+        nwalkers, ndim = state.coords.shape
+        if nwalkers < 2 * ndim and not self.live_dangerously:
+            raise RuntimeError(
+                "It is unadvisable to use a red-blue move with fewer walkers than twice the number of dimensions.")
+
+        if self.coords is None or self.coords.shape[1] != nwalkers:
+            self.setup(state)
+
+        self.coords[0] = state.coords
+        self.log_prob[0] = state.log_prob
+        old_coords = state.coords.copy()
+
+        all_inds = np.arange(nwalkers)
+        inds = all_inds % self.nsplits
+        if self.randomize_split:
+            model.random.shuffle(inds)
+
+        for split in range(self.nsplits):
+            S1 = inds == split
+
+            qs, factors = [], []
+            for k in range(self.ntemps):
+                sets = [self.coords[k, inds == j] for j in range(self.nsplits)]
+                q, f = self.get_proposal(
+                    sets[split], sets[:split] + sets[split + 1:], model.random)
+                qs.append(q)
+                factors.append(f)
+
+            # all temperatures in one go
+            q = np.vstack(qs)
+            new_log_probs = np.array(model.compute_log_prob_fn(q)[
+                                     0], dtype=float).reshape(self.ntemps, -1)
+            new_log_priors = np.array(self.lprior(q), dtype=float).reshape(
+                self.ntemps, -1)
+            q = q.reshape(self.ntemps, -1, ndim)
+
+            with np.errstate(invalid='ignore'):
+                lnpdiff = np.array(factors) + self.tempered(new_log_probs, new_log_priors, self.betas) - \
+                    self.tempered(self.log_prob[:, S1],
+                                  self.log_prior[:, S1], self.betas)
+            acc = lnpdiff > np.log(model.random.rand(*lnpdiff.shape))
+
+            for arr, new in ((self.coords, q), (self.log_prob, new_log_probs), (self.log_prior, new_log_priors)):
+                sub = arr[:, S1]
+                sub[acc] = new[acc]
+                arr[:, S1] = sub
+
+        rates = self.swap(model.random)
+        self.nswaps += rates
+
+        if self.iteration < self.adapt:
+            self.adapt_ladder(rates)
+        self.iteration += 1
+
+        accepted = np.any(self.coords[0] != old_coords, axis=1)
+        new_state = State(self.coords[0].copy(), log_prob=self.log_prob[0].copy(
+        ), blobs=state.blobs, random_state=state.random_state)
+
+        return new_state, accepted
+
+
+class BufferedHDFBackend(HDFBackend):
+    """HDF5 backend that writes the chain asynchronously
+
+    Steps are buffered in memory and written in chunks of `flush_every` iterations by a background thread. The last `tail` iterations are also kept in memory, such that reading the recent chain (e.g. for reporting) does not touch the file. The datasets are chunked along the iterations and compressed. The file has the same layout as the one of `emcee.backends.HDFBackend`. Call `flush` to make sure that all steps are written, e.g. after interrupting the sampler. Blobs are not supported.
+
+    Parameters
+    ----------
+    filename : str
+        The HDF5 file
+    flush_every : int, optional
+        Number of iterations written at once. Defaults to 100
+    tail : int, optional
+        Number of iterations kept in memory. Defaults to 10000
+    compression : str, optional
+        Compression filter of `h5py`. Defaults to 'gzip'
+    kwargs : keyword arguments, optional
+        Further arguments to `emcee.backends.HDFBackend`
+    """
+
+    def __init__(self, filename, flush_every=100, tail=10000, compression='gzip', **kwargs):
+
+        super().__init__(filename, compression=compression, **kwargs)
+
+        self.flush_every = flush_every
+        self.tail = tail
+        self.writer = None
+        self.error = None
+        self.loaded = False
+
+    def load(self):
+        """Read the state of the chain from the file once
+        """
+
+        if self.loaded:
+            return
+
+        with self.open() as f:
+            g = f[self.name]
+            self.nwalkers = g.attrs['nwalkers']
+            self.ndim = g.attrs['ndim']
+            self.niter = g.attrs['iteration']
+            self.acc = g['accepted'][...]
+            self.rstate = [v for k, v in sorted(
+                g.attrs.items()) if k.startswith('random_state_')] or None
+
+            start = max(self.niter - self.tail, 0)
+            self.tail_chain = deque(
+                g['chain'][start:self.niter], maxlen=self.tail)
+            self.tail_log_prob = deque(
+                g['log_prob'][start:self.niter], maxlen=self.tail)
+
+        self.nwritten = self.niter
+        self.buffer = []
+        self.loaded = True
+
+    def reset(self, nwalkers, ndim):
+
+        self.join()
+
+        with self.open('a') as f:
+            if self.name in f:
+                del f[self.name]
+
+            g = f.create_group(self.name)
+            g.attrs['version'] = emcee_version
+            g.attrs['nwalkers'] = nwalkers
+            g.attrs['ndim'] = ndim
+            g.attrs['has_blobs'] = False
+            g.attrs['iteration'] = 0
+
+            g.create_dataset('accepted', data=np.zeros(nwalkers))
+            g.create_dataset('chain', (0, nwalkers, ndim), maxshape=(None, nwalkers, ndim), chunks=(self.flush_every, nwalkers, ndim),
+                             dtype=self.dtype, compression=self.compression, compression_opts=self.compression_opts)
+            g.create_dataset('log_prob', (0, nwalkers), maxshape=(None, nwalkers), chunks=(self.flush_every, nwalkers),
+                             dtype=self.dtype, compression=self.compression, compression_opts=self.compression_opts)
+
+        self.loaded = False
+        self.load()
+
+    @property
+    def initialized(self):
+        return self.loaded or super().initialized
+
+    def has_blobs(self):
+        return False
+
+    @property
+    def shape(self):
+        self.load()
+        return self.nwalkers, self.ndim
+
+    @property
+    def iteration(self):
+        self.load()
+        return self.niter
+
+    @property
+    def accepted(self):
+        self.load()
+        return self.acc
+
+    @property
+    def random_state(self):
+        self.load()
+        return self.rstate
+
+    def grow(self, ngrow, blobs):
+        # the datasets are resized when writing
+        if blobs is not None:
+            raise NotImplementedError(
+                'The `BufferedHDFBackend` does not support blobs.')
+
+    def save_step(self, state, accepted):
+
+        self._check(state, accepted)
+
+        coords = np.array(state.coords, dtype=self.dtype)
+        log_prob = np.array(state.log_prob, dtype=self.dtype)
+
+        self.buffer.append((coords, log_prob))
+        self.tail_chain.append(coords)
+        self.tail_log_prob.append(log_prob)
+
+        self.acc = self.acc + accepted
+        self.rstate = state.random_state
+        self.niter += 1
+
+        if len(self.buffer) >= self.flush_every:
+            self.flush(wait=False)
+
+    def get_value(self, name, flat=False, thin=1, discard=0):
+
+        self.load()
+
+        if name == 'blobs':
+            return None
+
+        first = discard + thin - 1
+        tail_start = self.niter - len(self.tail_chain)
+
+        if self.niter <= 0 or first < tail_start:
+            # not (or no longer) in memory
+            self.flush()
+            return super().get_value(name, flat=flat, thin=thin, discard=discard)
+
+        tail = self.tail_chain if name == 'chain' else self.tail_log_prob
+        # only copy the requested iterations
+        v = list(islice(tail, first - tail_start, None, thin))
+        v = np.array(v) if v else np.empty((0,) + np.shape(tail[0] if tail else ()))
+
+        if flat:
+            s = list(v.shape[1:])
+            s[0] = np.prod(v.shape[:2])
+            return v.reshape(s)
+
+        return v
+
+    def write(self, start, chunk, accepted, random_state):
+
+        try:
+            with self.open('a') as f:
+                g = f[self.name]
+                stop = start + len(chunk)
+
+                g['chain'].resize(stop, axis=0)
+                g['log_prob'].resize(stop, axis=0)
+                g['chain'][start:stop] = np.array([c[0] for c in chunk])
+                g['log_prob'][start:stop] = np.array([c[1] for c in chunk])
+                g['accepted'][:] = accepted
+
+                for i, v in enumerate(random_state or ()):
+                    g.attrs['random_state_{0}'.format(i)] = v
+
+                g.attrs['iteration'] = stop
+
+        except Exception as e:
+            self.error = e
+
+    def join(self):
+        """Wait until the background thread is done writing
+        """
+
+        if self.writer is not None:
+            self.writer.join()
+            self.writer = None
+
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def flush(self, wait=True):
+        """Write all buffered steps to the file
+
+        Parameters
+        ----------
+        wait : bool, optional
+            Wait until the steps are written. Otherwise the steps are written by a background thread. Defaults to True
+        """
+
+        if not self.loaded:
+            return
+
+        if self.buffer:
+            chunk, self.buffer = self.buffer, []
+            start, self.nwritten = self.nwritten, self.nwritten + len(chunk)
+
+            # only one thread writes to the file at a time
+            self.join()
+            self.writer = threading.Thread(target=self.write, args=(
+                start, chunk, self.acc.copy(), self.rstate))
+            self.writer.start()
+
+        if wait:
+            self.join()
+
+    def __del__(self):
+        try:
+            self.flush()
+        except Exception:
+            pass
+
+
+def mcmc(self, p0=None, nsteps=3000, nwalks=None, tune=None, moves=None, temp=False, seed=None, backend=True, suffix=None, linear=None, resume=False, append=False, update_freq=None, lprob_seed=None, biject=False, vectorize=False, delayed_acceptance=False, ntemps=None, tmax=None, hess_proposal=False, flush_every=100, report=None, verbose=False, debug=False, **samplerargs):
+    """Run the emcee ensemble sampler
+
+    ...
+
+    Parameters
+    ----------
+    vectorize : bool, optional
+        Evaluate the walkers of each step in batches (see `lprob_batch`), with one batch per worker. Defaults to `False`.
+    delayed_acceptance : bool, optional
+        Screen the proposals with the likelihood of the linear model (using the Kalman filter) and only evaluate the nonlinear likelihood for the proposals that survive the screening (see `DelayedAcceptanceMove`). Only for the nonlinear model, and can not be combined with custom `moves`. Defaults to `False`.
+    ntemps : int, optional
+        If larger than one, the sampler runs `ntemps` tempered ensembles in parallel and swaps walkers between them (see `ParallelTemperingMove`). The temperature ladder is adapted during the first `nsteps - tune` iterations. Only the ensemble at `temp` is stored, and the ensembles at higher temperatures are reinitialized when resuming. Can not be combined with custom `moves`. Defaults to `None`.
+    tmax : float, optional
+        Highest temperature of the ladder. Defaults to a geometric ladder that is appropriate for a Gaussian posterior.
+    hess_proposal : bool or float, optional
+        Mix the stretch move with a Gaussian random walk whose covariance is the (scaled) inverse of the negative Hessian at the mode (see `mode_cov`). If a float, this is the share of the Gaussian moves (otherwise .5). Not for bijected chains, and can not be combined with custom `moves`. Defaults to `False`.
+    flush_every : int, optional
+        The chain is written to the backend file in chunks of this many iterations by a background thread (see `BufferedHDFBackend`). If zero or None, every iteration is written immediately. Defaults to 100.
+    """
 
     import pathos
     import emcee
@@ -39,22 +541,25 @@ def mcmc(self, p0=None, nsteps=3000, nwalks=None, tune=None, moves=None, temp=Fa
 
     self.fdict['biject'] = biject
 
-    from grgrlib.core import serializer
+    from .parallel import WorkerTask
+    from .estimation import kill_timeout
 
     if hasattr(self, 'pool'):
-        from .estimation import create_pool
-        create_pool(self)
-
-    lprob_global = serializer(self.lprob)
+        from .estimation import get_pool
+        get_pool(self)
 
     if isinstance(temp, bool) and not temp:
         temp = 1
 
-    def lprob(par): return lprob_global(
-        par, linear=linear, verbose=verbose, temp=temp, lprob_seed=lprob_seed or 'set')
-
+    # only these descriptors are sent to the workers
+    lprob_args = dict(linear=linear, verbose=verbose,
+                      temp=temp, lprob_seed=lprob_seed or 'set')
     bnd = np.array(self.fdict['prior_bounds'])
 
+    lprob_scaled = WorkerTask(self, lprob_bij, timeout=kill_timeout(
+        self), fallback=-np.inf, biject=biject, bounds=bnd, **lprob_args)
+    lprob_batch = WorkerTask(self, 'lprob_batch', **lprob_args)
+
     def bjfunc(x):
         if not biject:
             return x
@@ -67,7 +572,43 @@ def mcmc(self, p0=None, nsteps=3000, nwalks=None, tune=None, moves=None, temp=Fa
         x = (x - bnd[0])/(bnd[1] - bnd[0])
         return np.log(1/x - 1)
 
-    def lprob_scaled(x): return lprob(bjfunc(x))
+    def lprob_batch_scaled(xs): return self.batch_map(lprob_batch, bjfunc(xs))
+
+    if delayed_acceptance:
+
+        if linear or self.filter.name == 'KalmanFilter':
+            raise TypeError(
+                'Delayed acceptance is only useful for the nonlinear model.')
+        if moves is not None:
+            raise TypeError(
+                'Delayed acceptance can not be combined with other `moves`.')
+
+        lprob_linear = WorkerTask(
+            self, 'lprob_batch', **dict(lprob_args, linear=True))
+        moves = DelayedAcceptanceMove(
+            lambda xs: self.batch_map(lprob_linear, bjfunc(xs)))
+
+    if hess_proposal:
+
+        if moves is not None or biject:
+            raise TypeError(
+                'The Hessian proposal can not be combined with other `moves` or `biject`.')
+
+        from .stats import mode_cov
+
+        share = .5 if hess_proposal is True else hess_proposal
+        cov = 2.38**2/self.ndim*mode_cov(self, linear=linear)
+        moves = [(StretchMove(), 1 - share),
+                 (emcee.moves.GaussianMove(cov), share)]
+
+    if ntemps and ntemps > 1:
+
+        if moves is not None:
+            raise TypeError(
+                'Parallel tempering can not be combined with other `moves`.')
+
+        moves = ParallelTemperingMove(lambda xs: self.lprior_batch(
+            bjfunc(xs)), ntemps, tmax=tmax, adapt=nsteps - self.tune)
 
     if self.pool:
         self.pool.clear()
@@ -94,7 +635,10 @@ def mcmc(self, p0=None, nsteps=3000, nwalks=None, tune=None, moves=None, temp=Fa
             suffix = str(suffix) if suffix else '_sampler.h5'
             backend = os.path.join(self.path, self.name+suffix)
 
-        backend = emcee.backends.HDFBackend(backend)
+        if flush_every:
+            backend = BufferedHDFBackend(backend, flush_every=flush_every)
+        else:
+            backend = emcee.backends.HDFBackend(backend)
 
         if not (resume or append):
             if not nwalks:
@@ -109,13 +653,20 @@ def mcmc(self, p0=None, nsteps=3000, nwalks=None, tune=None, moves=None, temp=Fa
         backend = None
 
     if resume:
-        nwalks = backend.get_chain().shape[1]
+        nwalks = backend.shape[0]
 
     if debug:
         sampler = emcee.EnsembleSampler(nwalks, self.ndim, lprob_scaled)
+    elif vectorize:
+        # batches are distributed over the pool by `batch_map`
+        sampler = emcee.EnsembleSampler(
+            nwalks, self.ndim, lprob_batch_scaled, moves=moves, backend=backend, vectorize=True)
     else:
+        # emcee wraps `lprob_scaled`, so the pool must know the limit itself
+        pool = self.pool.limited(
+            kill_timeout(self), -np.inf) if self.pool else None
         sampler = emcee.EnsembleSampler(
-            nwalks, self.ndim, lprob_scaled, moves=moves, pool=self.pool, backend=backend)
+            nwalks, self.ndim, lprob_scaled, moves=moves, pool=pool, backend=backend)
 
     if resume and not p0:
         p0 = sampler.get_last_sample()
@@ -136,8 +687,13 @@ def mcmc(self, p0=None, nsteps=3000, nwalks=None, tune=None, moves=None, temp=Fa
     old_tau = np.inf
     cnt = 0
 
+    # updated with every iteration, such that reporting does not require to go through the whole chain
+    self.diagnostics = StreamingDiagnostics(nwalks, self.ndim)
+
     for result in sampler.sample(p0, iterations=nsteps, **samplerargs):
 
+        self.diagnostics.update(result.coords)
+
         if not verbose:
             lls = list(result)[1]
             maf = np.mean(sampler.acceptance_fraction[-update_freq:])*100
@@ -159,14 +715,15 @@ def mcmc(self, p0=None, nsteps=3000, nwalks=None, tune=None, moves=None, temp=Fa
 
             report(prnttup)
 
-            sample = sampler.get_chain()
+            sample = sampler.get_chain(discard=sampler.iteration - update_freq)
 
-            tau = emcee.autocorr.integrated_time(sample, tol=0)
+            tau, bound = self.diagnostics.tau_window()
             min_tau = np.min(tau).round(2)
             max_tau = np.max(tau).round(2)
             dev_tau = np.max(np.abs(old_tau - tau)/tau)
 
-            tau_sign = '>' if max_tau > sampler.iteration/50 else '<'
+            # a lower bound can not indicate convergence
+            tau_sign = '>' if max_tau > sampler.iteration/50 or bound.any() else '<'
             dev_sign = '>' if dev_tau > .01 else '<'
 
             self.mcmc_summary(chain=bjfunc(sample), tune=update_freq,
@@ -174,10 +731,14 @@ def mcmc(self, p0=None, nsteps=3000, nwalks=None, tune=None, moves=None, temp=Fa
 
             report("Convergence stats: tau is in (%s,%s) (%s%s) and change is %s (%s0.01)." % (
                 min_tau, max_tau, tau_sign, sampler.iteration/50, dev_tau.round(3), dev_sign))
+            if bound.any():
+                report("The autocorrelation time of %s parameter(s) exceeds what can be estimated from %s lags, tau is only a lower bound." % (
+                    bound.sum(), self.diagnostics.maxlag))
+            report("Split R-hat is at most %s and the effective sample size at least %s." % (
+                np.nanmax(self.diagnostics.rhat).round(3), np.nanmin(self.diagnostics.ess).round()))
 
         if cnt and update_freq and not (cnt+1) % update_freq:
-            sample = sampler.get_chain()
-            old_tau = emcee.autocorr.integrated_time(sample, tol=0)
+            old_tau = self.diagnostics.tau
 
         if not verbose:
             pbar.update(1)
@@ -185,14 +746,34 @@ def mcmc(self, p0=None, nsteps=3000, nwalks=None, tune=None, moves=None, temp=Fa
         cnt += 1
 
     pbar.close()
-    if self.pool:
-        self.pool.close()
+
+    if isinstance(backend, BufferedHDFBackend):
+        backend.flush()
 
     if not verbose:
         np.warnings.filterwarnings('default')
 
-    log_probs = sampler.get_log_prob()[-self.tune:]
-    chain = sampler.get_chain()[-self.tune:]
+    if delayed_acceptance:
+        print('[mcmc:]'.ljust(15, ' ') + " Delayed acceptance: %s of %s proposals evaluated with the nonlinear likelihood." %
+              (moves.nevaluated, moves.nproposed))
+
+    if isinstance(moves, ParallelTemperingMove):
+
+        self.fdict['pt_betas'] = moves.betas
+        self.fdict['pt_swap_rates'] = moves.swap_rates
+
+        if backend is not None:
+            with backend.open('a') as f:
+                f[backend.name].attrs['pt_betas'] = moves.betas
+                f[backend.name].attrs['pt_swap_rates'] = moves.swap_rates
+
+        print('[mcmc:]'.ljust(15, ' ') + " Parallel tempering: temperatures are %s, swap rates are %s." %
+              (np.round(1/moves.betas, 3), np.round(moves.swap_rates, 3)))
+
+    # only read the last part of the chain
+    discard = max(sampler.iteration - self.tune, 0) if self.tune else 0
+    log_probs = sampler.get_log_prob(discard=discard)
+    chain = sampler.get_chain(discard=discard)
     chain = chain.reshape(-1, chain.shape[-1])
 
     arg_max = log_probs.argmax()
@@ -349,6 +930,8 @@ def kdes(self, p0=None, nsteps=3000, nwalks=None, tune=None, seed=None, linear=N
 def tmcmc(self, nsteps, nwalks, ntemps, target, update_freq=False, test_lprob=False, verbose=True, debug=False, **mcmc_args):
     """Run Tempered Ensemble MCMC
 
+    See `smc` for a sequential Monte Carlo sampler with adaptive tempering, which also provides the marginal data density.
+
     Parameters
     ----------
     ntemps : int
@@ -403,11 +986,165 @@ def tmcmc(self, nsteps, nwalks, ntemps, target, update_freq=False, test_lprob=Fa
 
         pbar.update()
 
-        pars = self.get_chain()[-1]
-        lprobs_adj = self.get_log_prob()[-1]
+        pars = self.get_chain(tail=1)[-1]
+        lprobs_adj = self.get_log_prob(tail=1)[-1]
         x = pars[lprobs_adj.argmax()]
 
     pbar.close()
     self.fdict['datetime'] = str(datetime.now())
 
     return pars
+
+
+def smc(self, nparts=None, rho=.95, resample_thresh=.5, nmutate=3, linear=None, lprob_seed=None, seed=None, verbose=True, debug=False):
+    """Run a Sequential Monte Carlo sampler with adaptive tempering
+
+    The particles are drawn from the prior and moved to the posterior by tempering the likelihood. Each temperature step is chosen such that the conditional effective sample size (Zhou, Johansen & Aston, 2016) of the reweighting is `rho` times the number of particles. The particles are resampled (systematically) if the effective sample size drops below `resample_thresh`, and then mutated by `nmutate` random walk Metropolis-Hastings steps. The proposal covariance is the covariance of the particles, with a scaling that is adapted towards an acceptance rate of 25% (Herbst & Schorfheide, 2014). All particles are evaluated at once via `batch_map`, such that the pool is fully used. The log marginal data density follows as a by-product.
+
+    Parameters
+    ----------
+    nparts : int, optional
+        Number of particles. Defaults to 50 times the number of parameters
+    rho : float, optional
+        Target ratio of the conditional effective sample size. The closer to one, the more temperature steps are taken. Defaults to .95
+    resample_thresh : float, optional
+        Particles are resampled if the effective sample size relative to the number of particles is below this value. Defaults to .5
+    nmutate : int, optional
+        Number of Metropolis-Hastings steps in each mutation. Defaults to 3
+
+    Returns
+    -------
+    array
+        The (equally weighted) particles of shape (nparts, ndim)
+    """
+
+    import scipy.optimize as so
+    from grgrlib.core import timeprint
+    from .stats import get_prior
+    from .parallel import WorkerTask
+
+    st = time.time()
+    self.debug |= debug
+
+    if not hasattr(self, 'ndim'):
+        self.prep_estim(load_R=True)
+
+    if hasattr(self, 'pool'):
+        from .estimation import get_pool
+        get_pool(self)
+
+    np.random.seed(self.fdict['seed'] if seed is None else seed)
+
+    ndim = self.ndim
+    nparts = nparts or 50*ndim
+
+    lprob_batch = WorkerTask(self, 'lprob_batch', linear=linear,
+                             verbose=verbose > 2, lprob_seed=lprob_seed or 'set')
+
+    def evaluate(pars):
+        # returns the log-likelihood and the log-prior separately
+        lps = self.lprior_batch(pars)
+        with np.errstate(invalid='ignore'):
+            lls = self.batch_map(lprob_batch, pars) - lps
+        return np.where(np.isnan(lls), -np.inf, lls), lps
+
+    frozen_prior = self.fdict.get('frozen_prior')
+    if not np.any(frozen_prior):
+        frozen_prior = get_prior(self.prior, verbose=verbose > 2)[0]
+
+    # draws that can not be solved simply have zero weight from the first stage on
+    pars = np.array([pl.rvs(size=nparts) for pl in frozen_prior]).T
+    lls, lps = evaluate(pars)
+
+    if verbose:
+        print('[smc:]'.ljust(15, ' ') + ' %s of %s prior draws have a finite likelihood (%s).' %
+              (np.isfinite(lls).sum(), nparts, timeprint(time.time() - st, 3)))
+
+    logw = np.zeros(nparts)
+    temp = 0
+    temps = [temp]
+    mdd = 0
+    scale = 2.38/np.sqrt(ndim)
+    stage = 0
+
+    def normalize(logw):
+        w = np.exp(logw - np.max(logw))
+        return w/np.sum(w)
+
+    while temp < 1:
+
+        stage += 1
+        weights = normalize(logw)
+
+        def cess(dtemp):
+            # conditional ESS relative to the number of particles, minus its target
+            with np.errstate(invalid='ignore'):
+                incw = np.where(np.isfinite(lls), dtemp*lls, -np.inf)
+            g = np.exp(incw - np.max(incw))
+            return np.sum(weights*g)**2/np.sum(weights*g**2) - rho
+
+        if cess(1 - temp) >= 0:
+            dtemp = 1 - temp
+        else:
+            dtemp = so.brentq(cess, 1e-12, 1 - temp)
+
+        # reweighting, and the increment of the MDD
+        incw = np.where(np.isfinite(lls), dtemp*lls, -np.inf)
+        mdd += np.log(np.sum(weights*np.exp(incw - np.max(incw)))) + np.max(incw)
+        with np.errstate(divide='ignore'):
+            logw = np.log(weights) + incw
+        temp = min(temp + dtemp, 1)
+        temps.append(temp)
+
+        weights = normalize(logw)
+        ess = 1/np.sum(weights**2)/nparts
+
+        resampled = ess < resample_thresh or temp == 1
+        if resampled:
+            # systematic resampling
+            inds = np.searchsorted(np.cumsum(weights),
+                                   (np.random.rand() + np.arange(nparts))/nparts)
+            inds = np.minimum(inds, nparts - 1)
+            pars, lls, lps = pars[inds], lls[inds], lps[inds]
+            logw = np.zeros(nparts)
+            weights = np.full(nparts, 1/nparts)
+
+        # mutation
+        cov = np.cov(pars.T, aweights=weights) + 1e-10*np.eye(ndim)
+        chol = np.linalg.cholesky(cov)
+        accepted = 0
+
+        for _ in range(nmutate):
+
+            props = pars + scale*np.random.randn(nparts, ndim) @ chol.T
+            lls_prop, lps_prop = evaluate(props)
+
+            with np.errstate(invalid='ignore'):
+                alpha = temp*(lls_prop - lls) + lps_prop - lps
+            accept = np.log(np.random.rand(nparts)) < np.nan_to_num(
+                alpha, nan=-np.inf)
+
+            pars[accept] = props[accept]
+            lls[accept] = lls_prop[accept]
+            lps[accept] = lps_prop[accept]
+            accepted += accept.sum()
+
+        acc_rate = accepted/nparts/nmutate
+        scale *= .95 + .1*np.exp(16*(acc_rate - .25)) / \
+            (1 + np.exp(16*(acc_rate - .25)))
+
+        if verbose:
+            print('[smc:]'.ljust(15, ' ') + ' Stage %s: temperature is %s, ESS is %s%s, acceptance rate is %s (%s).' %
+                  (stage, np.round(temp, 5), np.round(ess, 3), ' (resampled)' if resampled else '', np.round(acc_rate, 3), timeprint(time.time() - st, 3)))
+
+    self.fdict['smc_particles'] = pars
+    self.fdict['smc_lprobs'] = lls + lps
+    self.fdict['smc_temps'] = np.array(temps)
+    self.fdict['smc_mdd'] = mdd
+    self.fdict['datetime'] = str(datetime.now())
+
+    if verbose:
+        print('[smc:]'.ljust(15, ' ') + ' Done after %s stages and %s. Log marginal data density is %s.' %
+              (stage, timeprint(time.time() - st, 3), np.round(mdd, 4)))
+
+    return pars
@@ -5,6 +5,7 @@ import os
 import time
 import tqdm
 import numpy as np
+from grgrlib.optimize import CMAES
 from .mpile import get_par
 from .stats import summary, pmdm_report
 
@@ -262,7 +263,7 @@ def nlopt(self, p0=None, linear=None, maxfev=None, method=None, tol=1e-2, update
 def swarms(self, algos, linear=None, pop_size=100, ngen=500, mig_share=.1, seed=None, use_ring=False, nlopt=True, broadcasting=True, ncores=None, crit_mem=.85, autosave=100, update_freq=None, use_cloudpickle=False, verbose=False, debug=False):
     """Find mode using pygmo swarms.
 
-    The interface partly replicates some features of the distributed island model because the original implementation has problems with the picklability of the DSGE class
+    The interface partly replicates some features of the distributed island model because the original implementation has problems with the picklability of the DSGE class. See `islands` for an asynchronous island model that keeps the populations in their processes.
 
     Parameters
     ----------
@@ -617,7 +618,289 @@ def swarms(self, algos, linear=None, pop_size=100, ngen=500, mig_share=.1, seed=
     return xsw
 
 
-def cmaes(self, p0=None, sigma=None, pop_size=None, restart_factor=2, seeds=3, seed=None, linear=None, lprob_seed=None, update_freq=1000, verbose=True, debug=False, **args):
+def island_runner(self, no, algo, init_pop, pop_size, ngen, mig_abs, inbox, outboxes, reports, seed, checkpoint, linear, lprob_seed):
+    """Evolve one island in its own (forked) process
+
+    The population and the algorithm stay in the process for all generations. After each generation, the best `mig_abs` individuals are sent to the `outboxes`, and the immigrants that arrived in the `inbox` in the meantime replace the worst individuals. The best individual is reported after each generation, and the full population every `checkpoint` generations and after the last one.
+    """
+
+    import queue
+    import pygmo as pg
+    from grgrlib.core import GPP
+
+    # an island should not be the parent of further workers
+    self.debug = True
+
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(limits=1)
+    except ImportError:
+        pass
+
+    def lprob(par): return self.lprob(
+        par, linear=linear, verbose=False, lprob_seed=lprob_seed)
+
+    prob = pg.problem(GPP(lprob, self.fdict['prior_bounds']))
+
+    if init_pop is None:
+        pop = pg.population(prob, size=pop_size, seed=seed)
+    else:
+        pop = pg.population(prob, seed=seed)
+        for x, f in zip(*init_pop):
+            pop.push_back(x, [f])
+
+    if algo.has_set_seed():
+        algo.set_seed(seed)
+
+    for gen in range(ngen):
+
+        pop = algo.evolve(pop)
+
+        # immigrants replace the worst individuals, if they are better
+        while True:
+            try:
+                xs, fs = inbox.get_nowait()
+            except queue.Empty:
+                break
+
+            worst = pop.get_f()[:, 0].argsort()[::-1]
+            for i, x, f in zip(worst, xs, fs):
+                if f < pop.get_f()[i, 0]:
+                    pop.set_xf(i, x, [f])
+
+        xs, fs = pop.get_x(), pop.get_f()[:, 0]
+        order = fs.argsort()
+
+        for box in outboxes:
+            box.put((xs[order[:mig_abs]], fs[order[:mig_abs]]))
+
+        full = not (gen + 1) % checkpoint or gen + 1 == ngen
+        reports.put((no, gen + 1, xs[order[0]], -fs[order[0]],
+                     (xs, fs) if full else None))
+
+    # do not wait for neighbors that already finished to pick up their immigrants
+    for box in outboxes:
+        box.cancel_join_thread()
+
+
+def islands(self, algos, linear=None, pop_size=100, ngen=500, mig_share=.1, nislands=None, broadcasting=False, checkpoint=50, resume=False, seed=None, lprob_seed=None, verbose=True):
+    """Find the mode with an asynchronous island model of pygmo algorithms
+
+    Each island is a population that is evolved by one of the `algos` in its own process for all generations (see `island_runner`). Islands do not wait for each other: the best individuals of each island migrate through queues to the next island (or to all others) after every generation, and are integrated by the receiving island whenever they arrive. Only the migrants and the progress reports are pickled. The populations are checkpointed in `fdict` every `checkpoint` generations, and can be used to resume the search.
+
+    Parameters
+    ----------
+    algos : list
+        List of initialized pygmo algorithms. Island `i` uses `algos[i % len(algos)]`
+    linear : bool, optional
+        Optimize linear model. Defaults to whether the filter object is linear
+    pop_size : int, optional
+        Size of each population. (Default: 100)
+    ngen : int, optional
+        Number of generations of each island. Note that this runs *on top* of the generations defined in each algorithm. (Default: 500)
+    mig_share : float, optional
+        Share of the population that migrates after each generation. (Default: 0.1)
+    nislands : int, optional
+        Number of islands. (Default: number of cores)
+    broadcasting : bool, optional
+        Whether migrants are sent to all other islands or only to the next (ring topology). (Default: False)
+    checkpoint : int, optional
+        Number of generations between checkpoints. (Default: 50)
+    resume : bool, optional
+        Start from the populations of the last checkpoint. (Default: False)
+
+    Returns
+    -------
+    tuple
+        The best parameters and log-probability of each island
+    """
+
+    import queue
+    import multiprocess as mp
+    from grgrlib.core import timeprint
+
+    st = time.time()
+
+    if not hasattr(self, 'ndim'):
+        self.prep_estim(load_R=True, verbose=verbose > 2)
+
+    if linear is None:
+        linear = self.filter.name == 'KalmanFilter'
+
+    if seed is None:
+        seed = self.fdict['seed']
+
+    # the islands inherit the model as it is
+    ctx = mp.get_context('fork')
+    nislands = nislands or ctx.cpu_count()
+    mig_abs = max(int(pop_size*mig_share), 1)
+
+    if resume:
+        init_pops = list(
+            zip(self.fdict['islands_x'], -self.fdict['islands_f']))
+        nislands = len(init_pops)
+    else:
+        init_pops = [None]*nislands
+
+    inboxes = [ctx.Queue() for _ in range(nislands)]
+    reports = ctx.Queue()
+
+    procs = []
+    for i in range(nislands):
+
+        if broadcasting:
+            outboxes = inboxes[:i] + inboxes[i+1:]
+        else:
+            outboxes = [inboxes[(i + 1) % nislands]]
+
+        args = (self, i, algos[i % len(algos)], init_pops[i], pop_size, ngen, mig_abs, inboxes[i],
+                outboxes, reports, seed + i, checkpoint, linear, lprob_seed or 'set')
+        procs.append(ctx.Process(target=island_runner, args=args, daemon=True))
+
+    if verbose:
+        print('[islands:]'.ljust(15, ' ') + 'Starting %s islands with %s generations each (%s)...' %
+              (nislands, ngen, ', '.join(set(a.get_name().split(':')[0] for a in algos))))
+
+    for p in procs:
+        p.start()
+
+    names = np.array(['%s_%s' % (algos[i % len(algos)].get_name().split(':')[0], i)
+                      for i in range(nislands)])
+    x_best = np.full((nislands, self.ndim), np.nan)
+    f_best = np.full(nislands, -np.inf)
+    pops = [None]*nislands
+    f_hist, x_hist, name_hist = [], [], []
+    ndone = 0
+
+    pbar = tqdm.tqdm(total=ngen*nislands, dynamic_ncols=True,
+                     disable=not verbose)
+
+    while ndone < nislands:
+
+        try:
+            no, gen, x, f, pop = reports.get(timeout=1)
+        except queue.Empty:
+            failed = [i for i, p in enumerate(procs) if p.exitcode]
+            if failed:
+                for p in procs:
+                    p.terminate()
+                raise RuntimeError('[islands:]'.ljust(
+                    15, ' ') + ' Island(s) %s failed.' % failed)
+            continue
+
+        pbar.update()
+
+        if f > f_best[no]:
+            x_best[no], f_best[no] = x, f
+
+        if f > np.max(f_hist, initial=-np.inf):
+            f_hist.append(f)
+            x_hist.append(x)
+            name_hist.append(names[no])
+            pbar.set_description('ll: %s [%s]' % (np.round(f, 4), names[no]))
+
+        if pop is not None:
+            pops[no] = pop
+            ndone += gen == ngen
+
+            if all(p is not None for p in pops):
+                # checkpoint
+                self.fdict['islands_x'] = np.array([p[0] for p in pops])
+                self.fdict['islands_f'] = -np.array([p[1] for p in pops])
+
+    pbar.close()
+
+    for p in procs:
+        p.join()
+
+    self.fdict['swarm_history'] = np.array(f_hist).reshape(
+        1, -1), np.array(x_hist), np.array(name_hist).reshape(1, -1)
+    self.fdict['swarms'] = x_best, f_best.reshape(-1, 1), names.reshape(1, -1)
+
+    arg_max = f_best.argmax()
+
+    if verbose:
+        print('[islands:]'.ljust(15, ' ') + 'Done after %s. Best log-probability is %s (%s).' %
+              (timeprint(time.time() - st, 3), np.round(f_best[arg_max], 4), names[arg_max]))
+
+    if 'mode_f' in self.fdict.keys() and f_best[arg_max] < self.fdict['mode_f']:
+        print('[islands:]'.ljust(15, ' ') + " New mode of %s is below old mode of %s. Rejecting..." %
+              (f_best[arg_max], self.fdict['mode_f']))
+    else:
+        self.fdict['mode_x'] = x_best[arg_max]
+        self.fdict['mode_f'] = f_best[arg_max]
+
+    return x_best, f_best
+
+
+def neg_lprob_unit(self, x, batch=False, **lprob_args):
+    """Negative `lprob` on the unit hypercube spanned by the prior bounds
+    """
+
+    bnd = np.array(self.fdict['prior_bounds'])
+    x = (bnd[1] - bnd[0])*x + bnd[0]
+
+    if batch:
+        return -self.lprob_batch(x, **lprob_args)
+
+    return -self.lprob(x, **lprob_args)
+
+
+class RestartCMAES(CMAES):
+    """`grgrlib.optimize.CMAES` with its own random state, such that restarts can run side by side
+
+    Relies on the internals of `CMAES` as of grgrlib 0.1.0, which (like `grgrlib.optimize.cmaes`) expects the objective, the bijection and the mapper to be set on the instance.
+    """
+
+    def __init__(self, objective, mapper, xstart, sigma, popsize, seed, biject=False, **args):
+
+        super().__init__(np.array(xstart, dtype=float), sigma,
+                         popsize=popsize, biject=biject, verbose=False, **args)
+
+        self.rng = np.random.RandomState(seed)
+        # `CMAES.__init__` sets its own sampler (based on the global random state)
+        self.randn = self.draw
+
+        self.bfunc = (lambda x: 1/(1 + np.exp(x))) if biject else (lambda x: x)
+        self.objective_fct = lambda x: objective(self.bfunc(x))
+        self.map = mapper
+        self.stime = time.time()
+
+    def draw(self):
+        return self.rng.standard_normal((self.params.lam, self.params.ndim))
+
+
+def cmaes_restarts(objective, mapper, p0, sigmas, pop_sizes, seeds, nconcurrent, biject=False, **args):
+    """Run the restarts of CMA-ES concurrently, sharing one pool
+
+    Each restart runs in its own thread, which only waits for the evaluations of its populations. The populations of all running restarts are thus in the task queue of the pool at the same time, and the workers do not idle while a small population is evaluated. At most `nconcurrent` restarts run at the same time. Unlike the sequential restarts, all restarts start at `p0`, since which restarts are finished when a new one starts depends on timing. Together with the own random state of each restart, the results are thus reproducible and do not depend on the order in which the populations are finished.
+
+    Yields
+    ------
+    tuple
+        The seed and the result (as returned by `grgrlib.optimize.cmaes`) of each restart, in the order in which they finish
+    """
+
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    def run(sigma, pop_size, seed):
+
+        es = RestartCMAES(objective, mapper, p0, sigma,
+                          pop_size, seed, biject=biject, **args)
+
+        while not es.stop():
+            es.run()
+
+        return seed, es.result
+
+    with ThreadPoolExecutor(nconcurrent) as executor:
+        futures = [executor.submit(run, *a)
+                   for a in zip(sigmas, pop_sizes, seeds)]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def cmaes(self, p0=None, sigma=None, pop_size=None, restart_factor=2, seeds=3, seed=None, linear=None, lprob_seed=None, vectorize=False, warmstart=False, concurrent=False, bipop=False, update_freq=1000, verbose=True, debug=False, **args):
     """Find mode using CMA-ES from grgrlib.
 
     Parameters
@@ -626,10 +909,19 @@ def cmaes(self, p0=None, sigma=None, pop_size=None, restart_factor=2, seeds=3, s
         Size of each population. (Default: number of dimensions)
     seeds : in, optional
         Number of different seeds tried. (Default: 3)
+    vectorize : bool, optional
+        Evaluate each population in batches (see `lprob_batch`), with one batch per worker. (Default: False)
+    warmstart : bool or int, optional
+        Start from the best point found by the Gaussian process emulator (see `emulate`), with a step size that reflects the spread of the best points. If an integer, this is the number of evaluations spent on the emulator. (Default: False)
+    concurrent : bool or int, optional
+        Run the restarts concurrently on the pool instead of one after another (see `cmaes_restarts`). If an integer, this is the maximum number of restarts that run at the same time. All restarts then start at `p0` rather than at the best solution of the previous restart. Workers are not killed if a `time_budget` is exceeded, since they are shared by the restarts. Without a pool (or with `debug`), the restarts run one at a time, since they would otherwise evaluate on the same model instance. (Default: False)
+    bipop : bool, optional
+        Alternate between restarts with increasing population sizes and restarts with small populations and step sizes (BIPOP, Hansen 2009). (Default: False)
     """
 
     from grgrlib.optimize import cmaes as fmin
-    from grgrlib.core import serializer
+    from .parallel import WorkerTask
+    from .estimation import kill_timeout, limited_mapper
 
     np.random.seed(seed or self.fdict['seed'])
 
@@ -641,23 +933,64 @@ def cmaes(self, p0=None, sigma=None, pop_size=None, restart_factor=2, seeds=3, s
                  asdict=False) if p0 is None else p0
     p0 = (p0 - bnd[0])/(bnd[1] - bnd[0])
 
-    sigma = sigma or .25
-
     if hasattr(self, 'pool'):
-        from .estimation import create_pool
-        create_pool(self)
+        from .estimation import get_pool
+        get_pool(self)
 
     self.debug |= debug
-    lprob_global = serializer(self.lprob)
 
-    def lprob(par): return lprob_global(
-        par, linear=linear, lprob_seed=lprob_seed or 'set')
+    nevals_em = 0
+    if warmstart:
+        from .emulator import emulate
+        p0, sigma_em, nevals_em = emulate(self, nevals=None if warmstart is True else warmstart, p0=p0*(
+            bnd[1] - bnd[0]) + bnd[0], linear=linear, lprob_seed=lprob_seed, seed=seed, verbose=verbose)
+        sigma = sigma or sigma_em
 
-    def lprob_scaled(x): return -lprob((bnd[1] - bnd[0])*x + bnd[0])
+    sigma = sigma or .25
+
+    # only these descriptors are sent to the workers
+    lprob_scaled = WorkerTask(self, neg_lprob_unit, timeout=kill_timeout(self), fallback=np.inf,
+                              linear=linear, lprob_seed=lprob_seed or 'set')
+    lprob_batch = WorkerTask(
+        self, neg_lprob_unit, batch=True, linear=linear, lprob_seed=lprob_seed or 'set')
+
+    def batch_mapper(func, xs):
+        # ignores `func` and evaluates the whole population at once
+        if args.get('biject'):
+            xs = 1/(1 + np.exp(xs))
+        return self.batch_map(lprob_batch, xs)
 
     if self.pool:
         self.pool.clear()
 
+    # the schedule of population sizes (IPOP) and step sizes
+    def_pop = 4 + int(3*np.log(len(p0)))
+    pop_sizes, sigmas = [], []
+    for i in range(len(seeds)):
+        pop_large = (pop_size or def_pop)*restart_factor**((i + 1)//2 if bipop else i)
+        if bipop and i % 2:
+            # small populations with step sizes that are drawn at random
+            u = np.random.rand()
+            pop_sizes.append(int(def_pop*(.5*pop_large/def_pop)**(u**2)))
+            sigmas.append(sigma*10**(-2*u))
+        else:
+            pop_sizes.append(pop_large if pop_size or bipop else None)
+            sigmas.append(sigma)
+
+    # fmin wraps `lprob_scaled`, so the pool must know the limit itself
+    mapper = batch_mapper if vectorize else limited_mapper(self, np.inf)
+
+    if concurrent:
+        # a killed worker would take down the tasks of the other restarts
+        lprob_shared = WorkerTask(self, neg_lprob_unit, linear=linear,
+                                  lprob_seed=lprob_seed or 'set')
+        nconcurrent = len(seeds) if concurrent is True else concurrent
+        if self.mapper is map:
+            # the threads would all evaluate (and write to) the same model instance
+            nconcurrent = 1
+        restarts = cmaes_restarts(lprob_shared, batch_mapper if vectorize else self.mapper, p0, sigmas, pop_sizes,
+                                  seeds, nconcurrent, debug=debug, **args)
+
     f_max = -np.inf
 
     print('[cma-es:]'.ljust(15, ' ') + 'Starting mode search over %s seeds...' %
@@ -670,16 +1003,26 @@ def cmaes(self, p0=None, sigma=None, pop_size=None, restart_factor=2, seeds=3, s
         f_hist = []
         x_hist = []
 
-    for s in seeds:
+    nevals = 0
+    # the order in which the restarts finished
+    seeds_done = []
+
+    for i, s in enumerate(seeds):
 
+        pop_size = pop_sizes[i]
         verbose = np.ceil(
             update_freq/pop_size) if update_freq is not None and pop_size is not None else None
 
-        np.random.seed(s)
-        res = fmin(lprob_scaled, p0, sigma, popsize=pop_size,
-                   verbose=verbose, mapper=self.mapper, debug=debug, **args)
+        if concurrent:
+            s, res = next(restarts)
+        else:
+            np.random.seed(s)
+            res = fmin(lprob_scaled, p0, sigmas[i], popsize=pop_size,
+                       verbose=verbose, mapper=mapper, debug=debug, **args)
 
         x_scaled = res[0] * (bnd[1] - bnd[0]) + bnd[0]
+        nevals += res[3]
+        seeds_done.append(s)
         f_hist.append(-res[1])
         x_hist.append(x_scaled)
 
@@ -696,10 +1039,6 @@ def cmaes(self, p0=None, sigma=None, pop_size=None, restart_factor=2, seeds=3, s
                 print('[cma-es:]'.ljust(15, ' ') +
                       'Updating best solution to %s at seed %s.' % (np.round(f_max, 4), s))
 
-        # apply restart_factor
-        if pop_size:
-            pop_size *= restart_factor
-
         if verbose:
             from .clsmethods import mode_summary
 
@@ -711,9 +1050,12 @@ def cmaes(self, p0=None, sigma=None, pop_size=None, restart_factor=2, seeds=3, s
 
     np.warnings.filterwarnings('default')
 
+    print('[cma-es:]'.ljust(15, ' ') + '%s function evaluations in total (%s of them by the emulator).' %
+          (nevals + nevals_em, nevals_em))
+
     self.fdict['cmaes_mode_x'] = x_max_scaled
     self.fdict['cmaes_mode_f'] = f_max
-    self.fdict['cmaes_history'] = f_hist, x_hist, seeds
+    self.fdict['cmaes_history'] = f_hist, x_hist, seeds_done
 
     if 'mode_f' in self.fdict.keys() and f_max < self.fdict['mode_f']:
         print('[cmaes:]'.ljust(15, ' ') + " New mode of %s is below old mode of %s. Rejecting..." %
@@ -722,6 +1064,4 @@ def cmaes(self, p0=None, sigma=None, pop_size=None, restart_factor=2, seeds=3, s
         self.fdict['mode_x'] = x_max_scaled
         self.fdict['mode_f'] = f_max
 
-    self.pool.close()
-
     return f_max, x_max_scaled
@@ -25,7 +25,7 @@ def posterior_sampler(self, nsamples, seed=0, verbose=True):
     """
     import random
     random.seed(seed)
-    sample = self.get_chain()[-self.get_tune:]
+    sample = self.get_chain(tail=self.get_tune)
     sample = sample.reshape(-1, sample.shape[(-1)])
     sample = random.choices(sample, k=nsamples)
     return sample
@@ -43,6 +43,40 @@ def sample_box(self, dim0, dim1=None, bounds=None, lp_rule=None, verbose=False):
     return res
 
 
+def prior_runner(self, locseed, seed, frozen_prior, test_lprob, verbose):
+    """Draw one parameter vector from the prior that can be solved (and has a finite likelihood if `test_lprob`)
+    """
+
+    np.random.seed(seed+locseed)
+    done = False
+    no = 0
+
+    while not done:
+
+        no += 1
+
+        with np.warnings.catch_warnings(record=False):
+            try:
+                np.warnings.filterwarnings('error')
+                rst = np.random.randint(2**31)  # win explodes with 2**32
+                pdraw = [pl.rvs(random_state=rst+sn)
+                         for sn, pl in enumerate(frozen_prior)]
+
+                if test_lprob:
+                    draw_prob = self.lprob(pdraw, linear=None,
+                                           verbose=verbose > 1)
+                    done = not np.isinf(draw_prob)
+                else:
+                    self.set_par(pdraw)
+                    done = True
+
+            except Exception as e:
+                if verbose > 1:
+                    print(str(e)+' (%s) ' % no)
+
+    return pdraw, no
+
+
 def prior_sampler(self, nsamples, seed=0, test_lprob=False, lks=None, verbose=True, debug=False, **args):
     """Draw parameters from prior. 
     Parameters
@@ -62,7 +96,8 @@ def prior_sampler(self, nsamples, seed=0, test_lprob=False, lks=None, verbose=Tr
     """
 
     import tqdm
-    from grgrlib import map2arr, serializer
+    from grgrlib import map2arr
+    from .parallel import WorkerTask
 
     l_max, k_max = lks or (None, None)
 
@@ -78,43 +113,11 @@ def prior_sampler(self, nsamples, seed=0, test_lprob=False, lks=None, verbose=Tr
     self.debug |= debug
 
     if hasattr(self, 'pool'):
-        from .estimation import create_pool
-        create_pool(self)
-
-    set_par = serializer(self.set_par)
-    get_par = serializer(self.get_par)
-    lprob = serializer(self.lprob) if test_lprob else None
+        from .estimation import get_pool
+        get_pool(self)
 
-    def runner(locseed):
-
-        np.random.seed(seed+locseed)
-        done = False
-        no = 0
-
-        while not done:
-
-            no += 1
-
-            with np.warnings.catch_warnings(record=False):
-                try:
-                    np.warnings.filterwarnings('error')
-                    rst = np.random.randint(2**31)  # win explodes with 2**32
-                    pdraw = [pl.rvs(random_state=rst+sn)
-                             for sn, pl in enumerate(frozen_prior)]
-
-                    if test_lprob:
-                        draw_prob = lprob(pdraw, linear=None,
-                                          verbose=verbose > 1)
-                        done = not np.isinf(draw_prob)
-                    else:
-                        set_par(pdraw)
-                        done = True
-
-                except Exception as e:
-                    if verbose > 1:
-                        print(str(e)+' (%s) ' % no)
-
-        return pdraw, no
+    runner = WorkerTask(self, prior_runner, seed=seed, frozen_prior=frozen_prior,
+                        test_lprob=test_lprob, verbose=verbose)
 
     if verbose > 1:
         print('[prior_sample:]'.ljust(15, ' ') + ' Sampling from the pior...')
@@ -383,9 +386,12 @@ def box_check(self, par=None):
     if par is None:
         par = self.par
 
-    for i, name in enumerate(self.fdict['prior_names']):
+    lb, ub = self.fdict['prior_bounds']
 
-        lb, ub = self.fdict['prior_bounds']
+    if hasattr(self, 'compiled_prior') and np.all(self.compiled_prior.in_bounds(par[:len(lb)])):
+        return
+
+    for i, name in enumerate(self.fdict['prior_names']):
 
         if par[i] < lb[i]:
             print('[box_check:]'.ljust(
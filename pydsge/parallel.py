@@ -0,0 +1,605 @@
+#!/bin/python
+# -*- coding: utf-8 -*-
+
+"""contains the process pool that keeps a resident copy of the model in each worker
+"""
+
+import time
+import weakref
+import threading
+import numpy as np
+from sys import platform
+
+# the model as seen from inside a worker
+worker_model = None
+# the model that is inherited by forked workers
+parent_model = None
+# keeps the shared arrays of the model alive in the worker
+worker_shared = None
+# guards read-modify-writes of shared arrays. Set in the parent and in the workers of the pool that was started last
+stats_lock = None
+# attributes of the model that are placed in shared memory instead of being pickled for each worker
+shared_attrs = ('Z', 'precalc_mat', 'precalc_tmat')
+
+
+class SharedArray(object):
+    """An array in shared memory, read-only by default
+
+    Pickling a `SharedArray` only transfers the name of the memory block, and unpickling attaches to the block without copying. This allows to send large arrays to the workers of a pool (e.g. as arguments of a `WorkerTask`) while only keeping one copy in memory. The block is freed when the instance that created it is released or garbage collected, so the creator must be kept alive while the workers use the block.
+
+    Parameters
+    ----------
+    arr : array
+        The data. Will be copied once into the shared memory block
+    writeable : bool, optional
+        Whether all processes may write to the array. Defaults to False
+    """
+
+    def __init__(self, arr, writeable=False):
+
+        from multiprocess import shared_memory
+
+        arr = np.ascontiguousarray(arr)
+
+        self.shape = arr.shape
+        self.dtype = arr.dtype
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=max(arr.nbytes, 1))
+        self.name = self.shm.name
+        self.writeable = writeable
+        self.owner = True
+
+        self.array = np.ndarray(self.shape, self.dtype, buffer=self.shm.buf)
+        self.array[:] = arr
+        self.array.flags.writeable = writeable
+
+        # free the block at the latest when the interpreter exits
+        self.finalizer = weakref.finalize(self, free_block, self.shm)
+
+    def __getstate__(self):
+        return {'name': self.name, 'shape': self.shape, 'dtype': self.dtype, 'writeable': self.writeable}
+
+    def __setstate__(self, state):
+
+        from multiprocess import shared_memory
+
+        self.__dict__.update(state)
+        self.owner = False
+
+        # workers share the resource tracker of the parent, so attaching does not take over the ownership
+        self.shm = shared_memory.SharedMemory(self.name)
+        self.array = np.ndarray(self.shape, self.dtype, buffer=self.shm.buf)
+        self.array.flags.writeable = self.writeable
+
+    def __array__(self, dtype=None):
+        return self.array if dtype is None else self.array.astype(dtype)
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, key):
+        return self.array[key]
+
+    def release(self):
+        """Detach from the memory block. The creating instance also frees the block
+        """
+
+        if self.shm is None:
+            return
+
+        self.array = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # views on the block are still in use. The mapping is dropped together with them
+            pass
+
+        if self.owner:
+            self.finalizer()
+        self.shm = None
+
+    def __del__(self):
+        try:
+            self.release()
+        except Exception:
+            pass
+
+
+def free_block(shm):
+
+    try:
+        shm.close()
+    except BufferError:
+        pass
+
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def share(obj):
+    """Put an array (or a tuple of arrays) into shared memory. Other objects are returned as they are
+    """
+
+    if isinstance(obj, tuple):
+        return tuple(share(o) for o in obj)
+    if isinstance(obj, np.ndarray) and obj.dtype != object:
+        return SharedArray(obj)
+
+    return obj
+
+
+def unshare(obj):
+    """Return the array view(s) of `SharedArray` object(s)
+    """
+
+    if isinstance(obj, tuple):
+        return tuple(unshare(o) for o in obj)
+    if isinstance(obj, SharedArray):
+        return obj.array
+
+    return obj
+
+
+def release(obj):
+
+    if isinstance(obj, tuple):
+        for o in obj:
+            release(o)
+    elif isinstance(obj, SharedArray):
+        obj.release()
+
+
+class SharedCache(object):
+    """A bounded cache for scalar function values that is shared by all workers of a pool
+
+    The cache is direct-mapped: each key has exactly one slot, and a new entry overwrites the old entry of its slot. Keys are arrays (e.g. parameter vectors) that are rounded to `decimals` before being compared exactly. Slots are written without locks, which is safe as long as the cached function is deterministic. The hit statistics are approximate when several processes write concurrently.
+
+    Parameters
+    ----------
+    maxsize : int
+        Number of slots
+    keysize : int
+        Length of the keys
+    decimals : int, optional
+        Precision of the keys. Defaults to 12
+    """
+
+    def __init__(self, maxsize, keysize, decimals=12):
+
+        self.maxsize = int(maxsize)
+        self.decimals = decimals
+
+        self.keys = SharedArray(
+            np.full((self.maxsize, keysize), np.nan), writeable=True)
+        self.values = SharedArray(np.zeros(self.maxsize), writeable=True)
+        self.counts = SharedArray(np.zeros(2, dtype=int), writeable=True)
+
+    def key(self, *parts):
+        return np.round(np.hstack(parts).astype(float), self.decimals)
+
+    def slot(self, key):
+        import zlib
+        return zlib.crc32(key.tobytes()) % self.maxsize
+
+    def get(self, key):
+        """Return the cached value, or None
+        """
+
+        i = self.slot(key)
+        keys = self.keys.array
+
+        if np.array_equal(keys[i], key):
+            value = self.values.array[i]
+            # make sure the slot was not overwritten meanwhile
+            if np.array_equal(keys[i], key):
+                self.counts.array[0] += 1
+                return value
+
+        self.counts.array[1] += 1
+
+        return None
+
+    def put(self, key, value):
+
+        i = self.slot(key)
+        keys = self.keys.array
+
+        # invalidate the slot while writing
+        keys[i] = np.nan
+        self.values.array[i] = value
+        keys[i] = key
+
+    def clear(self):
+
+        self.keys.array[:] = np.nan
+        self.counts.array[:] = 0
+
+    @property
+    def stats(self):
+        """Dictionary with the number of hits and misses, the hit rate and the number of used slots
+        """
+
+        hits, misses = self.counts.array
+        used = np.sum(~np.isnan(self.keys.array[:, 0]))
+
+        return {'hits': hits, 'misses': misses, 'hit_rate': hits/max(hits + misses, 1), 'used': used}
+
+
+def warmup(model):
+    """Run the transition function once such that the jitted kernels are compiled (or loaded from cache)
+    """
+
+    if not hasattr(model, 'precalc_mat'):
+        return
+
+    try:
+        state = np.zeros(model.dimq - model.dimeps)
+        model.t_func(state)
+        model.t_func(state, linear=True)
+    except Exception:
+        # warming up is optional, errors will show up on the actual call
+        pass
+
+
+def init_worker(model_dump, shared, threadpool_limit, lock):
+    """Initializer of the workers. Loads the model once per worker
+    """
+
+    global worker_model, worker_shared, stats_lock
+
+    stats_lock = lock
+
+    if model_dump is None:
+        # workers are forked and inherit the model (and its compiled kernels)
+        worker_model = parent_model
+    else:
+        import cloudpickle as cpickle
+        worker_model = cpickle.loads(model_dump)
+
+        # attach to the large arrays
+        worker_shared = shared
+        for attr, obj in shared.items():
+            setattr(worker_model, attr, unshare(obj))
+
+        warmup(worker_model)
+
+    # a worker should not be the parent of further workers
+    worker_model.debug = True
+
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(limits=threadpool_limit)
+    except ImportError:
+        pass
+
+
+def ping(arg):
+    return arg
+
+
+def locked():
+    """Context manager that guards read-modify-writes of shared arrays (e.g. counters) against concurrent workers
+
+    Does nothing as long as no pool was started.
+    """
+
+    import contextlib
+
+    return stats_lock if stats_lock is not None else contextlib.nullcontext()
+
+
+class WorkerTask(object):
+    """A picklable task that is executed on the model that resides in the worker
+
+    Only the task descriptor (the function and its keyword arguments) is sent to the workers, but never the model itself. When called in the main process (e.g. if no pool is used), the task is executed on the model it was created with.
+
+    Parameters
+    ----------
+    model : DSGE
+        The model instance
+    func : str or callable
+        Either the name of a method of the model or a module-level function with signature `func(model, arg, **kwargs)`
+    timeout : float, optional
+        Wall-clock limit in seconds for a single call when run on a `ModelPool`. Workers that exceed it are killed and `fallback` is returned instead. Defaults to no limit
+    fallback : object, optional
+        Result of calls that were killed
+    kwargs : keyword arguments, optional
+        Further arguments to `func`
+    """
+
+    def __init__(self, model, func, timeout=None, fallback=None, **kwargs):
+
+        self.model = model
+        self.func = func
+        self.timeout = timeout
+        self.fallback = fallback
+        self.kwargs = kwargs
+
+    def __getstate__(self):
+
+        state = self.__dict__.copy()
+        state['model'] = None
+
+        return state
+
+    def __call__(self, arg):
+
+        model = self.model if self.model is not None else worker_model
+
+        if isinstance(self.func, str):
+            return getattr(model, self.func)(arg, **self.kwargs)
+
+        return self.func(model, arg, **self.kwargs)
+
+
+class ModelPool(object):
+    """A process pool where each worker holds a resident copy of the model
+
+    The pool is persistent: workers are started lazily on the first call of `imap`/`map` and are then reused by all subsequent calls. Whenever the model changed since the workers were started (the model's `revision` counter is increased by `set_par`, `create_filter` and `load_data`), or if a worker died, the workers are restarted before the next task is sent. On platforms that support forking, the workers inherit the model and its compiled kernels, and share its memory with the parent. Otherwise, the model is pickled once for each worker, except for the data and the precalculated system tensors, which are placed in shared memory such that all workers attach to one copy.
+
+    Parameters
+    ----------
+    model : DSGE
+        The model instance
+    ncpus : int, optional
+        Number of workers. Defaults to the number of cores.
+    threadpool_limit : int, optional
+        Number of threads that numpy uses in each worker. Defaults to one.
+    start_method : str, optional
+        The multiprocessing start method. Defaults to 'fork' where available.
+    """
+
+    def __init__(self, model, ncpus=None, threadpool_limit=1, start_method=None):
+
+        import multiprocess as mp
+
+        self.model = model
+        self.ncpus = ncpus or mp.cpu_count()
+        self.threadpool_limit = threadpool_limit
+        self.start_method = start_method
+        self.shared = {}
+        self.pool = None
+        self.pids = None
+        self.revision = None
+        self.stats_lock = None
+        # arguments of the tasks that were killed because they exceeded their timeout
+        self.killed = []
+        self.lock = threading.RLock()
+
+    def is_alive(self):
+        """Check if the workers are started and still running
+        """
+
+        if self.pool is None:
+            return False
+
+        # a worker that was replaced by the pool may have died holding a lock on the task queue
+        pids = [p.pid for p in self.pool._pool if p.is_alive()]
+
+        return sorted(pids) == self.pids
+
+    def is_stale(self):
+        """Check if the model changed since the workers were started
+        """
+        return self.revision != getattr(self.model, 'revision', 0)
+
+    def ping(self, timeout=10):
+        """Health check: send a trivial task to each worker and wait at most `timeout` seconds for the answers
+        """
+
+        if not self.is_alive():
+            return False
+
+        try:
+            res = self.pool.map_async(ping, range(self.ncpus), chunksize=1)
+            return res.get(timeout) == list(range(self.ncpus))
+        except Exception:
+            return False
+
+    def start(self):
+        """Start the workers, or restart them if they are stale or not healthy
+        """
+
+        global parent_model, stats_lock
+
+        import multiprocess as mp
+
+        # the pool may be shared by several threads (e.g. the concurrent restarts of `cmaes`)
+        with self.lock:
+
+            if self.pool is not None:
+                if not self.is_alive():
+                    self.terminate()
+                elif self.is_stale():
+                    self.close()
+                else:
+                    return self.pool
+
+            start_method = self.start_method or (
+                'fork' if platform in ("linux", "darwin") else None)
+
+            if start_method == 'fork':
+                # compile once in the parent instead of once in each worker
+                warmup(self.model)
+                # forked workers share the memory of the parent as long as it is not written to
+                parent_model = self.model
+                model_dump = None
+            else:
+                import copy
+                import cloudpickle as cpickle
+
+                # large arrays are not pickled but placed in shared memory
+                self.shared = {attr: share(getattr(self.model, attr))
+                               for attr in shared_attrs if hasattr(self.model, attr)}
+                model_copy = copy.copy(self.model)
+                for attr in self.shared:
+                    setattr(model_copy, attr, None)
+                model_dump = cpickle.dumps(model_copy)
+
+            ctx = mp.get_context(start_method)
+            # locks can only be passed on to the workers when they are created
+            self.stats_lock = stats_lock = ctx.Lock()
+
+            self.revision = getattr(self.model, 'revision', 0)
+            self.pool = ctx.Pool(self.ncpus, initializer=init_worker, initargs=(
+                model_dump, self.shared, self.threadpool_limit, self.stats_lock))
+            self.pids = sorted(p.pid for p in self.pool._pool)
+
+            return self.pool
+
+    def restart(self):
+        """Force a restart of the workers
+        """
+
+        self.close()
+        return self.start()
+
+    def imap(self, func, iterable):
+        if getattr(func, 'timeout', None):
+            return iter(self.map_with_timeout(func, iterable))
+        return self.start().imap(func, iterable)
+
+    def limited(self, timeout, fallback=None):
+        """A view of the pool that kills calls which exceed `timeout` seconds, and returns `fallback` for them
+
+        Samplers and optimizers wrap the function they are given (e.g. emcee's `_FunctionWrapper`), which hides the limit of a `WorkerTask` from the pool. Pass this view to them instead.
+        """
+        return TimeLimitedPool(self, timeout, fallback)
+
+    def map(self, func, iterable):
+        if getattr(func, 'timeout', None):
+            return self.map_with_timeout(func, iterable)
+        return self.start().map(func, iterable)
+
+    def map_with_timeout(self, func, iterable, timeout=None, fallback=None):
+        """Map a function and kill the workers of calls that exceed `timeout` (defaults to `func.timeout`)
+
+        Since every call takes at most `timeout` seconds, the n-th call must be finished after `(n//ncpus + 1)*timeout` seconds. If it is not, its result is set to `fallback` (defaults to `func.fallback`), the workers are killed and the calls that did not finish are sent again to fresh workers.
+        """
+
+        import multiprocess as mp
+
+        if timeout is None:
+            timeout, fallback = func.timeout, func.fallback
+
+        args = list(iterable)
+        res = [None]*len(args)
+        todo = list(range(len(args)))
+
+        while todo:
+
+            pool = self.start()
+            st = time.time()
+            pending = [(i, pool.apply_async(func, (args[i],))) for i in todo]
+            todo = []
+
+            for n, (i, r) in enumerate(pending):
+                try:
+                    res[i] = r.get(
+                        max(st + timeout*(n//self.ncpus + 1) - time.time(), 0))
+                except mp.TimeoutError:
+                    res[i] = fallback
+                    self.killed.append(args[i])
+
+                    for j, rj in pending[n+1:]:
+                        if rj.ready():
+                            res[j] = rj.get()
+                        else:
+                            todo.append(j)
+
+                    self.terminate()
+                    break
+
+        return res
+
+    def clear(self):
+        """Kept for compatibility with `pathos` pools
+        """
+        return
+
+    def close(self):
+        """Shut down the workers. The pool can still be used and will be restarted on the next call
+        """
+
+        global parent_model
+
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+        if parent_model is self.model:
+            parent_model = None
+
+        for obj in self.shared.values():
+            release(obj)
+        self.shared = {}
+
+    def terminate(self):
+        """Kill the workers without waiting for pending tasks
+        """
+
+        global stats_lock
+
+        # a killed worker may have held the lock. The next start creates a new one
+        if stats_lock is self.stats_lock:
+            stats_lock = None
+
+        if self.pool is not None:
+            for p in self.pool._pool:
+                p.terminate()
+                p.join()
+
+            # a killed worker may still hold the lock on the task queue, which would block forever
+            rlock = self.pool._inqueue._rlock
+            rlock.acquire(False)
+            rlock.release()
+
+            self.pool.terminate()
+            self.pool = None
+
+        for obj in self.shared.values():
+            release(obj)
+        self.shared = {}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __getstate__(self):
+        # a pool can not be pickled, e.g. along with the model
+        return {'model': None, 'ncpus': self.ncpus, 'threadpool_limit': self.threadpool_limit, 'start_method': self.start_method, 'shared': {}, 'pool': None, 'pids': None, 'revision': None, 'stats_lock': None, 'killed': []}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.RLock()
+
+
+class TimeLimitedPool(object):
+    """A view of a `ModelPool` that kills calls which exceed `timeout` seconds (see `ModelPool.limited`)
+    """
+
+    def __init__(self, pool, timeout, fallback=None):
+
+        self.pool = pool
+        self.timeout = timeout
+        self.fallback = fallback
+
+    def map(self, func, iterable):
+        if not self.timeout:
+            return self.pool.map(func, iterable)
+        return self.pool.map_with_timeout(func, iterable, self.timeout, self.fallback)
+
+    def imap(self, func, iterable):
+        if not self.timeout:
+            return self.pool.imap(func, iterable)
+        return iter(self.map(func, iterable))
+
+    @property
+    def ncpus(self):
+        return self.pool.ncpus
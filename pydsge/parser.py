@@ -326,6 +326,10 @@ class DSGE(DSGE_RAW):
                                 raise SyntaxError(
                                     "Definitions of `para_func` seem to be circular. Last error: "+error_msg)
 
+        # keep the symbolic system to allow for analytic derivatives
+        self.sys_sym = {'AA': AA, 'BB': BB, 'CC': CC, 'PSI': PSI, 'bb': bb,
+                        'bb_PSI': bb_PSI, 'ZZ0': ZZ0, 'ZZ1': ZZ1, 'QQ': self['covariance']}
+
         ZZ0 = lambdify([self.parameters+self['other_para']], ZZ0)
         ZZ1 = lambdify([self.parameters+self['other_para']], ZZ1)
 
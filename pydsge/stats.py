@@ -8,10 +8,13 @@ import tqdm
 import numpy as np
 import pandas as pd
 import scipy.stats as ss
+import scipy.linalg as sl
 import scipy.optimize as so
-from scipy.special import gammaln
+from scipy.special import gammaln, betaln
+from numba import njit
 from grgrlib.core import timeprint
 from grgrlib.stats import mode
+from .parallel import WorkerTask, share, release
 
 
 def mc_error(x):
@@ -141,23 +144,353 @@ def mc_mean(trace, varnames):
     return p_means
 
 
+class StreamingDiagnostics(object):
+    """Convergence diagnostics of an ensemble chain that are updated with every iteration
+
+    The costs of an update do not depend on the length of the chain. The autocovariances up to `maxlag` are accumulated directly (without FFT), and the integrated autocorrelation time is estimated from them as in `emcee.autocorr.integrated_time`. This is exact as long as the window of the estimator closes within `maxlag`, i.e. for autocorrelation times below `maxlag/c`. The chain of each walker is further summarized in (at most `2*nbatches`) batches of equal size, which are merged pairwise whenever their number is exceeded. The batch means provide the effective sample size and the split R-hat across walkers.
+
+    Parameters
+    ----------
+    nwalks : int
+        Number of walkers
+    ndim : int
+        Number of parameters
+    maxlag : int, optional
+        Maximum lag of the autocovariances. If the window of the estimator does not close within `maxlag`, the autocorrelation time is only a lower bound (see `tau_is_bound`). Defaults to 500
+    nbatches : int, optional
+        Minimum number of batches. Defaults to 64
+    c : float, optional
+        Step size of the window search for the autocorrelation time. Defaults to 5
+    """
+
+    def __init__(self, nwalks, ndim, maxlag=500, nbatches=64, c=5):
+
+        self.maxlag = maxlag
+        self.nbatches = nbatches
+        self.c = c
+        self.n = 0
+
+        # the first and the last `maxlag` samples (the latter as a ring buffer) and the sums of the lagged products
+        self.head = np.zeros((maxlag, nwalks, ndim))
+        self.lagged = np.zeros((maxlag, nwalks, ndim))
+        self.lagged_sums = np.zeros((maxlag + 1, nwalks, ndim))
+        self.sums = np.zeros((nwalks, ndim))
+
+        self.batch_size = 1
+        self.batch_sums = []
+        self.batch_sqs = []
+        self.open_sum = np.zeros((nwalks, ndim))
+        self.open_sq = np.zeros((nwalks, ndim))
+        self.open_n = 0
+
+    def update(self, x):
+        """Add one iteration of shape (nwalks, ndim)
+        """
+
+        x = np.asarray(x, dtype=float)
+
+        nlags = min(self.n, self.maxlag)
+        self.lagged_sums[0] += x**2
+        if nlags:
+            ind = (self.n - np.arange(1, nlags + 1)) % self.maxlag
+            self.lagged_sums[1:nlags+1] += x*self.lagged[ind]
+
+        if self.n < self.maxlag:
+            self.head[self.n] = x
+        self.lagged[self.n % self.maxlag] = x
+        self.sums += x
+        self.n += 1
+
+        self.open_sum += x
+        self.open_sq += x**2
+        self.open_n += 1
+
+        if self.open_n == self.batch_size:
+            self.batch_sums.append(self.open_sum)
+            self.batch_sqs.append(self.open_sq)
+            self.open_sum = np.zeros_like(x)
+            self.open_sq = np.zeros_like(x)
+            self.open_n = 0
+
+            if len(self.batch_sums) == 2*self.nbatches:
+                self.batch_sums = [a + b for a, b in zip(
+                    self.batch_sums[::2], self.batch_sums[1::2])]
+                self.batch_sqs = [a + b for a, b in zip(
+                    self.batch_sqs[::2], self.batch_sqs[1::2])]
+                self.batch_size *= 2
+
+    @property
+    def acf(self):
+        """Autocorrelation function (averaged over walkers) of shape (lags, ndim)
+        """
+
+        nlags = min(self.n, self.maxlag + 1)
+        lags = np.arange(nlags)
+        mean = self.sums/self.n
+
+        # sums over the first and the last `n - lag` samples, required to center the lagged products
+        first_k = np.cumsum(self.head[:nlags-1], axis=0)
+        ind = (self.n - 1 - np.arange(nlags - 1)) % self.maxlag
+        last_k = np.cumsum(self.lagged[ind], axis=0)
+        zero = np.zeros((1,) + mean.shape)
+        sums_first = self.sums - np.vstack((zero, last_k))
+        sums_last = self.sums - np.vstack((zero, first_k))
+
+        # biased estimator as in `emcee.autocorr.function_1d`
+        acov = (self.lagged_sums[:nlags] - mean*(sums_first + sums_last) +
+                (self.n - lags)[:, None, None]*mean**2)/self.n
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.nanmean(acov/acov[0], axis=1)
+
+    def tau_window(self):
+        """Integrated autocorrelation time for each parameter, and whether its window exceeds `maxlag`
+        """
+
+        taus = 2*np.cumsum(self.acf, axis=0) - 1
+        tau = np.empty(taus.shape[1])
+        bound = np.zeros(taus.shape[1], dtype=bool)
+
+        for i, t in enumerate(taus.T):
+            # the window as in `emcee.autocorr.auto_window`
+            window = np.arange(len(t)) < self.c*t
+            bound[i] = window.all()
+            # without a window, the estimate at the largest lag is a lower bound for positively autocorrelated chains
+            tau[i] = t[-1] if bound[i] else t[np.argmin(window)]
+
+        return tau, bound
+
+    @property
+    def tau(self):
+        """Integrated autocorrelation time for each parameter
+
+        Only a lower bound for the parameters in `tau_is_bound`.
+        """
+        return self.tau_window()[0]
+
+    @property
+    def tau_is_bound(self):
+        """Whether the window of the estimator of `tau` did not close within `maxlag`, such that the estimate is only a lower bound
+        """
+        return self.tau_window()[1]
+
+    @property
+    def tau_bm(self):
+        """Batch-means estimate of the integrated autocorrelation time for each parameter
+        """
+
+        nbatches = len(self.batch_sums)
+        if nbatches < 2:
+            return np.full(self.sums.shape[1], np.nan)
+
+        sums = np.array(self.batch_sums)
+        nsamples = nbatches*self.batch_size
+
+        var_bm = self.batch_size * \
+            np.var(sums/self.batch_size, axis=0, ddof=1).mean(axis=0)
+        mean = sums.sum(axis=0)/nsamples
+        var = (np.sum(self.batch_sqs, axis=0)/nsamples - mean**2).mean(axis=0)
+
+        return var_bm/var
+
+    @property
+    def ess(self):
+        """Effective sample size for each parameter
+
+        Uses the larger of the two estimates of the autocorrelation time (`tau` and `tau_bm`). Batch means underestimate the autocorrelation time if it is not small relative to the batch size, and `tau` may be a lower bound.
+        """
+
+        nsamples = len(self.batch_sums)*self.batch_size*self.sums.shape[0]
+
+        return nsamples/np.fmax(self.tau, self.tau_bm)
+
+    @property
+    def rhat(self):
+        """Split R-hat across walkers for each parameter
+        """
+
+        half = len(self.batch_sums)//2
+        if not half:
+            return np.full(self.sums.shape[1], np.nan)
+
+        sums = np.array(self.batch_sums[:2*half])
+        sqs = np.array(self.batch_sqs[:2*half])
+        n = half*self.batch_size
+
+        # each half of each walker is one chain
+        sums = np.vstack((sums[:half].sum(axis=0), sums[half:].sum(axis=0)))
+        sqs = np.vstack((sqs[:half].sum(axis=0), sqs[half:].sum(axis=0)))
+
+        means = sums/n
+        within = ((sqs/n - means**2)*n/max(n - 1, 1)).mean(axis=0)
+        between = np.var(means, axis=0, ddof=1)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.sqrt(((n - 1)/n*within + between)/within)
+
+    def summary(self, names=None):
+        """Table of the autocorrelation times, effective sample sizes and R-hats
+        """
+
+        tau, bound = self.tau_window()
+
+        return pd.DataFrame({'tau': tau, 'tau is bound': bound, 'ess': self.ess, 'rhat': self.rhat}, index=names)
+
+
 class InvGammaDynare(ss.rv_continuous):
 
     name = 'inv_gamma_dynare'
 
     def _logpdf(self, x, s, nu):
 
-        if x < 0:
-            lpdf = -np.inf
-        else:
+        # vectorized to allow for batches of parameters
+        with np.errstate(invalid='ignore', divide='ignore'):
             lpdf = np.log(2) - gammaln(nu/2) - nu/2*(np.log(2) -
                                                      np.log(s)) - (nu+1)*np.log(x) - .5*s/np.square(x)
 
-        return lpdf
+        return np.where(x < 0, -np.inf, lpdf)
 
     def _pdf(self, x, s, nu):
         return np.exp(self._logpdf(x, s, nu))
 
+    def _rvs(self, s, nu, size=None, random_state=None):
+        # the square is inverse gamma distributed, which avoids the numerical inversion of the cdf
+        return np.sqrt(.5*s/random_state.gamma(nu/2, size=size))
+
+
+# codes of the distribution families known to `CompiledPrior`
+prior_families = {'norm': 0, 'uniform': 1, 'gamma': 2,
+                  'beta': 3, 'invgamma': 4, 'inv_gamma_dynare': 5}
+
+
+@njit(cache=True, nogil=True)
+def prior_logpdf_jit(x, codes, a, b, loc, scale, const):
+    """Sum of the log-densities of the standardized families for each row of `x`
+    """
+
+    n, ndim = x.shape
+    lps = np.zeros(n)
+
+    for i in range(n):
+        for j in range(ndim):
+
+            code = codes[j]
+            if code < 0:
+                continue
+
+            z = (x[i, j] - loc[j])/scale[j]
+
+            if code == 0:
+                lp = -.5*z**2
+            elif code == 1:
+                lp = 0. if 0 <= z <= 1 else -np.inf
+            elif code == 2:
+                lp = (a[j]-1)*np.log(z) - z if z >= 0 else -np.inf
+            elif code == 3:
+                lp = (a[j]-1)*np.log(z) + (b[j]-1) * \
+                    np.log(1-z) if 0 <= z <= 1 else -np.inf
+            elif code == 4:
+                lp = -(a[j]+1)*np.log(z) - 1/z if z > 0 else -np.inf
+            else:
+                # `a` is `nu` and `b` is `s`
+                lp = -(a[j]+1)*np.log(z) - .5*b[j] / \
+                    z**2 if z > 0 else -np.inf
+
+            lps[i] += lp + const[j]
+
+    return lps
+
+
+class CompiledPrior(object):
+    """The prior as one object that evaluates batches of parameter vectors at once
+
+    The frozen scipy distributions are grouped by family and evaluated with closed-form log-densities in a single jitted call. Families that are not known are evaluated with their `logpdf` method.
+
+    Parameters
+    ----------
+    frozen_prior : list
+        The frozen distributions as returned by `get_prior`
+    bounds : tuple of lists, optional
+        Lower and upper bounds of the parameters. `None` entries are ignored
+    """
+
+    def __init__(self, frozen_prior, bounds=None):
+
+        ndim = len(frozen_prior)
+
+        self.codes = np.zeros(ndim, dtype=np.int64)
+        self.a = np.ones(ndim)
+        self.b = np.ones(ndim)
+        self.loc = np.zeros(ndim)
+        self.scale = np.ones(ndim)
+        self.const = np.zeros(ndim)
+        self.other = []
+
+        for j, pl in enumerate(frozen_prior):
+
+            # scipy overwrites the name of custom distributions
+            name = 'inv_gamma_dynare' if isinstance(
+                pl.dist, InvGammaDynare) else pl.dist.name
+
+            if name not in prior_families:
+                # skipped by the jitted function
+                self.codes[j] = -1
+                self.other.append((j, pl))
+                continue
+
+            shapes, loc, scale = pl.dist._parse_args(*pl.args, **pl.kwds)
+            code = prior_families[name]
+
+            self.codes[j] = code
+            self.loc[j] = loc
+            self.scale[j] = scale
+            const = -np.log(scale)
+
+            if code == 0:
+                const -= .5*np.log(2*np.pi)
+            elif code == 2:
+                self.a[j] = shapes[0]
+                const -= gammaln(shapes[0])
+            elif code == 3:
+                self.a[j], self.b[j] = shapes
+                const -= betaln(*shapes)
+            elif code == 4:
+                self.a[j] = shapes[0]
+                const -= gammaln(shapes[0])
+            elif code == 5:
+                s, nu = shapes
+                self.a[j], self.b[j] = nu, s
+                const += np.log(2) - gammaln(nu/2) - nu/2*(np.log(2) - np.log(s))
+
+            self.const[j] = const
+
+        lb, ub = bounds if bounds is not None else ([None]*ndim, [None]*ndim)
+        self.lb = np.array([-np.inf if l is None else l for l in lb], dtype=float)
+        self.ub = np.array([np.inf if u is None else u for u in ub], dtype=float)
+
+    def logpdf(self, pars):
+        """Log-density of one parameter vector or a batch of shape (n, ndim)
+        """
+
+        x = np.atleast_2d(np.asarray(pars, dtype=float))
+        lps = prior_logpdf_jit(x, self.codes, self.a, self.b,
+                               self.loc, self.scale, self.const)
+
+        for j, pl in self.other:
+            lps += pl.logpdf(x[:, j])
+
+        return lps if np.ndim(pars) > 1 else lps[0]
+
+    __call__ = logpdf
+
+    def in_bounds(self, pars):
+        """Boolean mask of the parameter values that lie within the bounds
+        """
+
+        x = np.asarray(pars, dtype=float)
+
+        return (x >= self.lb) & (x <= self.ub)
+
 
 def inv_gamma_spec(mu, sigma):
 
@@ -327,9 +660,33 @@ def pmdm_report(self, x_max, res_max, n=np.inf, printfunc=print):
     return
 
 
+def gfevd_runner(self, i, groups, resids, states, pars, horizon, linear, args):
+    """Summed squared generalized impulse responses for the draws in the `i`-th group, which share one parameter set
+    """
+
+    from .engine import girf_jit
+
+    idx = groups[i]
+
+    if pars[idx[0]] is not None:
+        self.set_par(pars[idx[0]], **args)
+
+    pmat, qmat, pterm, qterm, bmat, bterm = self.precalc_mat
+    dimeps = self.dimeps
+
+    aca = np.ascontiguousarray
+
+    gis = girf_jit(pmat, pterm, aca(qmat[:, :, :-dimeps]), aca(qterm[..., :-dimeps]), bmat, bterm, self.sys[2], *self.hx,
+                   aca(states[idx][:, -(self.dimq-dimeps):]), aca(resids[idx]), horizon, linear)
+
+    return np.sum(gis**2, axis=0)
+
+
 def gfevd(self, eps_dict, horizon=1, nsamples=None, linear=False, seed=0, verbose=True, **args):
     """Calculates the generalized forecasting error variance decomposition (GFEVD, Lanne & Nyberg)
 
+    Draws that share a parameter set are simulated jointly by a jitted kernel, which propagates all shocks and the baseline for all their initial states. The parameter sets are distributed over the pool.
+
     Parameters
     ----------
     eps : array or dict
@@ -358,26 +715,39 @@ def gfevd(self, eps_dict, horizon=1, nsamples=None, linear=False, seed=0, verbos
     numbers = np.arange(resids.shape[0])
     draw = np.random.choice(numbers, nsamples, replace=False)
 
-    sample = zip(resids[draw], states[draw], pars[draw])
-    gis = np.zeros((len(self.shocks), len(self.vv)))
+    sample = [resids[draw], states[draw], pars[draw]]
 
-    wrap = tqdm.tqdm if verbose else (lambda x, **kwarg: x)
+    if hasattr(self, 'pool'):
+        from .estimation import get_pool
+        get_pool(self)
 
-    for s in wrap(sample, total=nsamples, unit='draws', dynamic_ncols=True):
+    if getattr(self, 'pool', None) is not None and not self.debug:
+        # workers attach to the arrays instead of receiving copies
+        sample = [share(x) for x in sample]
 
-        if s[2] is not None:
-            self.set_par(s[2], **args)
+    # draws that share a parameter set are simulated in one batch
+    if pars.dtype == object:
+        # e.g. from `extract(sample=None)`. Draws without parameters are simulated with the current ones
+        keys = [None if p is None else tuple(np.ravel(p)) for p in pars[draw]]
+        ids = {}
+        inv = np.array([ids.setdefault(k, len(ids)) for k in keys])
+    else:
+        _, inv = np.unique(pars[draw], axis=0, return_inverse=True)
+    inv = inv.ravel()
+    groups = [np.flatnonzero(inv == g) for g in range(inv.max() + 1)]
 
-        for e in self.shocks:
+    runner = WorkerTask(self, gfevd_runner, groups=groups, resids=sample[0], states=sample[1], pars=sample[2],
+                        horizon=horizon, linear=linear, args=args)
 
-            ei = self.shocks.index(e)
-            shock = (e, s[0][ei], 0)
+    gis = np.zeros((len(self.shocks), len(self.vv)))
 
-            irfs = self.irfs(shock, T=horizon, state=s[1], linear=linear)[
-                0].to_numpy()[-1]
-            void = self.irfs((e, 0, 0), T=horizon, state=s[1], linear=linear)[
-                0].to_numpy()[-1]
-            gis[ei] += (irfs - void)**2
+    with tqdm.tqdm(total=nsamples, unit='draws', dynamic_ncols=True, disable=not verbose) as pbar:
+        for group, gi in zip(groups, self.mapper(runner, range(len(groups)))):
+            gis += gi
+            pbar.update(len(group))
+
+    for x in sample:
+        release(x)
 
     gis /= np.sum(gis, axis=0)
 
@@ -414,138 +784,329 @@ def mbcs_index(self, vd, verbose=True):
     return mbs
 
 
-def nhd(self, eps_dict, linear=False, **args):
-    """Calculates the normalized historic decomposition, based on normalized counterfactuals
+def nhd_runner(self, i, groups, pars, states, resids, linear, args):
+    """Summed historic decompositions and smoothed states for the draws in the `i`-th group, which share one parameter set
     """
 
-    states = eps_dict['init']
-    pars = eps_dict['pars']
-    resids = eps_dict['resid']
+    from .engine import nhd_jit
 
-    nsamples = pars.shape[0]
-    hd = np.empty((nsamples, self.dimeps, self.data.shape[0], self.dimx))
-    means = np.empty((nsamples, self.data.shape[0], self.dimx))
-    rcons = np.empty(self.dimeps)
+    idx = groups[i]
+    self.set_par(pars[idx[0]], **args)
 
-    for i in range(nsamples):
+    pmat, qmat, pterm, qterm, bmat, bterm = self.precalc_mat
+    aca = np.ascontiguousarray
 
-        self.set_par(pars[i], **args)
+    hd, means = 0, 0
 
-        pmat, qmat, pterm, qterm, bmat, bterm = self.precalc_mat
-        qmat = qmat[:, :, :-self.dimeps]
-        qterm = qterm[..., :-self.dimeps]
+    for j in idx:
+        hd_j, means_j = nhd_jit(pmat, pterm, aca(qmat[:, :, :-self.dimeps]), aca(qterm[..., :-self.dimeps]), bmat, bterm, self.sys[2], *self.hx,
+                                aca(states[j], dtype=float), aca(resids[j], dtype=float), linear)
+        hd += hd_j
+        means += means_j
 
-        state = states[i]
-        means[i, 0, :] = state
+    return hd, means
 
-        hd[i, :, 0, :] = state/self.dimeps
 
-        for t, resid in enumerate(resids[i]):
-            state, (l, k), _ = self.t_func(
-                state, resid, return_k=True, linear=linear)
-            means[i, t+1, :] = state
+def nhd(self, eps_dict, linear=False, **args):
+    """Calculates the normalized historic decomposition, based on normalized counterfactuals
+
+    The counterfactuals of all shocks are propagated jointly by a jitted kernel. Draws are grouped by parameter set and the groups are distributed over the pool.
+    """
+
+    sample = [eps_dict['pars'], eps_dict['init'], eps_dict['resid']]
+    nsamples = len(sample[0])
 
-            # for each shock:
-            for s in range(self.dimeps):
+    if hasattr(self, 'pool'):
+        from .estimation import get_pool
+        get_pool(self)
 
-                eps = np.zeros(self.dimeps)
-                eps[s] = resid[s]
+    if getattr(self, 'pool', None) is not None and not self.debug:
+        # workers attach to the arrays instead of receiving copies
+        sample = [share(np.asarray(x)) for x in sample]
 
-                v = np.hstack((hd[i, s, t, -self.dimq+self.dimeps:], eps))
-                p = pmat[l, k] @ v
-                q = qmat[l, k] @ v
-                hd[i, s, t+1, :] = np.hstack((p, q))
+    # draws that share a parameter set are processed together
+    _, inv = np.unique(np.asarray(sample[0]), axis=0, return_inverse=True)
+    inv = inv.ravel()
+    groups = [np.flatnonzero(inv == g) for g in range(inv.max() + 1)]
 
-                if k:
-                    rcons[s] = bmat[0, l, k] @ v
+    runner = WorkerTask(self, nhd_runner, groups=groups, pars=sample[0], states=sample[1], resids=sample[2],
+                        linear=linear, args=args)
 
-            if k and rcons.sum():
-                for s in range(len(self.shocks)):
-                    # proportional to relative contribution to constaint spell duration
-                    hd[i, s, t+1, :] += rcons[s] / \
-                        rcons.sum()*np.hstack((pterm[l, k], qterm[l, k]))
+    hd = np.zeros((self.dimeps, self.data.shape[0], self.dimx))
+    means = np.zeros((self.data.shape[0], self.dimx))
+
+    # average on the fly
+    for hd_i, means_i in self.mapper(runner, range(len(groups))):
+        hd += hd_i/nsamples
+        means += means_i/nsamples
+
+    for x in sample:
+        release(x)
 
     # as a list of DataFrames
     hd = [pd.DataFrame(h, index=self.data.index, columns=self.vv)
-          for h in hd.mean(axis=0)]
-    means = pd.DataFrame(means.mean(
-        axis=0), index=self.data.index, columns=self.vv)
+          for h in hd]
+    means = pd.DataFrame(means, index=self.data.index, columns=self.vv)
 
     return hd, means
 
 
-def mdd_lp(chain, lprobs, calc_hess=False):
-    """Approximate the marginal data density useing the LaPlace method.
+def hessian(self, x=None, h=None, target=1e-2, niter=3, linear=None, lprob_seed=None, cache=True, verbose=False):
+    """Finite-difference Hessian and gradient of `lprob`, evaluated in parallel
+
+    All 2n² + 1 points of the central-difference stencil are evaluated at once via `batch_map`, i.e. distributed over the pool. Unless `h` is given, the step of each parameter is first adapted in `niter` rounds (of 2n evaluations each) such that the second-order change of `lprob` is about `target`. This balances the truncation error against the numerical noise of the likelihood. Steps are limited to half the distance to the prior bounds, if there are any. The result is stored in `fdict['hessian']` and reused if it is requested again for the same point and arguments, as long as the model (its revision) and the prior bounds did not change meanwhile.
+
+    Parameters
+    ----------
+    x : array, optional
+        The point at which the Hessian is evaluated. Defaults to the mode
+    h : float or array, optional
+        Step sizes. Defaults to adaptive step sizes
+    target : float, optional
+        Targeted change of `lprob` when adapting the step sizes. Defaults to 1e-2
+    niter : int, optional
+        Number of rounds of the step size adaptation. Defaults to 3
+    cache : bool, optional
+        Whether to reuse a previous result for the same point and arguments. Defaults to True
+
+    Returns
+    -------
+    tuple
+        The Hessian and the gradient
     """
 
-    mode_x = chain[lprobs.argmax()]
+    if verbose:
+        st = time.time()
+
+    x = np.array(self.fdict['mode_x'] if x is None else x, dtype=float)
+    # priors given by three parameters come without bounds (`None`)
+    lb, ub = self.fdict['prior_bounds']
+    bnd = np.array([[-np.inf if b is None else b for b in lb],
+                    [np.inf if b is None else b for b in ub]], dtype=float)
+
+    def cache_key():
+        # evaluating `lprob` in this process also increases the revision, so the key is taken after the evaluation
+        return (linear, lprob_seed, target, niter, getattr(self, 'revision', 0), bnd.tobytes())
+
+    if cache and h is None and 'hessian' in self.fdict:
+        cached = self.fdict['hessian']
+        if len(cached) > 3 and np.array_equal(cached[0], x) and cached[3] == cache_key():
+            return cached[1], cached[2]
+
+    lprob_batch = WorkerTask(self, 'lprob_batch', linear=linear,
+                             verbose=verbose > 2, lprob_seed=lprob_seed or 'set')
+
+    def evaluate(xs):
+        return self.batch_map(lprob_batch, xs)
+
+    ndim = len(x)
+    h_max = .5*np.minimum(x - bnd[0], bnd[1] - x)
+
+    f0 = evaluate(x[None])[0]
+    nevals = 1
+    h_given = h
+
+    if h is None:
+        width = bnd[1] - bnd[0]
+        h = np.where(np.isfinite(width), 1e-3*width,
+                     1e-3*np.maximum(1, np.abs(x)))
+        h = np.minimum(h, h_max)
+
+        for _ in range(niter):
+            fs = evaluate(np.vstack((x + np.diag(h), x - np.diag(h))))
+            nevals += 2*ndim
+            curv = np.abs(fs[:ndim] - 2*f0 + fs[ndim:])/h**2
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                h_new = np.sqrt(2*target/curv)
+            h = np.where(np.isfinite(h_new) & (curv > 0),
+                         np.minimum(h_new, h_max), h)
+    else:
+        h = np.minimum(np.broadcast_to(h, x.shape), h_max)
+
+    # the full stencil in one go
+    iu, ju = np.triu_indices(ndim, 1)
+    d = np.diag(h)
+    fs = evaluate(np.vstack((x + d, x - d, x + d[iu] + d[ju], x + d[iu] - d[ju],
+                             x - d[iu] + d[ju], x - d[iu] - d[ju])))
+    nevals += len(fs)
+
+    f_p, f_m = fs[:ndim], fs[ndim:2*ndim]
+    f_pp, f_pm, f_mp, f_mm = fs[2*ndim:].reshape(4, -1)
+
+    hess = np.diag((f_p - 2*f0 + f_m)/h**2)
+    hess[iu, ju] = (f_pp - f_pm - f_mp + f_mm)/(4*h[iu]*h[ju])
+    hess[ju, iu] = hess[iu, ju]
+    grad = (f_p - f_m)/(2*h)
+
+    if not np.all(np.isfinite(hess)):
+        raise ValueError('[hessian:]'.ljust(
+            15, ' ') + " Some points of the stencil have zero probability. Try smaller steps.")
+
+    # results for given steps are not reused
+    self.fdict['hessian'] = x, hess, grad, cache_key() if h_given is None else None
+
+    if verbose:
+        print('[hessian:]'.ljust(15, ' ') + ' %s evaluations done after %s.' %
+              (nevals, timeprint(time.time() - st, 3)))
+
+    return hess, grad
 
-    if calc_hess:
 
-        import numdifftools as nd
+def mode_cov(self, x=None, **args):
+    """Covariance of the Laplace approximation of the posterior at the mode (the inverse of the negative Hessian of `lprob`)
 
-        np.warnings.filterwarnings('ignore')
-        hh = nd.Hessian(func)(mode_x)
-        np.warnings.filterwarnings('default')
+    Takes the same arguments as `hessian`.
+    """
+
+    hess, _ = hessian(self, x, **args)
+
+    return np.linalg.inv(-hess)
+
+
+def mdd_lp(chain, lprobs, calc_hess=False, hess=None):
+    """Approximate the marginal data density useing the LaPlace method.
+
+    If `calc_hess`, the covariance is the inverse of the negative Hessian `hess` of `lprob` at the mode (see `hessian`). Otherwise, the covariance of the chain is used.
+    """
+
+    if calc_hess:
 
-        if np.isnan(hh).any():
+        if hess is None:
             raise ValueError('[mdd:]'.ljust(
-                15, ' ') + "Option `hess` is experimental and did not return a usable hessian matrix.")
+                15, ' ') + "Option `calc_hess` requires the hessian matrix (see `hessian`).")
 
-        inv_hess = np.linalg.inv(hh)
+        inv_hess = np.linalg.inv(-hess)
 
     else:
         inv_hess = np.cov(chain.T)
 
     ndim = chain.shape[-1]
-    log_det_inv_hess = np.log(np.linalg.det(inv_hess))
+    sign, log_det_inv_hess = np.linalg.slogdet(inv_hess)
+
+    if sign <= 0:
+        print('[mdd:]'.ljust(15, ' ') +
+              ' Covariance is not positive definite, the posterior maximum of the chain is probably not close to the mode.')
+        return np.nan
+
     mdd = .5*ndim*np.log(2*np.pi) + .5*log_det_inv_hess + lprobs.max()
 
     return mdd
 
 
-def mdd_mhm(chain, lprobs, alpha=.05, pool=None, verbose=False, debug=False):
+def chain_moments(chain, chunksize=100000):
+    """Mean and covariance of a (possibly very long) flat chain, accumulated in chunks
+    """
+
+    nsamples = len(chain)
+    # shifting by a draw avoids cancellation in the second moment
+    shift = np.array(chain[0], dtype=float)
+
+    s1 = np.zeros_like(shift)
+    s2 = np.zeros((len(shift), len(shift)))
+
+    for start in range(0, nsamples, chunksize):
+        dev = chain[start:start+chunksize] - shift
+        s1 += dev.sum(axis=0)
+        s2 += dev.T @ dev
+
+    mean = s1/nsamples
+    cov = (s2 - nsamples*np.outer(mean, mean))/(nsamples - 1)
+
+    return mean + shift, cov
+
+
+def logsumexp_add(lse, x):
+    """Add the values `x` to the running log-sum-exp `lse`, which is a tuple of (maximum, sum of exp(values - maximum))
+    """
+
+    lmax, lsum = lse
+    xmax = np.max(x, initial=-np.inf)
+
+    if xmax == -np.inf:
+        return lmax, lsum
+
+    new_max = max(lmax, xmax)
+    lsum = lsum*np.exp(lmax - new_max) + np.sum(np.exp(x - new_max))
+
+    return new_max, lsum
+
+
+def mdd_mhm_runner(bounds, chain, lprobs, cmean, chol, thresh, chunksize):
+    """Log-sum-exp of the weights of the modified harmonic mean for the draws within `bounds`
+
+    Returns the running log-sum-exp (see `logsumexp_add`) and the number of draws within the truncation region.
+    """
+
+    ndim = len(cmean)
+    # normalizing constant of the multivariate normal
+    lconst = -.5*ndim*np.log(2*np.pi) - np.sum(np.log(np.diag(chol)))
+
+    lse = -np.inf, 0.
+    ninside = 0
+
+    for start in range(bounds[0], bounds[1], chunksize):
+
+        stop = min(start + chunksize, bounds[1])
+
+        # batched Mahalanobis distances
+        dev = sl.solve_triangular(
+            chol, (chain[start:stop] - cmean).T, lower=True, check_finite=False)
+        maha = np.sum(dev**2, axis=0)
+        inside = maha < thresh
+
+        lse = logsumexp_add(
+            lse, lconst - .5*maha[inside] - lprobs[start:stop][inside])
+        ninside += np.sum(inside)
+
+    return lse, ninside
+
+
+def mdd_mhm(chain, lprobs, alpha=.05, pool=None, chunksize=100000, verbose=False, debug=False):
     """Approximate the marginal data density useing modified harmonic mean.
+
+    Uses the truncated normal weighting function of Geweke (1999). The draws are processed in chunks of `chunksize`, such that long chains do not require large temporary arrays. If `pool` is given, the chain is split over its workers, which attach to the chain in shared memory.
     """
 
-    from grgrlib.stats import logpdf
-
-    cmean = chain.mean(axis=0)
-    ccov = np.cov(chain.T)
-    cicov = np.linalg.inv(ccov)
-
-    nsamples = chain.shape[0]
-    ##
-
-    def runner(chunk):
-        ##
-        res = np.empty_like(chunk)
-        wrapper = tqdm.tqdm if verbose else (lambda x, **kwarg: x)
-        ##
-        for i in wrapper(range(len(chunk))):
-            drv = chain[i]
-            drl = lprobs[i]
-            ##
-            if (drv - cmean) @ cicov @ (drv - cmean) < ss.chi2.ppf(1-alpha, df=chain.shape[-1]):
-                res[i] = logpdf(drv, cmean, ccov) - drl
-            else:
-                res[i] = -np.inf
-        return res
+    chain = np.asarray(chain)
+    lprobs = np.asarray(lprobs)
+
+    nsamples, ndim = chain.shape
+
+    cmean, ccov = chain_moments(chain, chunksize)
+    chol = np.linalg.cholesky(ccov)
+    thresh = ss.chi2.ppf(1-alpha, df=ndim)
 
     if pool and not debug:
-        if pool.ncpus is None:
-            import pathos
-            nbatches = pathos.multiprocessing.cpu_count()
-        else:
-            nbatches = pool.ncpus
 
-        batches = pool.imap(runner, np.array_split(chain, nbatches))
-        mls = np.vstack(list(batches))
+        from functools import partial
+
+        bounds = np.linspace(0, nsamples, pool.ncpus + 1).astype(int)
+        schain, slprobs = share(chain), share(lprobs)
+
+        runner = partial(mdd_mhm_runner, chain=schain, lprobs=slprobs,
+                         cmean=cmean, chol=chol, thresh=thresh, chunksize=chunksize)
+        res = list(pool.imap(runner, zip(bounds[:-1], bounds[1:])))
+
+        release(schain)
+        release(slprobs)
+
+        lse = -np.inf, 0.
+        for (lmax, lsum), _ in res:
+            if lsum:
+                lse = logsumexp_add(lse, lmax + np.log(lsum))
+        ninside = sum(r[1] for r in res)
+
     else:
-        mls = runner(chain)
+        lse, ninside = mdd_mhm_runner(
+            (0, nsamples), chain, lprobs, cmean, chol, thresh, chunksize)
+
+    if verbose:
+        print('[mdd:]'.ljust(15, ' ') + ' %s of %s draws are within the truncation region.' %
+              (ninside, nsamples))
 
-    maxllike = np.max(mls)  # for numeric stability
-    imdd = np.log(np.mean(np.exp(mls-maxllike))) + maxllike
+    # the weighting function is normalized by the mass of the truncation region
+    imdd = lse[0] + np.log(lse[1]/nsamples) - np.log(1-alpha)
 
     return -imdd
 
@@ -556,7 +1117,9 @@ def mdd(self, method='laplace', chain=None, lprobs=None, tune=None, verbose=Fals
     Parameters
     ----------
     method : str
-        The method used for the approximation. Can be either of 'laplace', 'mhm' (modified harmonic mean) or 'hess' (LaPlace approximation with the numerical approximation of the hessian; NOT FUNCTIONAL).
+        The method used for the approximation. Can be either of 'laplace', 'mhm' (modified harmonic mean) or 'hess' (LaPlace approximation with the numerical approximation of the hessian at the mode of the chain, see `hessian`).
+    args : keyword arguments, optional
+        Passed on to the approximation, e.g. `pool=self.pool` to split the modified harmonic mean over the workers. Since the calculation is vectorized, this only pays off for very long chains.
     """
 
     if verbose:
@@ -564,12 +1127,12 @@ def mdd(self, method='laplace', chain=None, lprobs=None, tune=None, verbose=Fals
 
     if chain is None:
         tune = tune or self.get_tune
-        chain = self.get_chain()[-tune:]
+        chain = self.get_chain(tail=tune)
         chain = chain.reshape(-1, chain.shape[-1])
 
     if lprobs is None:
         tune = tune or self.get_tune
-        lprobs = self.get_log_prob()[-tune:]
+        lprobs = self.get_log_prob(tail=tune)
         lprobs = lprobs.flatten()
 
     if method in ('laplace', 'lp'):
@@ -577,18 +1140,19 @@ def mdd(self, method='laplace', chain=None, lprobs=None, tune=None, verbose=Fals
         mdd = mdd_lp(chain, lprobs, calc_hess=False, **args)
     elif method == 'hess':
         mstr = 'LaPlace approximation with hessian approximation'
-        mdd = mdd_lp(chain, lprobs, calc_hess=True, **args)
+        hess = hessian(self, chain[lprobs.argmax()],
+                       verbose=verbose > 1)[0]
+        mdd = mdd_lp(chain, lprobs, calc_hess=True, hess=hess, **args)
     elif method == 'mhm':
         mstr = 'modified harmonic mean'
-        pool = self.pool if hasattr(self, 'pool') else None
-        mdd = mdd_mhm(chain, lprobs, pool=pool, verbose=verbose > 1, **args)
+        mdd = mdd_mhm(chain, lprobs, verbose=verbose > 1, **args)
     else:
         raise NotImplementedError('[mdd:]'.ljust(
             15, ' ') + "`method` must be one of `laplace`, `mhm` or `hess`.")
 
     if verbose:
         print('[mdd:]'.ljust(15, ' ') + "done after %s. Marginal data density according to %s is %s." %
-              (timeprint(time.time()-st), mstr, mdd.round(3)))
+              (timeprint(time.time()-st), mstr, np.round(mdd, 3)))
 
     return mdd
 
@@ -598,6 +1162,6 @@ def post_mean(self, chain=None, tune=None):
     """
 
     tune = tune or self.get_tune
-    chain = chain or self.get_chain()[-tune:]
+    chain = self.get_chain(tail=tune) if chain is None else chain[-tune:]
 
     return chain.reshape(-1, chain.shape[-1]).mean(axis=0)
@@ -124,6 +124,92 @@ def o_func(self, state, covs=None, pars=None):
     return iv95_obs, iv95
 
 
+def irfs_runner(self, par, T, new_shocklist, state, set_k, force_init_equil, linear, verbose, args):
+    """Simulate the impulse responses for a single parameter vector
+    """
+
+    shocks = self.shocks
+    nstates = self.dimx
+
+    X = np.empty((T, nstates))
+    K = np.empty(T)
+    L = np.empty(T)
+
+    if np.any(par):
+        try:
+            self.set_par(par, **args)
+        except ValueError:
+            X[:] = np.nan
+            K[:] = np.nan
+            L[:] = np.nan
+            return X, K, L, 4
+
+    st_vec = state if state is not None else np.zeros(nstates)
+
+    supererrflag = False
+    supermultflag = False
+    l, k = 0, 0
+
+    for t in range(T):
+
+        shk_vec = np.zeros(len(shocks))
+        for vec in new_shocklist:
+            if vec[2] == t:
+
+                shock = vec[0]
+                shocksize = vec[1]
+
+                shock_arg = shocks.index(shock)
+                shk_vec[shock_arg] = shocksize
+
+        # force_init_equil will force recalculation of l,k only if the shock vec is not empty
+        if force_init_equil and not np.any(shk_vec):
+            set_k_eff = (l-1, k) if l else (l, max(k-1, 0))
+
+            _, (l_endo, k_endo), flag = self.t_func(
+                st_vec[-(self.dimq-self.dimeps):], shk_vec, set_k=None, linear=linear, return_k=True)
+
+            multflag = l_endo != set_k_eff[0] or k_endo != set_k_eff[1]
+            supermultflag |= multflag
+
+            if verbose > 1 and multflag:
+                print('[irfs:]'.ljust(
+                    15, ' ') + 'Multiplicity found in period %s: new eql. %s coexits with old eql. %s.' % (t, (l_endo, k_endo), set_k_eff))
+
+        elif set_k is None:
+            set_k_eff = None
+        elif isinstance(set_k, tuple):
+            set_l_eff, set_k_eff = set_k
+            if set_l_eff-t >= 0:
+                set_k_eff = set_l_eff-t, set_k_eff
+            else:
+                set_k_eff = 0, max(set_k_eff+set_l_eff-t, 0)
+        elif set_k:
+            set_k_eff = 0, max(set_k-t, 0)
+        else:
+            set_k_eff = set_k
+
+        if set_k_eff:
+            if set_k_eff[0] > self.lks[0] or set_k_eff[1] > self.lks[1]:
+                raise IndexError(
+                    'set_k exceeds l_max (%s vs. %s).' % (set_k_eff, self.lks))
+
+        st_vec, (l, k), flag = self.t_func(
+            st_vec[-(self.dimq-self.dimeps):], shk_vec, set_k=set_k_eff, linear=linear, return_k=True)
+
+        if flag and verbose > 1:
+            print('[irfs:]'.ljust(
+                15, ' ') + 'No rational expectations solution found in period %s (error flag %s).' % (t, flag))
+
+        supererrflag |= flag
+
+        X[t, :] = st_vec
+        L[t] = l
+        K[t] = k
+
+    return X, L, K, supererrflag, supermultflag
+
+
 def irfs(self, shocklist, pars=None, state=None, T=30, linear=False, set_k=False, force_init_equil=None, verbose=True, debug=False, **args):
     """Simulate impulse responses
 
@@ -149,7 +235,7 @@ def irfs(self, shocklist, pars=None, state=None, T=30, linear=False, set_k=False
         The simulated series as a pandas.DataFrame object and the expected durations at the constraint
     """
 
-    from grgrlib.core import serializer
+    from .parallel import WorkerTask
 
     self.debug |= debug
     if force_init_equil is None:
@@ -159,16 +245,10 @@ def irfs(self, shocklist, pars=None, state=None, T=30, linear=False, set_k=False
         shocklist = [shocklist, ]
 
     if hasattr(self, 'pool'):
-        from .estimation import create_pool
-        create_pool(self)
+        from .estimation import get_pool
+        get_pool(self)
 
     st = time.time()
-    shocks = self.shocks
-    nstates = self.dimx
-
-    if self.set_par is not None:
-        set_par = serializer(self.set_par)
-    t_func = serializer(self.t_func)
 
     # accept all sorts of inputs
     new_shocklist = []
@@ -180,85 +260,8 @@ def irfs(self, shocklist, pars=None, state=None, T=30, linear=False, set_k=False
             vec += 0,
         new_shocklist.append(vec)
 
-    def runner(par):
-
-        X = np.empty((T, nstates))
-        K = np.empty(T)
-        L = np.empty(T)
-
-        if np.any(par):
-            try:
-                set_par(par, **args)
-            except ValueError:
-                X[:] = np.nan
-                K[:] = np.nan
-                L[:] = np.nan
-                return X, K, L, 4
-
-        st_vec = state if state is not None else np.zeros(nstates)
-
-        supererrflag = False
-        supermultflag = False
-        l, k = 0, 0
-
-        for t in range(T):
-
-            shk_vec = np.zeros(len(shocks))
-            for vec in new_shocklist:
-                if vec[2] == t:
-
-                    shock = vec[0]
-                    shocksize = vec[1]
-
-                    shock_arg = shocks.index(shock)
-                    shk_vec[shock_arg] = shocksize
-
-            # force_init_equil will force recalculation of l,k only if the shock vec is not empty
-            if force_init_equil and not np.any(shk_vec):
-                set_k_eff = (l-1, k) if l else (l, max(k-1, 0))
-
-                _, (l_endo, k_endo), flag = t_func(
-                    st_vec[-(self.dimq-self.dimeps):], shk_vec, set_k=None, linear=linear, return_k=True)
-
-                multflag = l_endo != set_k_eff[0] or k_endo != set_k_eff[1]
-                supermultflag |= multflag
-
-                if verbose > 1 and multflag:
-                    print('[irfs:]'.ljust(
-                        15, ' ') + 'Multiplicity found in period %s: new eql. %s coexits with old eql. %s.' % (t, (l_endo, k_endo), set_k_eff))
-
-            elif set_k is None:
-                set_k_eff = None
-            elif isinstance(set_k, tuple):
-                set_l_eff, set_k_eff = set_k
-                if set_l_eff-t >= 0:
-                    set_k_eff = set_l_eff-t, set_k_eff
-                else:
-                    set_k_eff = 0, max(set_k_eff+set_l_eff-t, 0)
-            elif set_k:
-                set_k_eff = 0, max(set_k-t, 0)
-            else:
-                set_k_eff = set_k
-
-            if set_k_eff:
-                if set_k_eff[0] > self.lks[0] or set_k_eff[1] > self.lks[1]:
-                    raise IndexError(
-                        'set_k exceeds l_max (%s vs. %s).' % (set_k_eff, self.lks))
-
-            st_vec, (l, k), flag = t_func(
-                st_vec[-(self.dimq-self.dimeps):], shk_vec, set_k=set_k_eff, linear=linear, return_k=True)
-
-            if flag and verbose > 1:
-                print('[irfs:]'.ljust(
-                    15, ' ') + 'No rational expectations solution found in period %s (error flag %s).' % (t, flag))
-
-            supererrflag |= flag
-
-            X[t, :] = st_vec
-            L[t] = l
-            K[t] = k
-
-        return X, L, K, supererrflag, supermultflag
+    runner = WorkerTask(self, irfs_runner, T=T, new_shocklist=new_shocklist, state=state, set_k=set_k,
+                        force_init_equil=force_init_equil, linear=linear, verbose=verbose, args=args)
 
     if pars is not None and np.ndim(pars) > 1:
         res = self.mapper(runner, pars)
@@ -311,6 +314,42 @@ def mask(self, verbose=False):
     return msk.rename(columns=dict(zip(self.observables, self.shocks)))[:-1]
 
 
+def simulate_runner(self, i, pars, resid, init, mask, operation, linear, vv_orig, args):
+    """Simulate the `i`-th series given the parameters, the innovations and the initial states (which may be in shared memory)
+    """
+
+    superflag = False
+    par, eps, state = pars[i], resid[i], init[i]
+
+    if mask is not None:
+        eps = np.where(np.isnan(mask), eps, operation(np.array(mask), eps))
+
+    if self.set_par is not None:
+        _, vv = self.set_par(par, return_vv=True, **args)
+        if not np.all(vv == vv_orig):
+            raise Exception('The ordering of variables has changed given different parameters.')
+
+    X = [state]
+    L, K = [], []
+
+    for eps_t in eps:
+
+        state, (l, k), flag = self.t_func(
+            state, eps_t, return_k=True, linear=linear)
+
+        superflag |= flag
+
+        X.append(state)
+        L.append(l)
+        K.append(k)
+
+    X = np.array(X)
+    LK = np.array((L, K))
+    K = np.array(K)
+
+    return X, LK, superflag
+
+
 def simulate(self, source=None, mask=None, pars=None, resid=None, init=None, operation=np.multiply, linear=False, debug=False, verbose=False, **args):
     """Simulate time series given a series of exogenous innovations.
 
@@ -321,13 +360,13 @@ def simulate(self, source=None, mask=None, pars=None, resid=None, init=None, ope
         mask : array
             Mask for eps. Each non-None element will be replaced.
     """
-    from grgrlib.core import serializer
+    from .parallel import WorkerTask, share, release
 
     pars = pars if pars is not None else source['pars']
     resi = resid if resid is not None else source['resid']
     init = init if init is not None else source['init']
 
-    sample = pars, resi, init
+    sample = [np.asarray(pars), np.asarray(resi), np.asarray(init)]
 
     if verbose:
         st = time.time()
@@ -335,57 +374,27 @@ def simulate(self, source=None, mask=None, pars=None, resid=None, init=None, ope
     self.debug |= debug
 
     if hasattr(self, 'pool'):
-        from .estimation import create_pool
-        create_pool(self)
-
-    if self.set_par is not None:
-        set_par = serializer(self.set_par)
-    else:
-        set_par = None
-
-    t_func = serializer(self.t_func)
-    obs = serializer(self.obs)
-    vv_orig = self.vv.copy()
-
-    def runner(arg):
-
-        superflag = False
-        par, eps, state = arg
+        from .estimation import get_pool
+        get_pool(self)
 
+    if getattr(self, 'pool', None) is not None and not self.debug:
+        # workers attach to the arrays instead of receiving copies
+        sample = [share(x) for x in sample]
         if mask is not None:
-            eps = np.where(np.isnan(mask), eps, operation(np.array(mask), eps))
-
-        if set_par is not None:
-            _, vv = set_par(par, return_vv=True, **args)
-            if not np.all(vv == vv_orig):
-                raise Exception('The ordering of variables has changed given different parameters.')
-
-        X = [state]
-        L, K = [], []
-
-        for eps_t in eps:
-
-            state, (l, k), flag = t_func(
-                state, eps_t, return_k=True, linear=linear)
+            mask = share(np.array(mask))
 
-            superflag |= flag
-
-            X.append(state)
-            L.append(l)
-            K.append(k)
-
-        X = np.array(X)
-        LK = np.array((L, K))
-        K = np.array(K)
-
-        return X, LK, superflag
+    runner = WorkerTask(self, simulate_runner, pars=sample[0], resid=sample[1], init=sample[2], mask=mask,
+                        operation=operation, linear=linear, vv_orig=self.vv.copy(), args=args)
 
     wrap = tqdm.tqdm if verbose else (lambda x, **kwarg: x)
-    res = wrap(self.mapper(runner, zip(*sample)), unit=' sample(s)',
-               total=len(source['pars']), dynamic_ncols=True)
+    res = wrap(self.mapper(runner, range(len(sample[0]))), unit=' sample(s)',
+               total=len(sample[0]), dynamic_ncols=True)
 
     X, LK, flags = map2arr(res)
 
+    for x in sample + [mask]:
+        release(x)
+
     if verbose > 1:
         print('[simulate:]'.ljust(15, ' ')+'Simulation took ',
               time.time() - st, ' seconds.')
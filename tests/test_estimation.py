@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+from pydsge import DSGE, example
+
+
+def test_lprob_and_grad_is_independent_of_earlier_calls():
+
+    yaml, data = example
+    mod = DSGE.read(yaml)
+    mod.load_data(pd.read_csv(data, index_col='date', parse_dates=True))
+    mod.prep_estim(linear=True, ncores=0, verbose=False)
+
+    p0 = np.array(mod.fdict['init_value'])
+    # leave some other filter state behind
+    mod.lprob(p0*1.05)
+
+    lp, grad = mod.lprob_and_grad(p0)
+    assert np.isclose(lp, mod.lprob(p0), rtol=0, atol=1e-8)
+
+    h = 1e-5*np.maximum(1, np.abs(p0))
+    fd = np.empty(len(p0))
+    for i in range(len(p0)):
+        e = np.zeros(len(p0))
+        e[i] = h[i]
+        fd[i] = (mod.lprob(p0 + e) - mod.lprob(p0 - e))/(2*h[i])
+
+    assert np.allclose(grad, fd, rtol=1e-4, atol=1e-4)
@@ -0,0 +1,21 @@
+import numpy as np
+import pandas as pd
+from pydsge import DSGE, example
+
+
+def test_means_only_matches_rts_smoother():
+
+    yaml, data = example
+    mod = DSGE.read(yaml)
+    data = pd.read_csv(data, index_col='date', parse_dates=True)
+    # some missing observations
+    mod.load_data(data.mask(np.random.RandomState(0).rand(*data.shape) < .2))
+    mod.prep_estim(linear=True, ncores=0, verbose=False)
+    mod.set_par('init')
+
+    mod.filter.P = mod.filter.init_P.copy()
+    means, _ = mod.run_filter(verbose=False)
+    mod.filter.P = mod.filter.init_P.copy()
+    means_only = mod.run_filter(means_only=True, verbose=False)
+
+    assert np.allclose(means, means_only, atol=1e-10)
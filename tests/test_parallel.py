@@ -0,0 +1,27 @@
+import time
+from pydsge import DSGE, example
+from pydsge.parallel import ModelPool, WorkerTask
+
+
+def nap(model, x):
+    time.sleep(x)
+    return x
+
+
+def test_limited_pool_kills_wrapped_tasks():
+
+    mod = DSGE.read(example[0])
+    pool = ModelPool(mod, 2)
+    task = WorkerTask(mod, nap)
+
+    # like emcee and cmaes, wrap the task such that its own limit is not visible to the pool
+    def wrapped(x):
+        return task(x)
+
+    st = time.time()
+    res = pool.limited(1, fallback=-1).map(wrapped, [0, 60, 0])
+    pool.close()
+
+    assert res == [0, -1, 0]
+    assert pool.killed == [60]
+    assert time.time() - st < 30
@@ -0,0 +1,22 @@
+import numpy as np
+import pandas as pd
+from pydsge import DSGE, example
+
+
+def test_gfevd_without_parameters():
+
+    yaml, data = example
+    mod = DSGE.read(yaml)
+    mod.load_data(pd.read_csv(data, index_col='date', parse_dates=True))
+    mod.prep_estim(linear=True, ncores=0, verbose=False)
+    mod.set_par('init')
+
+    # extracting without a parameter sample leaves `None` in `pars`
+    eps = mod.extract(verbose=False)
+    assert eps['pars'].dtype == object
+    eps['means'] = mod.run_filter(verbose=False)[0]
+
+    vd = mod.gfevd(eps, nsamples=20, verbose=False)
+
+    assert vd.shape == (len(mod.shocks), len(mod.vv))
+    assert np.allclose(vd.sum(axis=0), 1)